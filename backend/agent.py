@@ -1,26 +1,107 @@
-import google.generativeai as genai
+import asyncio
 import os
-from file_loader import load_all_data, search_items, get_item_by_id
-import pandas as pd
-import json
+import threading
+from file_loader import load_all_data, search_items, get_item_by_id, snapshot_for, get_catalog, get_item_index, get_item_json, catalog_version_of
+from search_engine import get_columns
+from catalog_db import CatalogDatabase, DatabaseQueryMatcher
+from matcher import QueryMatcher
+from llm import ModelOverloaded, generate_text, generate_text_async, stream_text_async
+from response_cache import response_cache, response_cache_key
+from session_store import create_session_store
+from prompt_builder import assemble_prompt, get_item_lines, render_conversation
+from context_selector import estimate_tokens, select_context_items
+from fast_path import fast_path_answer, find_sku, parse_max_price
 from dotenv import load_dotenv
-import re
 from datetime import datetime
 from typing import Dict, List, Any
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set up Gemini client
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if gemini_api_key:
-    genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash-exp')
-else:
-    model = None
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+# Queries of one batch (/query/batch) answered at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# What a query gets when its model call is shed by the concurrency limiter:
+# "fallback" - the catalog-only answer used when there is no model
+# "reject"   - ModelOverloaded is raised (the API answers 429)
+OVERLOAD_RESPONSE = os.getenv("OVERLOAD_RESPONSE", "fallback").lower()
 
-# Conversation memory storage (session_id -> conversation history)
-conversation_memory: Dict[str, List[Dict[str, Any]]] = {}
+# Gemini client, created by get_model() on first use (or during server start-up)
+# so importing this module doesn't pay for importing the Google SDK
+model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+def get_model():
+    """
+    Get the Gemini model client, creating it on first call
+    
+    Returns:
+    - The model, or None when GEMINI_API_KEY isn't set
+    """
+    global model, _model_loaded
+    if _model_loaded or model is not None:
+        return model
+    with _model_lock:
+        if not _model_loaded and model is None:
+            gemini_api_key = os.getenv("GEMINI_API_KEY")
+            if gemini_api_key:
+                import google.generativeai as genai
+                genai.configure(api_key=gemini_api_key)
+                model = genai.GenerativeModel(GEMINI_MODEL)
+        _model_loaded = True
+    return model
+
+# Conversation memory storage (session_id -> conversation history), in memory
+# or shared between workers in SQLite depending on SESSION_BACKEND
+conversation_memory = create_session_store()
+
+# Product category searches (keywords are tried in this order)
+CATEGORIES = {
+    "electronics": ["laptop", "tablet", "computer", "phone", "headphones", "earbuds", "speaker"],
+    "office supplies": ["stapler", "paper", "pen", "pencil", "notebook", "binder"],
+    "clothing": ["shirt", "pants", "jacket", "hoodie", "sweater", "yoga"]
+}
+CATEGORY_KEYWORDS = [keyword for keywords in CATEGORIES.values() for keyword in keywords]
+
+def get_query_matcher(items_data):
+    """
+    Get the keyword/item name matcher for items_data
+    
+    The matcher for the cached catalog is built once per catalog version.
+    """
+    if isinstance(items_data, CatalogDatabase):
+        return items_data.derived("query_matcher", lambda database: DatabaseQueryMatcher(database, CATEGORY_KEYWORDS))
+    snapshot = snapshot_for(items_data)
+    if snapshot is not None and snapshot.compiled is not None:
+        # The distinct names are stored in the file, only the automaton is built here
+        return snapshot.derived("query_matcher", lambda snap: QueryMatcher(snap.items, CATEGORY_KEYWORDS,
+                                                                           snap.compiled.distinct_names()))
+    if snapshot is not None:
+        return snapshot.derived("query_matcher", lambda snap: QueryMatcher(snap.items, CATEGORY_KEYWORDS))
+    return QueryMatcher(items_data, CATEGORY_KEYWORDS)
+
+def warm_catalog():
+    """
+    Load the catalog and build everything derived from it (search columns and
+    text index, ID index, item JSON, query matcher, prompt lines) so no request pays for it.
+    
+    Returns:
+    - The warmed CatalogSnapshot (or CatalogDatabase, whose indexes live on disk)
+    """
+    snapshot = get_catalog()
+    if isinstance(snapshot, CatalogDatabase):
+        return snapshot
+    get_columns(snapshot).sorted_index('price')
+    get_item_index(snapshot)
+    get_item_json(snapshot)
+    get_query_matcher(snapshot.items)
+    if snapshot.compiled is None:
+        # Items of a compiled catalog are built on access, their lines can't be cached ahead
+        lines = get_item_lines(snapshot.items)
+        for item in snapshot.items:
+            lines.details(item)
+    return snapshot
 
 def find_relevant_items(query, items_data):
     """
@@ -39,46 +120,35 @@ def find_relevant_items(query, items_data):
     
     # Handle direct ID queries
     if "sku" in query_lower:
-        sku_pattern = r'SKU\d{7}'
-        match = re.search(sku_pattern, query, re.IGNORECASE)
-        if match:
-            item_id = match.group(0)
+        item_id = find_sku(query)
+        if item_id:
             item = get_item_by_id(items_data, item_id)
             if item:
                 result["item_data"] = item
                 return result
     
     # Handle price range queries
-    price_range_pattern = r'under\s+\$?(\d+)|less\s+than\s+\$?(\d+)|cheaper\s+than\s+\$?(\d+)'
-    match = re.search(price_range_pattern, query_lower)
-    if match:
-        max_price = int(next(filter(None, match.groups())))
-        results = search_items(items_data, max_price=max_price, sort_by='price')
+    max_price = parse_max_price(query_lower)
+    if max_price is not None:
+        results = search_items(items_data, max_price=max_price, sort_by='price', limit=5)
         if results:
-            result["items"] = results[:5]
+            result["items"] = results
             return result
     
-    # Handle product category searches
-    categories = {
-        "electronics": ["laptop", "tablet", "computer", "phone", "headphones", "earbuds", "speaker"],
-        "office supplies": ["stapler", "paper", "pen", "pencil", "notebook", "binder"],
-        "clothing": ["shirt", "pants", "jacket", "hoodie", "sweater", "yoga"]
-    }
+    # Find category keywords and item names mentioned in the query in one scan
+    keywords, named_item = get_query_matcher(items_data).match(query_lower)
     
-    for category, keywords in categories.items():
-        for keyword in keywords:
-            if keyword in query_lower:
-                results = search_items(items_data, search_query=keyword)
-                if results:
-                    result["items"] = results[:5]
-                    return result
+    # Handle product category searches
+    for keyword in keywords:
+        results = search_items(items_data, search_query=keyword, limit=5)
+        if results:
+            result["items"] = results
+            return result
     
     # Check for specific item names in the query
-    for item in items_data:
-        item_name_lower = item['item_name'].lower()
-        if item_name_lower in query_lower:
-            result["item_data"] = item
-            return result
+    if named_item is not None:
+        result["item_data"] = named_item
+        return result
     
     # No specific matches found
     return None
@@ -94,11 +164,9 @@ def get_conversation_history(session_id: str, max_entries: int = 5) -> List[Dict
     Returns:
     - List of conversation entries
     """
-    if session_id not in conversation_memory:
-        conversation_memory[session_id] = []
-    
-    # Return the most recent entries (limited by max_entries)
-    return conversation_memory[session_id][-max_entries:]
+    # Return the most recent entries (limited by max_entries); unknown sessions
+    # get an empty history without being created
+    return conversation_memory.get_history(session_id, max_entries)
 
 
 def add_to_conversation_history(session_id: str, role: str, content: Any, context: Dict[str, Any] = None):
@@ -111,9 +179,6 @@ def add_to_conversation_history(session_id: str, role: str, content: Any, contex
     - content: The message content
     - context: Optional context data (like item details)
     """
-    if session_id not in conversation_memory:
-        conversation_memory[session_id] = []
-    
     # Create the conversation entry
     entry = {
         "role": role,
@@ -125,12 +190,8 @@ def add_to_conversation_history(session_id: str, role: str, content: Any, contex
     if context:
         entry["context"] = context
     
-    # Add to memory
-    conversation_memory[session_id].append(entry)
-    
-    # Limit the size of conversation history (keep last 10 entries)
-    if len(conversation_memory[session_id]) > 10:
-        conversation_memory[session_id] = conversation_memory[session_id][-10:]
+    # Add to memory (the store keeps the last 10 entries per session)
+    conversation_memory.append(session_id, entry)
 
 
 def extract_item_context(result):
@@ -150,14 +211,16 @@ def extract_item_context(result):
     return context if context else None
 
 
-def handle_query(query, session_id="default"):
+def prepare_query(query, session_id):
     """
-    Main function to handle user queries about items with conversation memory
-    All queries now go through the API for natural responses
+    Record the user query and collect everything needed to answer it
     
     Parameters:
     - query: User's query text
     - session_id: Unique identifier for the user session
+    
+    Returns:
+    - Tuple of (items_data, conversation_history, context)
     """
     # Load items data
     items_data = load_all_data()
@@ -172,155 +235,381 @@ def handle_query(query, session_id="default"):
     relevant_items_result = find_relevant_items(query, items_data)
     context = extract_item_context(relevant_items_result) if relevant_items_result else None
     
+    return items_data, conversation_history, context
+
+
+async def run_blocking(function, *args):
+    """
+    Run a blocking call (catalog loading, session reads and writes) in the
+    default thread pool so it doesn't hold up the event loop
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def answer_cache_key(query, items_data, conversation_history, context):
+    """
+    Get the response cache key and catalog version for a query
+    
+    Returns:
+    - Tuple of (key, catalog_version)
+    """
+    catalog_version = catalog_version_of(items_data)
+    return response_cache_key(query, context, conversation_history, catalog_version), catalog_version
+
+
+def build_prompt(query, items_data, conversation_history, context):
+    """
+    Build the prompt for the AI from the query, conversation history and item context
+    """
+    # Extract context from recent conversation
+    current_context = {}
+    
+    # Look for recent items in conversation history
+    for entry in reversed(conversation_history):
+        if "context" in entry and entry["context"]:
+            if "current_item" in entry["context"] and not current_context.get("current_item"):
+                current_context["current_item"] = entry["context"]["current_item"]
+            
+            if "item_list" in entry["context"] and not current_context.get("item_list"):
+                current_context["item_list"] = entry["context"]["item_list"]
+        
+        # Stop once we have enough context
+        if "current_item" in current_context and "item_list" in current_context:
+            break
+    
+    # If we have new context from this query, update current_context
+    if context:
+        if "current_item" in context and not current_context.get("current_item"):
+            current_context["current_item"] = context["current_item"]
+        if "item_list" in context and not current_context.get("item_list"):
+            current_context["item_list"] = context["item_list"]
+    
+    # Item lines are pre-rendered once per catalog version
+    lines = get_item_lines(items_data)
+    items_info = []
+    
+    # Include current item from context first if available
+    if current_context.get("current_item"):
+        items_info.append("[CURRENTLY DISCUSSING] Item: ")
+        items_info.append(lines.details(current_context["current_item"]))
+    
+    # Include recently discussed items if available
+    if current_context.get("item_list"):
+        for i, item in enumerate(current_context["item_list"]):
+            items_info.append(f"Recent Item {i+1}: ")
+            items_info.append(lines.summary(item))
+    
+    # Include general items as well (avoiding duplicates)
+    already_included_ids = set()
+    if current_context.get("current_item"):
+        already_included_ids.add(current_context["current_item"]["item_id"])
+    if current_context.get("item_list"):
+        for item in current_context["item_list"]:
+            already_included_ids.add(item["item_id"])
+    
+    # Add the catalog items most relevant to the query, within the token budget
+    used_tokens = sum(estimate_tokens(line) for line in items_info)
+    for item in select_context_items(query, items_data, already_included_ids, used_tokens, lines.details):
+        items_info.append("Item: ")
+        items_info.append(lines.details(item))
+    
+    # Create prompt for the AI with conversation context
+    return assemble_prompt(query, render_conversation(conversation_history), items_info)
+
+
+def complete_query(query, session_id, ai_response, context):
+    """
+    Record the AI's answer and build the JSON response with both AI text AND relevant items
+    """
+    # Add assistant response to conversation history
+    add_to_conversation_history(session_id, "assistant", ai_response, context)
+    
+    # Create a JSON response with both AI text AND relevant items
+    result = {
+        "response": ai_response,
+        "query": query,
+        "format": "text"
+    }
+    
+    # Include item data if available
+    if context:
+        if "current_item" in context:
+            result["item_data"] = context["current_item"]
+        if "item_list" in context:
+            result["items"] = context["item_list"]
+    
+    return result
+
+
+def error_query_result(query, session_id, error):
+    """
+    Record and return the apology sent when the AI call fails
+    """
+    error_response = f"I apologize, but I encountered an error: {str(error)}. Please try again with a more specific query."
+    
+    # Add error response to conversation history
+    add_to_conversation_history(session_id, "assistant", error_response)
+    
+    return {
+        "response": error_response,
+        "query": query,
+        "format": "text"
+    }
+
+
+def fallback_query_result(query, session_id, items_data):
+    """
+    Answer without an AI model: provide useful information about featured items
+    """
+    featured_items = items_data[:5]  # Get 5 items to feature
+    items_text = "\n".join([
+        f"- {item['item_name']} (${item['price']:.2f})" +
+        (f" - {item['maximum_discount']*100:.0f}% discount available!" if item.get('maximum_discount', 0) > 0 else "") 
+        for item in featured_items
+    ])
+    
+    fallback_response = f"I can help you find items in our inventory. Here are some featured products:\n\n{items_text}\n\nHow can I assist you today?"
+    
+    # Add fallback response to conversation history
+    add_to_conversation_history(session_id, "assistant", fallback_response, {"item_list": featured_items})
+    
+    return {
+        "response": fallback_response,
+        "query": query,
+        "items": featured_items,
+        "format": "text"
+    }
+
+
+def overloaded_query_result(query, session_id, items_data, error):
+    """
+    Answer a query whose model call was shed: the catalog-only fallback
+    answer, or (OVERLOAD_RESPONSE=reject) re-raise the ModelOverloaded error
+    """
+    if OVERLOAD_RESPONSE != "fallback":
+        raise error
+    print(f"Model overloaded, answering from the catalog: {error}")
+    result = fallback_query_result(query, session_id, items_data)
+    result["degraded"] = True
+    return result
+
+
+def fast_path_result(query, session_id, context):
+    """
+    Answer a structured catalog question (price, discount, stock, price range)
+    from the catalog with templated text, without the model (see FAST_PATH_INTENTS)
+    
+    Returns:
+    - The result dictionary, marked with its "fast_path" intent, or None when the model should answer
+    """
+    answer = fast_path_answer(query, context, CATEGORY_KEYWORDS)
+    if answer is None:
+        return None
+    intent, response = answer
+    result = complete_query(query, session_id, response, context)
+    result["fast_path"] = intent
+    return result
+
+
+def handle_query(query, session_id="default"):
+    """
+    Main function to handle user queries about items with conversation memory
+    All queries now go through the API for natural responses
+    
+    Blocks while the model generates its answer; use handle_query_async from
+    async code (like the FastAPI endpoints).
+    
+    Parameters:
+    - query: User's query text
+    - session_id: Unique identifier for the user session
+    """
+    items_data, conversation_history, context = prepare_query(query, session_id)
+    
+    # Structured questions are answered straight from the catalog when enabled
+    result = fast_path_result(query, session_id, context)
+    if result is not None:
+        return result
+    
+    ai_model = get_model()
+    
     # Use AI to handle all queries with context
-    if model:
+    if ai_model:
         try:
-            # Extract context from recent conversation
-            current_context = {}
-            recent_items = []
-            
-            # Look for recent items in conversation history
-            for entry in reversed(conversation_history):
-                if "context" in entry and entry["context"]:
-                    if "current_item" in entry["context"] and not current_context.get("current_item"):
-                        current_context["current_item"] = entry["context"]["current_item"]
-                    
-                    if "item_list" in entry["context"] and not current_context.get("item_list"):
-                        current_context["item_list"] = entry["context"]["item_list"]
-                
-                # Stop once we have enough context
-                if "current_item" in current_context and "item_list" in current_context:
-                    break
-            
-            # If we have new context from this query, update current_context
-            if context:
-                if "current_item" in context and not current_context.get("current_item"):
-                    current_context["current_item"] = context["current_item"]
-                if "item_list" in context and not current_context.get("item_list"):
-                    current_context["item_list"] = context["item_list"]
-            
-            # Convert conversation history to string format
-            conversation_text = ""
-            for entry in conversation_history:
-                if entry["role"] == "user":
-                    conversation_text += f"Customer: {entry['content']}\n"
-                else:
-                    # Truncate long responses
-                    response = entry['content']
-                    if len(response) > 200:
-                        response = response[:197] + "..."
-                    conversation_text += f"Assistant: {response}\n"
-            
-            # Prepare items information for the AI
-            items_info = ""
-            
-            # Include current item from context first if available
-            if current_context.get("current_item"):
-                item = current_context["current_item"]
-                items_info += (f"[CURRENTLY DISCUSSING] Item: ID={item['item_id']}, Name={item['item_name']}, "
-                             f"Price=${item['price']:.2f}, Quantity={item['item_quantity']}, "
-                             f"Description={item.get('item_description', 'No description available')}, "
-                             f"Discount={item['maximum_discount']*100:.0f}%\n")
-            
-            # Include recently discussed items if available
-            if current_context.get("item_list"):
-                for i, item in enumerate(current_context["item_list"]):
-                    items_info += (f"Recent Item {i+1}: ID={item['item_id']}, Name={item['item_name']}, "
-                                 f"Price=${item['price']:.2f}, "
-                                 f"Description={item.get('item_description', 'No description available')}, "
-                                 f"Discount={item.get('maximum_discount', 0)*100:.0f}%\n")
-            
-            # Include general items as well (avoiding duplicates)
-            already_included_ids = set()
-            if current_context.get("current_item"):
-                already_included_ids.add(current_context["current_item"]["item_id"])
-            if current_context.get("item_list"):
-                for item in current_context["item_list"]:
-                    already_included_ids.add(item["item_id"])
-            
-            # Add additional items for context
-            for i, item in enumerate(items_data[:15]):  # Limit to 15 additional items
-                if item["item_id"] not in already_included_ids:
-                    items_info += (f"Item: ID={item['item_id']}, Name={item['item_name']}, "
-                                  f"Price=${item['price']:.2f}, Quantity={item['item_quantity']}, "
-                                  f"Description={item.get('item_description', 'No description available')}, "
-                                  f"Discount={item.get('maximum_discount', 0)*100:.0f}%\n")
-            
-            # Create prompt for the AI with conversation context
-            prompt = f"""
-You are a helpful sales assistant for an e-commerce store. Based on the query and conversation history,
-help the customer find products they're looking for or answer questions about our inventory.
-
-CONVERSATION HISTORY:
-{conversation_text}
-
-CURRENT CUSTOMER QUERY: {query}
-
-ITEMS INFORMATION:
-{items_info}
-
-INSTRUCTIONS:
-1. If the customer is asking about an item already mentioned in the conversation, use that context.
-2. If the query refers to "it", "this item", "that product", etc., assume they are talking about the item marked [CURRENTLY DISCUSSING].
-3. If the customer is asking about price, features, availability, or discounts, look for the relevant item in the context.
-4. Be concise, helpful, and specific in your recommendations.
-5. ALWAYS mention the exact discount percentage when discussing an item that has a discount.
-6. ALWAYS include the item description in your response when focusing on a specific item.
-7. If answering a follow-up question about a specific item, always mention the item name for clarity.
-8. When discussing prices, always format them as $XX.XX with two decimal places.
-"""
-            response = model.generate_content(prompt)
-            
-            # Extract the AI's response
-            ai_response = response.text.strip()
-            
-            # Add assistant response to conversation history
-            add_to_conversation_history(session_id, "assistant", ai_response, context)
-            
-            # Create a JSON response with both AI text AND relevant items
-            result = {
-                "response": ai_response,
-                "query": query,
-                "format": "text"
-            }
-            
-            # Include item data if available
-            if context:
-                if "current_item" in context:
-                    result["item_data"] = context["current_item"]
-                if "item_list" in context:
-                    result["items"] = context["item_list"]
-            
-            return result
-            
+            # Identical questions in the same context are answered from the cache
+            key, catalog_version = answer_cache_key(query, items_data, conversation_history, context)
+            ai_response = response_cache.get(key, catalog_version)
+            if ai_response is None:
+                prompt = build_prompt(query, items_data, conversation_history, context)
+                ai_response = generate_text(ai_model, prompt)
+                response_cache.put(key, catalog_version, ai_response)
+            return complete_query(query, session_id, ai_response, context)
         except Exception as e:
-            error_response = f"I apologize, but I encountered an error: {str(e)}. Please try again with a more specific query."
-            
-            # Add error response to conversation history
-            add_to_conversation_history(session_id, "assistant", error_response)
-            
-            return {
-                "response": error_response,
-                "query": query,
-                "format": "text"
-            }
+            return error_query_result(query, session_id, e)
     else:
         # Even without an AI model, we can provide useful information about items
-        featured_items = items_data[:5]  # Get 5 items to feature
-        items_text = "\n".join([
-            f"- {item['item_name']} (${item['price']:.2f})" +
-            (f" - {item['maximum_discount']*100:.0f}% discount available!" if item.get('maximum_discount', 0) > 0 else "") 
-            for item in featured_items
-        ])
-        
-        fallback_response = f"I can help you find items in our inventory. Here are some featured products:\n\n{items_text}\n\nHow can I assist you today?"
-        
-        # Add fallback response to conversation history
-        add_to_conversation_history(session_id, "assistant", fallback_response, {"item_list": featured_items})
-        
-        return {
-            "response": fallback_response,
-            "query": query,
-            "items": featured_items,
-            "format": "text"
-        }
+        return fallback_query_result(query, session_id, items_data)
+
+
+async def handle_query_async(query, session_id="default"):
+    """
+    Async version of handle_query that doesn't block the event loop
+    
+    The model call goes through the async client (or a bounded thread pool),
+    is limited by the adaptive concurrency limiter and times out after
+    MODEL_TIMEOUT_SECONDS. A call the limiter sheds gets the catalog-only
+    fallback answer (or raises ModelOverloaded, see OVERLOAD_RESPONSE).
+    Catalog loading, prompt building (which queries the SQLite catalog) and
+    conversation reads and writes run in the thread pool.
+    
+    Parameters:
+    - query: User's query text
+    - session_id: Unique identifier for the user session
+    """
+    items_data, conversation_history, context = await run_blocking(prepare_query, query, session_id)
+    result = await run_blocking(fast_path_result, query, session_id, context)
+    if result is not None:
+        return result
+    
+    ai_model = get_model()
+    
+    if ai_model:
+        try:
+            key, catalog_version = await run_blocking(answer_cache_key, query, items_data, conversation_history,
+                                                     context)
+            ai_response = response_cache.get(key, catalog_version)
+            if ai_response is None:
+                # Ranking context items queries the SQLite catalog
+                prompt = await run_blocking(build_prompt, query, items_data, conversation_history, context)
+                ai_response = await generate_text_async(ai_model, prompt)
+                response_cache.put(key, catalog_version, ai_response)
+            return await run_blocking(complete_query, query, session_id, ai_response, context)
+        except ModelOverloaded as e:
+            return await run_blocking(overloaded_query_result, query, session_id, items_data, e)
+        except Exception as e:
+            return await run_blocking(error_query_result, query, session_id, e)
+    else:
+        return await run_blocking(fallback_query_result, query, session_id, items_data)
+
+
+async def handle_query_batch_async(requests, concurrency=None):
+    """
+    Answer several queries concurrently with handle_query_async
+    
+    Queries of the same session run one after another, in order, so each
+    sees the earlier answers in its history; different sessions run in
+    parallel, at most concurrency queries at a time (the model calls also
+    share the global MAX_CONCURRENT_MODEL_CALLS limit).
+    
+    Parameters:
+    - requests: List of (query, session_id) pairs
+    - concurrency: Maximum queries in progress (default BATCH_CONCURRENCY)
+    
+    Returns:
+    - List with, for each request, its result dictionary or the exception it raised
+    """
+    slots = asyncio.Semaphore(concurrency or BATCH_CONCURRENCY)
+    results = [None] * len(requests)
+    sessions = {}
+    for index, (query, session_id) in enumerate(requests):
+        sessions.setdefault(session_id, []).append(index)
+    
+    async def run_session(indexes):
+        for index in indexes:
+            query, session_id = requests[index]
+            async with slots:
+                try:
+                    results[index] = await handle_query_async(query, session_id=session_id)
+                except Exception as e:
+                    print(f"Batch query {index} failed: {e}")
+                    results[index] = e
+    
+    await asyncio.gather(*(run_session(indexes) for indexes in sessions.values()))
+    return results
+
+
+def context_event(query, context):
+    """
+    First event of a streamed answer: the item context the answer is about
+    """
+    event = {"type": "context", "query": query}
+    if context:
+        if "current_item" in context:
+            event["item_data"] = context["current_item"]
+        if "item_list" in context:
+            event["items"] = context["item_list"]
+    return event
+
+
+async def stream_query_async(query, session_id="default"):
+    """
+    Handle a user query, yielding the answer as it is generated
+    
+    Yields event dictionaries:
+    - {"type": "context", ...}: item_data/items for the query, sent first
+    - {"type": "delta", "text": ...}: the next piece of the AI's answer
+    - {"type": "done", "response": ...}: the full answer, once the stream ends
+    - {"type": "error", "response": ...}: the apology sent if the AI call fails
+    
+    Conversation memory is updated when the stream ends.
+    
+    Parameters:
+    - query: User's query text
+    - session_id: Unique identifier for the user session
+    """
+    items_data, conversation_history, context = await run_blocking(prepare_query, query, session_id)
+    
+    result = await run_blocking(fast_path_result, query, session_id, context)
+    if result is not None:
+        yield context_event(query, context)
+        yield {"type": "delta", "text": result["response"]}
+        yield {"type": "done", "response": result["response"], "fast_path": result["fast_path"]}
+        return
+    
+    ai_model = get_model()
+    
+    if not ai_model:
+        result = await run_blocking(fallback_query_result, query, session_id, items_data)
+        yield context_event(query, {"item_list": result["items"]})
+        yield {"type": "delta", "text": result["response"]}
+        yield {"type": "done", "response": result["response"]}
+        return
+    
+    yield context_event(query, context)
+    
+    key, catalog_version = await run_blocking(answer_cache_key, query, items_data, conversation_history, context)
+    ai_response = response_cache.get(key, catalog_version)
+    if ai_response is not None:
+        yield {"type": "delta", "text": ai_response}
+        result = await run_blocking(complete_query, query, session_id, ai_response, context)
+        yield {"type": "done", "response": result["response"]}
+        return
+    
+    chunks = []
+    try:
+        prompt = await run_blocking(build_prompt, query, items_data, conversation_history, context)
+        async for text in stream_text_async(ai_model, prompt):
+            if not chunks:
+                # Match the stripped text of non-streamed answers
+                text = text.lstrip()
+                if not text:
+                    continue
+            chunks.append(text)
+            yield {"type": "delta", "text": text}
+    except ModelOverloaded as e:
+        # Shed before any text was sent
+        if OVERLOAD_RESPONSE != "fallback":
+            yield {"type": "error", "response": f"The assistant is busy right now, please try again shortly. ({e})"}
+            return
+        result = await run_blocking(overloaded_query_result, query, session_id, items_data, e)
+        yield {"type": "delta", "text": result["response"]}
+        yield {"type": "done", "response": result["response"], "degraded": True}
+        return
+    except Exception as e:
+        result = await run_blocking(error_query_result, query, session_id, e)
+        yield {"type": "error", "response": result["response"]}
+        return
+    
+    ai_response = "".join(chunks).strip()
+    response_cache.put(key, catalog_version, ai_response)
+    result = await run_blocking(complete_query, query, session_id, ai_response, context)
+    yield {"type": "done", "response": result["response"]}
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the agent's per-request work (no model calls)
+
+Run from the backend directory:
+    python bench_agent.py
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import agent
+import context_selector
+from file_loader import load_all_data
+from session_store import SessionStore, SQLiteSessionStore
+from test_agent import reference_build_prompt
+
+
+def timeit(func, repeat=2000):
+    """Return the average time per call in microseconds"""
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1_000_000 / repeat
+
+
+def peak_allocation(func):
+    """Return the peak memory (bytes) allocated while func runs"""
+    func()  # warm up (per-version caches are built here)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return peak
+
+
+def bench_prompt():
+    """Prompt build time and allocations per request: f-string += vs pre-rendered lines"""
+    items = load_all_data()
+    query = "What is the price of that binder?"
+    history = [
+        {"role": "user", "content": "Do you have any binders?"},
+        {"role": "assistant", "content": "Yes! " * 60, "context": {"item_list": list(items[19:24])}},
+    ]
+    context = {"current_item": items[19]}
+
+    old = lambda: reference_build_prompt(query, items, history, context)
+    new = lambda: agent.build_prompt(query, items, history, context)
+
+    # Same items in both prompts, so only the assembly differs
+    original = context_selector.CONTEXT_SELECTION
+    context_selector.CONTEXT_SELECTION = "first"
+    try:
+        assert old() == new()
+        print("📝 Prompt build per request")
+        print("-" * 40)
+        print(f"   prompt size          : {len(new()):8,} chars")
+        print(f"   f-string +=          : {timeit(old):8.1f} µs | peak alloc {peak_allocation(old):8,} B")
+        print(f"   pre-rendered + join  : {timeit(new):8.1f} µs | peak alloc {peak_allocation(new):8,} B")
+    finally:
+        context_selector.CONTEXT_SELECTION = original
+    print(f"   relevance selection  : {timeit(new):8.1f} µs | peak alloc {peak_allocation(new):8,} B")
+
+
+# Conversations from test_conversation.py plus common single questions
+REGRESSION_QUERIES = [
+    "Do you have any binders?",
+    "What is the price of that binder?",
+    "What is the maximum discount available?",
+    "Tell me about laptops under $500",
+    "Which one has the best specs?",
+    "I need a stapler and some paper",
+    "What yoga pants do you sell?",
+    "Hello!",
+]
+
+
+def prompt_tokens(selection):
+    """Estimated prompt tokens per query when replaying REGRESSION_QUERIES as one session"""
+    context_selector.CONTEXT_SELECTION = selection
+    items = load_all_data()
+    history, tokens = [], []
+    for query in REGRESSION_QUERIES:
+        result = agent.find_relevant_items(query, items)
+        context = agent.extract_item_context(result) if result else None
+        tokens.append(context_selector.estimate_tokens(agent.build_prompt(query, items, history[-5:], context)))
+        history.append({"role": "user", "content": query})
+        history.append({"role": "assistant", "content": "Here is what I found. " * 5, "context": context})
+    return tokens
+
+
+def bench_context_selection():
+    """Prompt size: first 15 catalog rows vs relevance-ranked, token-budgeted selection"""
+    print("\n🎯 Prompt tokens per turn (estimated)")
+    print("-" * 40)
+    original = context_selector.CONTEXT_SELECTION
+    try:
+        first = prompt_tokens("first")
+        relevance = prompt_tokens("relevance")
+    finally:
+        context_selector.CONTEXT_SELECTION = original
+    for query, old, new in zip(REGRESSION_QUERIES, first, relevance):
+        print(f"   {query[:38]:38} {old:6} -> {new:6}")
+    print(f"   {'total':38} {sum(first):6} -> {sum(relevance):6}"
+          f"  ({100 * (1 - sum(relevance) / sum(first)):.0f}% fewer tokens)")
+
+
+def bench_sessions(turns=2000, sessions=200):
+    """Per-turn conversation store overhead: read last 5 entries, append query and answer"""
+    print("\n💬 Session store per chat turn")
+    print("-" * 40)
+    item = load_all_data()[19]
+    tmp_dir = tempfile.mkdtemp()
+    stores = [
+        ("in-memory", SessionStore()),
+        ("sqlite, batched writes", SQLiteSessionStore(os.path.join(tmp_dir, "batched.db"))),
+        ("sqlite, commit per write", SQLiteSessionStore(os.path.join(tmp_dir, "unbatched.db"), batch_size=1)),
+    ]
+    for label, store in stores:
+        start = time.perf_counter()
+        for turn in range(turns):
+            session_id = f"session-{turn % sessions}"
+            store.get_history(session_id, 5)
+            store.append(session_id, {"role": "user", "content": "What is the price of that binder?"})
+            store.append(session_id, {"role": "assistant", "content": "The Dura Binder is $21.31.",
+                                      "context": {"current_item": item}})
+        store.flush()
+        per_turn = (time.perf_counter() - start) * 1_000_000 / turns
+        print(f"   {label:26} {per_turn:8.1f} µs/turn")
+
+
+if __name__ == "__main__":
+    print("⏱️ Agent Benchmarks")
+    print("=" * 40)
+    bench_prompt()
+    bench_context_selection()
+    bench_sessions()
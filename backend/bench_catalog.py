@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the catalog layer (file_loader)
+
+Run from the backend directory:
+    python bench_catalog.py
+"""
+
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import catalog_db
+import catalog_store
+import file_loader
+from search_engine import CatalogColumns
+
+
+def timeit(func, repeat=20):
+    """Return the average time per call in milliseconds"""
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def bench_load():
+    """Per-request catalog load cost: parsing Items.xlsx vs the cached snapshot"""
+    print("📦 Catalog load per request")
+    print("-" * 40)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        parse_ms = timeit(lambda: file_loader.load_items_data(), repeat=10)
+    cached_ms = timeit(lambda: file_loader.load_all_data(), repeat=10000)
+
+    print(f"   read_excel + to_dict : {parse_ms:10.3f} ms")
+    print(f"   cached snapshot      : {cached_ms:10.5f} ms")
+    print(f"   speed-up             : {parse_ms / cached_ms:10.0f}x")
+
+
+def bench_cold_start(sizes=(10_000, 100_000, 1_000_000)):
+    """Process start-up: parsing the spreadsheet vs mapping the compiled catalog"""
+    print("\n🧊 Cold start: spreadsheet vs compiled catalog")
+    print("-" * 40)
+
+    items_file = file_loader.ITEMS_FILE
+    with contextlib.redirect_stdout(io.StringIO()):
+        parse_ms = timeit(lambda: file_loader.load_items_data(items_file), repeat=5)
+        signature = (os.stat(items_file).st_mtime_ns, os.stat(items_file).st_size)
+        open_ms = timeit(lambda: catalog_store.open_compiled_catalog(items_file, signature, None), repeat=50)
+    print(f"   Items.xlsx parse     : {parse_ms:10.3f} ms")
+    print(f"   Items.catalog open   : {open_ms:10.3f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            items = make_items(size)
+            path = os.path.join(tmp_dir, f"items-{size}.catalog")
+            catalog_store.write_compiled_catalog(path, items, (0, 0))
+            repeat = max(1, 100_000 // size)
+            map_ms = timeit(lambda: catalog_store.CompiledCatalog(path), repeat=repeat)
+            items_ms = timeit(lambda: catalog_store.CompiledCatalog(path).items(), repeat=repeat)
+            compiled = catalog_store.CompiledCatalog(path)
+            columns_ms = timeit(lambda: CatalogColumns(items), repeat=1)
+            mapped_ms = timeit(lambda: CatalogColumns(items, compiled), repeat=1)
+            print(f"   {size:>9,} items   map {map_ms:7.3f} ms | item dicts {items_ms:8.1f} ms"
+                  f" | search columns {columns_ms:7.0f} ms built, {mapped_ms:7.0f} ms mapped"
+                  f" ({os.path.getsize(path) / 1e6:.0f} MB file)")
+
+
+def make_items(count, seed=42):
+    """Build a synthetic catalog by recombining the rows of Items.xlsx"""
+    rng = random.Random(seed)
+    base = file_loader.load_all_data()
+    items = []
+    for i in range(count):
+        template = base[i % len(base)]
+        items.append({
+            "item_id": f"SKU{i:07d}",
+            "item_name": template["item_name"],
+            "item_description": template["item_description"],
+            "item_quantity": rng.randint(0, 1000),
+            "price": round(rng.uniform(5, 500), 2),
+            "maximum_discount": template["maximum_discount"],
+        })
+    return items
+
+
+SEARCH_BENCH_CASES = [
+    ("substring 'binder'", {"search_query": "binder"}),
+    ("price <= 50, by price", {"max_price": 50, "sort_by": "price"}),
+    ("20 <= price <= 100", {"min_price": 20, "max_price": 100}),
+    ("20 <= price <= 25", {"min_price": 20, "max_price": 25}),
+    ("'yoga' by name", {"search_query": "yoga", "sort_by": "item_name"}),
+]
+
+
+def bench_search(sizes=(10_000, 100_000, 1_000_000)):
+    """search_items list scan vs the columnar engine at several catalog sizes"""
+    print("\n🔎 search_items: list scan vs columnar engine")
+    print("-" * 40)
+
+    for size in sizes:
+        items = make_items(size)
+        start = time.perf_counter()
+        columns = CatalogColumns(items)
+        build_ms = (time.perf_counter() - start) * 1000
+        print(f"\n   {size:,} items (one-off column build: {build_ms:.0f} ms)")
+
+        repeat = max(1, 100_000 // size)
+        for label, case in SEARCH_BENCH_CASES:
+            scan_ms = timeit(lambda: file_loader.search_items(items, **case), repeat=repeat)
+            columnar_ms = timeit(lambda: columns.search(**case), repeat=repeat)
+            top5_ms = timeit(lambda: columns.search(limit=5, **case), repeat=repeat)
+            print(f"   {label:24} scan {scan_ms:9.2f} ms | columnar {columnar_ms:8.2f} ms"
+                  f" | top-5 {top5_ms:7.2f} ms")
+
+
+def bench_lookup(sizes=(10_000, 100_000, 1_000_000)):
+    """get_item_by_id linear scan vs the item ID index"""
+    print("\n🆔 get_item_by_id: linear scan vs index")
+    print("-" * 40)
+
+    for size in sizes:
+        items = make_items(size)
+        snapshot = file_loader.CatalogSnapshot(1, items, "synthetic", None, None)
+        wanted = items[-1]["item_id"]
+        file_loader.get_item_index(snapshot)  # built once per catalog version
+        scan_ms = timeit(lambda: file_loader.get_item_by_id(items, wanted), repeat=3)
+        index_ms = timeit(lambda: file_loader.get_item_by_id(snapshot, wanted), repeat=10000)
+        print(f"   {size:>9,} items   scan {scan_ms:9.3f} ms | index {index_ms:8.5f} ms")
+
+
+MEMORY_PROBE = """
+import sys
+import catalog_db, catalog_store, file_loader
+from search_engine import get_columns
+backend, path = sys.argv[1], sys.argv[2]
+if backend == "memory":
+    compiled = catalog_store.CompiledCatalog(path)
+    catalog = file_loader.CatalogSnapshot(1, compiled.items(), path, None, None, compiled)
+    get_columns(catalog)
+else:
+    catalog = catalog_db.CatalogDatabase(path, 1, path)
+file_loader.search_items(catalog, search_query="binder", limit=10)
+file_loader.search_items(catalog, max_price=50, sort_by="price", limit=10)
+# Peak resident memory of this process (ru_maxrss would include the benchmark that spawned it)
+print(next(int(line.split()[1]) for line in open("/proc/self/status") if line.startswith("VmHWM")) / 1024)
+"""
+
+
+def bench_backends(sizes=(10_000, 100_000, 1_000_000)):
+    """In-memory columnar catalog vs the SQLite/FTS5 catalog: latency and resident memory"""
+    print("\n🗄️ Catalog backends: memory vs SQLite")
+    print("-" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            items = make_items(size)
+            db_path = os.path.join(tmp_dir, f"items-{size}.db")
+            start = time.perf_counter()
+            catalog_db.ingest_catalog(db_path, items, (0, 0))
+            ingest_s = time.perf_counter() - start
+            compiled_path = os.path.join(tmp_dir, f"items-{size}.catalog")
+            catalog_store.write_compiled_catalog(compiled_path, items, (0, 0))
+
+            database = catalog_db.CatalogDatabase(db_path, 1, db_path)
+            columns = CatalogColumns(items)
+            print(f"\n   {size:,} items (ingest {ingest_s:.1f} s, database {os.path.getsize(db_path) / 1e6:.0f} MB)")
+            repeat = max(3, 10_000 // size)
+            for label, case in SEARCH_BENCH_CASES + [("get_item_by_id", None)]:
+                if case is None:
+                    index = file_loader.build_item_index(items)
+                    memory_ms = timeit(lambda: index.get(file_loader.normalize_item_id(items[-1]["item_id"])), repeat=repeat)
+                    sqlite_ms = timeit(lambda: database.get(items[-1]["item_id"]), repeat=repeat)
+                else:
+                    memory_ms = timeit(lambda: columns.search(limit=10, **case), repeat=repeat)
+                    sqlite_ms = timeit(lambda: database.search(limit=10, **case), repeat=repeat)
+                print(f"   {label:24} top-10 memory {memory_ms:8.2f} ms | sqlite {sqlite_ms:8.2f} ms")
+
+            rss = {}
+            for backend, path in [("memory", compiled_path), ("sqlite", db_path)]:
+                result = subprocess.run([sys.executable, "-c", MEMORY_PROBE, backend, path],
+                                        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+                rss[backend] = float(result.stdout.strip().splitlines()[-1])
+            print(f"   peak RSS serving searches: memory {rss['memory']:.0f} MB | sqlite {rss['sqlite']:.0f} MB")
+
+
+def bench_serialization(sizes=(10_000, 100_000, 1_000_000)):
+    """Response body encoding: FastAPI's default path vs orjson vs spliced per-version item JSON"""
+    import json
+    from fastapi.encoders import jsonable_encoder
+    from serialization import ItemJSONCache, dumps, orjson, splice_items
+
+    print("\n🧾 Response serialization (ms per 1k items)")
+    print("-" * 40)
+    if orjson is None:
+        print("   orjson is not installed, dumps() uses the json module")
+
+    for size in sizes:
+        items = make_items(size)
+        start = time.perf_counter()
+        item_json = ItemJSONCache(items)
+        cache_ms = (time.perf_counter() - start) * 1000
+        repeat = max(1, 20_000 // size)
+        # What JSONResponse does with a returned dict
+        default_ms = timeit(lambda: json.dumps(jsonable_encoder({"items": items}), ensure_ascii=False,
+                                               allow_nan=False, separators=(",", ":")).encode("utf-8"), repeat=repeat)
+        dumps_ms = timeit(lambda: dumps({"items": items}), repeat=repeat)
+        spliced_ms = timeit(lambda: splice_items(item_json.encode(items)), repeat=repeat)
+        per_1k = 1000 / size
+        print(f"   {size:>9,} items   jsonable_encoder+json {default_ms * per_1k:8.3f} | dumps {dumps_ms * per_1k:7.3f}"
+              f" | spliced cache {spliced_ms * per_1k:7.3f} (cache build {cache_ms * per_1k:.3f} once per version)")
+
+
+if __name__ == "__main__":
+    print("⏱️ Catalog Benchmarks")
+    print("=" * 40)
+    bench_load()
+    sizes = [int(arg) for arg in sys.argv[1:]] or (10_000, 100_000, 1_000_000)
+    bench_cold_start(sizes)
+    bench_search(sizes)
+    bench_lookup(sizes)
+    bench_backends(sizes)
+    bench_serialization(sizes)
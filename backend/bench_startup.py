@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Start-up benchmark: what importing the app costs, and how long a fresh
+server process takes to answer /health and to report /ready
+
+Run from the backend directory:
+    python bench_startup.py
+
+The import profile comes from `python -X importtime -c "import main"`; to
+see the full tree yourself run:
+    python -X importtime -c "import main" 2> importtime.log
+"""
+
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_profile(top=8):
+    """Run the import of main with -X importtime and summarize the slowest packages"""
+    print("📦 python -X importtime -c 'import main'")
+    print("-" * 40)
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True)
+    # Attribute each module's own (self) time to its top-level package
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            package = match.group(4).split(".")[0]
+            packages[package] = packages.get(package, 0) + int(match.group(1))
+    total = sum(packages.values())
+
+    for package, micros in sorted(packages.items(), key=lambda entry: -entry[1])[:top]:
+        print(f"   {package:24} {micros / 1000:8.1f} ms")
+    print(f"   {'total':24} {total / 1000:8.1f} ms")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline):
+    """Poll url until it answers 200; returns the time it did"""
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer")
+
+
+def time_to_first_response(warmup, timeout=60):
+    """Start uvicorn with STARTUP_WARMUP=warmup; returns seconds to /health and to /ready"""
+    port = free_port()
+    env = dict(os.environ, STARTUP_WARMUP=warmup)
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        healthy = wait_for(f"http://127.0.0.1:{port}/health", start + timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", start + timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return healthy - start, ready - start
+
+
+def startup_times(rounds=3):
+    print("\n🚀 Fresh server process: time to first /health and /ready")
+    print("-" * 40)
+    for warmup in ["off", "background", "blocking"]:
+        times = [time_to_first_response(warmup) for _ in range(rounds)]
+        healthy = sorted(t[0] for t in times)[rounds // 2]
+        ready = sorted(t[1] for t in times)[rounds // 2]
+        print(f"   STARTUP_WARMUP={warmup:10} /health {healthy * 1000:7.0f} ms | /ready {ready * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    print("⏱️ Start-up Benchmarks")
+    print("=" * 40)
+    import_profile()
+    startup_times()
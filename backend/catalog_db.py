@@ -0,0 +1,465 @@
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import file_loader
+from matcher import AhoCorasick
+
+# "memory" keeps the catalog in RAM (file_loader's snapshot), "sqlite" serves
+# it from a SQLite database with an FTS5 index, for catalogs too big for RAM
+CATALOG_BACKEND = os.getenv("CATALOG_BACKEND", "memory").lower()
+# Database the spreadsheet is ingested into; defaults to the spreadsheet's name with .db (data/Items.db)
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", "")
+
+SCHEMA_VERSION = 2
+# Numeric fields with a B-tree index for range filters and ordering
+INDEXED_FIELDS = ['price', 'item_quantity', 'maximum_discount']
+SORTABLE_FIELDS = ['price', 'item_name', 'item_quantity']
+# The trigram tokenizer can't look up shorter strings, those are scanned
+MIN_INDEXED_LENGTH = 3
+FETCH_BATCH_SIZE = 1000
+# Keep IN (...) lists below SQLite's default host parameter limit
+MAX_PARAMETERS = 900
+
+
+def database_path(items_file, source_signature):
+    """
+    Return the database a version of a spreadsheet is ingested into
+    (data/Items.<mtime_ns>-<size>.db, next to CATALOG_DB_PATH when it is set)
+
+    Every version gets a file of its own, so a new database never replaces
+    the one still being served under its readers.
+    """
+    base, extension = os.path.splitext(CATALOG_DB_PATH or os.path.splitext(items_file)[0] + ".db")
+    return f"{base}.{source_signature[0]}-{source_signature[1]}{extension}"
+
+
+def database_files(items_file):
+    """
+    Return the databases ingested from versions of a spreadsheet, newest version first
+    """
+    base, extension = os.path.splitext(CATALOG_DB_PATH or os.path.splitext(items_file)[0] + ".db")
+    versions = []
+    for path in glob.glob(glob.escape(base) + ".*-*" + extension):
+        match = re.fullmatch(r"(\d+)-(\d+)", path[len(base) + 1:len(path) - len(extension)])
+        if match:
+            versions.append((int(match.group(1)), path))
+    return [path for _, path in sorted(versions, reverse=True)]
+
+
+def remove_databases(items_file, keep):
+    """
+    Delete the databases of a spreadsheet except the paths in keep
+    """
+    for path in database_files(items_file):
+        if path not in keep:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Could not remove old catalog database {path}: {e}")
+
+
+def quote(name):
+    """Quote a column name for SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def fts_phrase(text):
+    """FTS5 phrase matching text as a substring (with the trigram tokenizer)"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def contains_text(name, description, text):
+    """SQL function: does the lowercased name or description contain text (like search_items)"""
+    return text in str(name if name is not None else '').lower() or \
+        text in str(description if description is not None else '').lower()
+
+
+def ingest_catalog(path, items, source_signature):
+    """
+    Build the catalog database at path from a list of items
+
+    The database is built under a temporary name and renamed into place, so
+    readers never see a half-built catalog.
+
+    Parameters:
+    - path: Destination database file
+    - items: List of item dictionaries
+    - source_signature: (mtime_ns, size) of the source spreadsheet
+    """
+    columns = list(items[0]) if items else []
+    for field in ['item_id', 'item_name', 'item_description']:
+        if field not in columns:
+            columns.append(field)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        # Columns are declared without a type so values keep the type they were loaded with
+        connection.execute(
+            "CREATE TABLE items (position INTEGER PRIMARY KEY, id_key TEXT, "
+            + ", ".join(quote(column) for column in columns) + ")"
+        )
+        placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+        connection.executemany(
+            f"INSERT INTO items VALUES ({placeholders})",
+            (
+                [position, file_loader.normalize_item_id(item.get('item_id', ''))] + [item.get(column) for column in columns]
+                for position, item in enumerate(items)
+            )
+        )
+        connection.execute("CREATE INDEX items_by_id ON items (id_key)")
+        for field in INDEXED_FIELDS:
+            if field in columns:
+                connection.execute(f"CREATE INDEX items_by_{field} ON items ({quote(field)})")
+
+        # Trigram FTS5 index: MATCH on a phrase is a case-insensitive substring search
+        connection.execute(
+            "CREATE VIRTUAL TABLE items_fts USING fts5(item_name, item_description, "
+            "content='items', content_rowid='position', tokenize='trigram')"
+        )
+        connection.execute("INSERT INTO items_fts (items_fts) VALUES ('rebuild')")
+
+        # Distinct lowercased item names -> first position, to find item names mentioned in a query
+        connection.execute("CREATE TABLE item_names (name TEXT PRIMARY KEY, position INTEGER) WITHOUT ROWID")
+        connection.executemany(
+            "INSERT OR IGNORE INTO item_names VALUES (?, ?)",
+            ((str(item.get('item_name', '')).lower(), position) for position, item in enumerate(items))
+        )
+        name_lengths = [length for (length,) in
+                        connection.execute("SELECT DISTINCT length(name) FROM item_names ORDER BY 1")]
+
+        meta = {
+            "schema": SCHEMA_VERSION,
+            "source_mtime": source_signature[0],
+            "source_size": source_signature[1],
+            "columns": columns,
+            "count": len(items),
+            "name_lengths": name_lengths,
+        }
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [(key, json.dumps(value)) for key, value in meta.items()])
+        connection.commit()
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+
+
+class CatalogDatabase:
+    """
+    Read-only catalog served from SQLite, used instead of a CatalogSnapshot
+    when CATALOG_BACKEND is "sqlite".
+
+    Only the rows a request needs are read: searches, ID lookups and range
+    queries run in SQL against the FTS5 and B-tree indexes. The object also
+    behaves as a read-only sequence of item dictionaries (len, indexing,
+    slicing, iteration) for code that walks the catalog.
+
+    Attributes mirror CatalogSnapshot: version, path, mtime, size, loaded_at.
+    """
+
+    def __init__(self, db_path, version, path):
+        """
+        Parameters:
+        - db_path: Catalog database file
+        - version: Catalog version number
+        - path: Source spreadsheet
+        """
+        self.db_path = db_path
+        self.version = version
+        self.path = path
+        self.loaded_at = time.time()
+        self.local = threading.local()
+        self._derived = {}
+        self._lock = threading.Lock()
+
+        meta = dict(self._connection().execute("SELECT key, value FROM meta").fetchall())
+        meta = {key: json.loads(value) for key, value in meta.items()}
+        if meta.get("schema") != SCHEMA_VERSION:
+            raise ValueError(f"{db_path} has an unsupported schema")
+        self.mtime, self.size = meta["source_mtime"], meta["source_size"]
+        self.columns = meta["columns"]
+        self.count = meta["count"]
+        self.name_lengths = meta["name_lengths"]
+        self.select = "SELECT " + ", ".join(quote(column) for column in self.columns) + " FROM items"
+
+    def _connection(self):
+        """
+        Get this thread's read-only connection (reopened after a fork)
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            connection.create_function("contains_text", 3, contains_text, deterministic=True)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def rows(self, sql, params=()):
+        """
+        Run a query selecting item columns and return the item dictionaries
+        """
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self._connection().execute(sql, params)]
+
+    def derived(self, key, factory):
+        """
+        Return a structure derived from this catalog version, building it on first use
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = factory(self)
+            return self._derived[key]
+
+    # Sequence interface
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.rows(self.select + " WHERE position >= ? AND position < ? ORDER BY position", (start, stop))
+        if index < 0:
+            index += self.count
+        rows = self.rows(self.select + " WHERE position = ?", (index,))
+        if not rows:
+            raise IndexError("catalog index out of range")
+        return rows[0]
+
+    def __iter__(self):
+        columns = self.columns
+        cursor = self._connection().execute(self.select + " ORDER BY position")
+        while True:
+            batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not batch:
+                return
+            for row in batch:
+                yield dict(zip(columns, row))
+
+    # Queries
+
+    def field(self, name):
+        """SQL expression for an item field (missing fields count as 0, like item.get(field, 0))"""
+        return quote(name) if name in self.columns else "0"
+
+    def text_filter(self, text):
+        """
+        Return (SQL condition, parameters) for items whose name or description
+        contains the lowercased text
+        """
+        if len(text) >= MIN_INDEXED_LENGTH:
+            return "position IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)", [fts_phrase(text)]
+        return f"contains_text({quote('item_name')}, {quote('item_description')}, ?)", [text]
+
+    def search(self, search_query=None, min_price=None, max_price=None, sort_by=None, limit=None, offset=0):
+        """
+        SQL equivalent of file_loader.search_items (same filters, order, limit and offset)
+        """
+        conditions, params = [], []
+        if search_query:
+            condition, condition_params = self.text_filter(search_query.lower())
+            conditions.append(condition)
+            params += condition_params
+        if min_price is not None:
+            conditions.append(f"{self.field('price')} >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            conditions.append(f"{self.field('price')} <= ?")
+            params.append(max_price)
+
+        sql = self.select
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if sort_by in SORTABLE_FIELDS:
+            # Price is sorted high to low; ties keep catalog order like a stable sort
+            sql += f" ORDER BY {self.field(sort_by)}{' DESC' if sort_by == 'price' else ''}, position"
+        else:
+            sql += " ORDER BY position"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else max(limit, 0), max(offset, 0)]
+        return self.rows(sql, params)
+
+    def range(self, field, minimum=None, maximum=None, limit=None, descending=False):
+        """
+        SQL equivalent of file_loader.find_items_in_range
+        """
+        conditions, params = [], []
+        if minimum is not None:
+            conditions.append(f"{self.field(field)} >= ?")
+            params.append(minimum)
+        if maximum is not None:
+            conditions.append(f"{self.field(field)} <= ?")
+            params.append(maximum)
+        sql = self.select
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {self.field(field)}{' DESC' if descending else ''}, position"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(max(limit, 0))
+        return self.rows(sql, params)
+
+    def get(self, item_id):
+        """
+        Return the first item with a (normalized) ID, or None
+        """
+        rows = self.rows(self.select + " WHERE id_key = ? ORDER BY position LIMIT 1",
+                         (file_loader.normalize_item_id(item_id),))
+        return rows[0] if rows else None
+
+    def get_many(self, item_ids):
+        """
+        Return the item for each ID (None if not found), in request order
+        """
+        keys = [file_loader.normalize_item_id(item_id) for item_id in item_ids]
+        found = {}
+        distinct = list(dict.fromkeys(keys))
+        for start in range(0, len(distinct), MAX_PARAMETERS):
+            chunk = distinct[start:start + MAX_PARAMETERS]
+            sql = (f"SELECT id_key, {', '.join(quote(column) for column in self.columns)} FROM items "
+                   f"WHERE id_key IN ({', '.join('?' for _ in chunk)}) ORDER BY position")
+            for row in self._connection().execute(sql, chunk):
+                found.setdefault(row[0], dict(zip(self.columns, row[1:])))
+        return [found.get(key) for key in keys]
+
+    def find_named_item(self, query_lower):
+        """
+        Return the first catalog item whose lowercased name occurs in query_lower, or None
+
+        Every substring of the query that is as long as some item name is
+        looked up in the item_names table (only the lengths names have, and
+        the API caps the query length, see MAX_QUERY_LENGTH).
+        """
+        substrings = {
+            query_lower[start:start + length]
+            for length in self.name_lengths if length <= len(query_lower)
+            for start in range(len(query_lower) - length + 1)
+        }
+        if not substrings:
+            return None
+        substrings = list(substrings)
+        connection = self._connection()
+        first = None
+        for start in range(0, len(substrings), MAX_PARAMETERS):
+            chunk = substrings[start:start + MAX_PARAMETERS]
+            position = connection.execute(
+                f"SELECT MIN(position) FROM item_names WHERE name IN ({', '.join('?' for _ in chunk)})", chunk
+            ).fetchone()[0]
+            if position is not None and (first is None or position < first):
+                first = position
+        return None if first is None else self[first]
+
+    def count_containing(self, text):
+        """
+        Count the items whose name or description contains the lowercased text
+        """
+        condition, params = self.text_filter(text)
+        return self._connection().execute(f"SELECT COUNT(*) FROM items WHERE {condition}", params).fetchone()[0]
+
+    def rank(self, weighted_terms, limit=None):
+        """
+        Rank items by the summed weight of the terms their text contains
+
+        Parameters:
+        - weighted_terms: List of (lowercased term, weight)
+        - limit: Maximum number of positions to return
+
+        Returns:
+        - Positions with a positive score, best first (ties in catalog order)
+        """
+        if not weighted_terms:
+            return []
+        parts, params = [], []
+        for term, weight in weighted_terms:
+            condition, condition_params = self.text_filter(term)
+            parts.append(f"SELECT position, ? AS weight FROM items WHERE {condition}")
+            params += [weight] + condition_params
+        sql = (f"SELECT position FROM ({' UNION ALL '.join(parts)}) GROUP BY position "
+               "HAVING SUM(weight) > 0 ORDER BY SUM(weight) DESC, position")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(max(limit, 0))
+        return [row[0] for row in self._connection().execute(sql, params)]
+
+
+def open_catalog_database(items_file, source_signature, load_items, version):
+    """
+    Open the catalog database for items_file, ingesting the spreadsheet first
+    if the database is missing or was built from a different version of it
+
+    Parameters:
+    - items_file: Path of the source spreadsheet
+    - source_signature: Current (mtime_ns, size) of the spreadsheet, or None
+      if it is missing (the newest existing database is then used as is)
+    - load_items: Callable parsing the spreadsheet into a list of item dictionaries
+    - version: Catalog version number to give the database
+
+    Returns:
+    - CatalogDatabase, or None if there's no usable catalog
+    """
+    if source_signature is None:
+        # No spreadsheet: serve the newest database there is
+        for path in database_files(items_file)[:1]:
+            try:
+                database = CatalogDatabase(path, version, items_file)
+            except (sqlite3.Error, ValueError, KeyError):
+                return None
+            print(f"Opened catalog database {path} ({len(database)} items)")
+            return database
+        return None
+
+    path = database_path(items_file, source_signature)
+    try:
+        database = CatalogDatabase(path, version, items_file)
+        if (database.mtime, database.size) == tuple(source_signature):
+            print(f"Opened catalog database {path} ({len(database)} items)")
+            return database
+    except (sqlite3.Error, ValueError, KeyError):
+        pass  # Missing or unreadable: ingest the spreadsheet again
+
+    items = load_items(items_file)
+    if not items:
+        return None
+    try:
+        ingest_catalog(path, items, source_signature)
+        database = CatalogDatabase(path, version, items_file)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not build catalog database {path}: {e}")
+        return None
+    print(f"Ingested {len(items)} items into {path}")
+    return database
+
+
+class DatabaseQueryMatcher:
+    """
+    QueryMatcher counterpart for a CatalogDatabase: keywords are matched in
+    memory, item names with lookups in the item_names table.
+    """
+
+    def __init__(self, database, keywords):
+        self.database = database
+        self.keywords = list(keywords)
+        self.automaton = AhoCorasick(self.keywords)
+
+    def match(self, query_lower):
+        """
+        Same result as QueryMatcher.match
+        """
+        found = self.automaton.find_all(query_lower)
+        keywords = [self.keywords[pattern_id] for pattern_id in sorted(found)]
+        return keywords, self.database.find_named_item(query_lower)
@@ -0,0 +1,412 @@
+import bisect
+import json
+import mmap
+import os
+
+import numpy as np
+
+from search_engine import NUMERIC_FIELDS, TEXT_SEPARATOR, TextColumn, encode_text
+from matcher import distinct_names
+from serialization import dumps
+from text_index import PostingLists, TextIndex
+
+# Compiled catalogs are written next to the spreadsheet; set to "false" to always parse the spreadsheet
+COMPILED_CATALOG = os.getenv("COMPILED_CATALOG", "true").lower() != "false"
+COMPILED_EXTENSION = ".catalog"
+
+MAGIC = b"ITEMCAT1"
+FORMAT_VERSION = 4
+# Sections start on cache-line boundaries so they can be viewed in place
+ALIGNMENT = 64
+
+
+def compiled_path(items_file):
+    """
+    Return where the compiled snapshot of items_file lives (data/Items.xlsx -> data/Items.catalog)
+    """
+    return os.path.splitext(items_file)[0] + COMPILED_EXTENSION
+
+
+def search_text(item):
+    """
+    Lowercased "name<sep>description" text the search engine scans
+    """
+    return str(item.get('item_name', '')).lower() + TEXT_SEPARATOR + str(item.get('item_description', '')).lower()
+
+
+def column_kind(values):
+    """
+    Pick the storage format for a column: int64, float64, str or json (anything else)
+    """
+    if all(type(value) is int for value in values):
+        return "int64"
+    if all(type(value) in (int, float) for value in values):
+        return "float64"
+    if all(type(value) is str for value in values):
+        return "str"
+    return "json"
+
+
+class CatalogItem(dict):
+    """
+    Item dictionary read from a compiled catalog; remembers where it came
+    from so its pre-encoded JSON can be found again
+    """
+    __slots__ = ("catalog", "position")
+
+
+class MappedItems:
+    """
+    Read-only sequence of the items of a compiled catalog.
+
+    Item dictionaries are built from the mapped columns when they are
+    accessed (like the rows of a CatalogDatabase) instead of being held for
+    the whole catalog, so a worker's memory doesn't grow with the catalog.
+    Each access returns a new dictionary.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return self.catalog.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.catalog.row(position) for position in range(*index.indices(self.catalog.count))]
+        if index < 0:
+            index += self.catalog.count
+        if not 0 <= index < self.catalog.count:
+            raise IndexError("catalog index out of range")
+        return self.catalog.row(index)
+
+    def __iter__(self):
+        row = self.catalog.row
+        for position in range(self.catalog.count):
+            yield row(position)
+
+    def __bool__(self):
+        return self.catalog.count > 0
+
+
+class MappedItemJSON:
+    """
+    ItemJSONCache counterpart for a compiled catalog: every item's JSON is
+    written at compile time and read from the mapped file
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def encode(self, items):
+        """
+        Return the JSON bytes of each item (items that aren't from this catalog are encoded now)
+        """
+        catalog = self.catalog
+        return [catalog.item_json(item.position) if getattr(item, "catalog", None) is catalog else dumps(item)
+                for item in items]
+
+
+class MappedIdIndex:
+    """
+    Normalized item ID -> item lookups by bisection over the sorted IDs in
+    the mapped file (the first item wins for duplicated IDs, like build_item_index)
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.keys = catalog.strings_at("id")
+        self.order = catalog.section("id.order")
+
+    def get(self, key, default=None):
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.catalog.row(int(self.order[index]))
+        return default
+
+
+class MappedStrings:
+    """
+    Read-only sequence of the strings of a blob + byte offsets section pair, decoded on access
+    """
+
+    def __init__(self, buffer, offsets, base):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.base = base
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        base = self.base
+        return self.buffer[base + int(self.offsets[index]):base + int(self.offsets[index + 1])].decode("utf-8")
+
+
+class CompiledCatalog:
+    """
+    Read-only, memory-mapped catalog in columnar form.
+
+    Every array is a view into the mapped file, so all processes that open
+    the same file share one physical copy through the page cache. Besides
+    the item columns (item dictionaries are built from them on access, see
+    MappedItems) the file carries everything the other layers would
+    otherwise rebuild in each process: every item's JSON, the sorted item
+    IDs, the distinct item names, the lowercased search text as a UTF-8
+    blob with byte offsets, the token postings of the text index, the
+    numeric columns as float64 with their sort orders, and the item name order.
+
+    File layout: magic, header length (uint64), JSON header, then the
+    sections listed in the header, each aligned to ALIGNMENT bytes.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled catalog")
+        header_length = int.from_bytes(self.buffer[len(MAGIC):len(MAGIC) + 8], "little")
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.buffer[start:start + header_length].decode("utf-8"))
+        if self.header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} has an unsupported format")
+        self.path = path
+        self.count = self.header["count"]
+        self.columns = self.header["columns"]
+
+        # Per-column readers of one row's value
+        self.readers = []
+        for column in self.columns:
+            name, kind = column["name"], column["kind"]
+            if kind in ("str", "json"):
+                strings = self.strings_at("column." + name)
+                self.readers.append((name, strings.__getitem__ if kind == "str"
+                                     else lambda position, strings=strings: json.loads(strings[position])))
+            else:
+                values = self.section("column." + name)
+                self.readers.append((name, lambda position, values=values: values[position].item()))
+        self.json = self.strings_at("item.json")
+
+    @property
+    def source_signature(self):
+        """(mtime_ns, size) of the spreadsheet this catalog was compiled from"""
+        return self.header["source_mtime"], self.header["source_size"]
+
+    def section(self, name):
+        """
+        Return a section of the file as a NumPy array (a view, no copy)
+        """
+        section = self.header["sections"][name]
+        return np.frombuffer(self.buffer, dtype=np.dtype(section["dtype"]),
+                             count=section["count"], offset=section["offset"])
+
+    def strings_at(self, name):
+        """
+        Return the strings stored in the name.offsets and name.data sections (MappedStrings)
+        """
+        return MappedStrings(self.buffer, self.section(name + ".offsets"), self.header["sections"][name + ".data"]["offset"])
+
+    def column(self, column):
+        """
+        Return a column's values as a list of Python objects
+        """
+        name, kind = column["name"], column["kind"]
+        if kind in ("str", "json"):
+            strings = self.strings_at("column." + name)
+            values = [strings[position] for position in range(self.count)]
+            return values if kind == "str" else [json.loads(value) for value in values]
+        return self.section("column." + name).tolist()
+
+    def row(self, position):
+        """
+        Build the item dictionary at position (same keys, order and types as the spreadsheet loader)
+        """
+        item = CatalogItem((name, read(position)) for name, read in self.readers)
+        item.catalog = self
+        item.position = position
+        return item
+
+    def items(self):
+        """
+        Return the items as a MappedItems sequence
+        """
+        return MappedItems(self)
+
+    def item_json(self, position):
+        """JSON bytes of the item at position"""
+        offsets, base = self.json.offsets, self.json.base
+        return self.buffer[base + int(offsets[position]):base + int(offsets[position + 1])]
+
+    def id_index(self):
+        """Normalized item ID -> item lookups (MappedIdIndex)"""
+        return MappedIdIndex(self)
+
+    def distinct_names(self):
+        """
+        Return (lowercased name, first position) of each distinct item name, in
+        catalog order, for QueryMatcher (see matcher.distinct_names)
+        """
+        names = self.strings_at("names")
+        return list(zip((names[index] for index in range(len(names))), self.section("names.position").tolist()))
+
+    def search_text(self):
+        """TextColumn of the lowercased search text, read from the mapped file"""
+        return TextColumn(self.buffer, self.section("search.offsets"), self.header["sections"]["search.data"]["offset"])
+
+    def text_index(self):
+        """TextIndex over the search text, with the token postings read from the mapped file"""
+        tokens = self.strings_at("tokens")
+        vocabulary = [tokens[token_id] for token_id in range(len(tokens))]
+        postings = PostingLists(self.section("postings.data"), self.section("postings.offsets"))
+        return TextIndex.from_postings(vocabulary, postings, self.count)
+
+    def numeric(self, field):
+        """float64 values of a numeric field (missing values are 0)"""
+        return self.section("numeric." + field)
+
+    def sort_order(self, field, descending=False):
+        """Stable sort order of a numeric field, as SortedIndex uses it"""
+        return self.section(f"order.{field}.{'descending' if descending else 'ascending'}")
+
+    def sorted_values(self, field, descending=False):
+        """Values of a numeric field in sort order (negated for descending), as SortedIndex uses them"""
+        return self.section(f"order.{field}.{'descending' if descending else 'ascending'}.values")
+
+    def name_rank(self):
+        """Rank of each item in stable item name order (the item_name sort key)"""
+        return self.section("order.item_name.rank")
+
+
+def write_compiled_catalog(path, items, source_signature):
+    """
+    Compile items into a catalog file at path
+
+    The file is written to a temporary name and renamed into place, so
+    processes that race to compile the same catalog never see a partial file.
+
+    Parameters:
+    - path: Destination file
+    - items: List of item dictionaries
+    - source_signature: (mtime_ns, size) of the source spreadsheet
+    """
+    sections = {}
+
+    def add(name, array):
+        sections[name] = np.ascontiguousarray(array)
+
+    def add_strings(name, values):
+        offsets, data = encode_text(values)
+        add(name + ".offsets", offsets)
+        add(name + ".data", np.frombuffer(data, dtype=np.uint8))
+
+    names = list(items[0]) if items else []
+    columns = []
+    for name in names:
+        values = [item.get(name) for item in items]
+        kind = column_kind(values)
+        columns.append({"name": name, "kind": kind})
+        if kind in ("int64", "float64"):
+            add("column." + name, np.array(values, dtype=kind))
+        else:
+            if kind == "json":
+                values = [json.dumps(value, default=str) for value in values]
+            add_strings("column." + name, values)
+    add_strings("item.json", [dumps(item).decode("utf-8") for item in items])
+
+    # Sorted normalized IDs (ties in catalog order) for ID lookups
+    import file_loader  # imported here: file_loader imports this module
+    ids = [file_loader.normalize_item_id(item.get('item_id', '')) for item in items]
+    id_order = sorted(range(len(items)), key=ids.__getitem__)
+    add_strings("id", [ids[position] for position in id_order])
+    add("id.order", np.array(id_order, dtype=np.int64))
+
+    # Distinct lowercased item names with their first position, for the query matcher
+    names = distinct_names(items)
+    add_strings("names", [name for name, _ in names])
+    add("names.position", np.array([position for _, position in names], dtype=np.int64))
+
+    texts = [search_text(item) for item in items]
+    offsets, data = encode_text(texts)
+    add("search.offsets", offsets)
+    add("search.data", np.frombuffer(data, dtype=np.uint8))
+    index = TextIndex(texts)
+    add_strings("tokens", index.vocabulary)
+    add("postings.offsets", np.concatenate([[0], np.cumsum([len(rows) for rows in index.postings])]).astype(np.int64))
+    add("postings.data", np.concatenate(index.postings) if index.postings else np.zeros(0, dtype=np.int64))
+
+    for field in NUMERIC_FIELDS:
+        values = np.array([item.get(field, 0) for item in items], dtype=np.float64)
+        add("numeric." + field, values)
+        ascending = np.argsort(values, kind='stable')
+        descending = np.argsort(-values, kind='stable')
+        add(f"order.{field}.ascending", ascending)
+        add(f"order.{field}.descending", descending)
+        add(f"order.{field}.ascending.values", values[ascending])
+        add(f"order.{field}.descending.values", -values[descending])
+    names_column = np.array([item.get('item_name', 0) for item in items], dtype=object)
+    rank = np.empty(len(items), dtype=np.int64)
+    rank[np.argsort(names_column, kind='stable')] = np.arange(len(items))
+    add("order.item_name.rank", rank)
+
+    # Section offsets depend on the header length, so lay them out against a
+    # generous upper bound of the header size
+    layout = {name: {"dtype": array.dtype.str, "count": len(array)} for name, array in sections.items()}
+    header = {"format": FORMAT_VERSION, "count": len(items), "source_mtime": source_signature[0],
+              "source_size": source_signature[1], "columns": columns, "sections": layout}
+    header_space = len(json.dumps(header)) + 32 * len(sections) + 64
+    offset = -(-(len(MAGIC) + 8 + header_space) // ALIGNMENT) * ALIGNMENT
+    for name, array in sections.items():
+        layout[name]["offset"] = offset
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode("utf-8")
+    assert len(header_bytes) <= header_space
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for name, array in sections.items():
+                f.seek(layout[name]["offset"])
+                f.write(array.tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def open_compiled_catalog(items_file, source_signature, load_items):
+    """
+    Open the compiled snapshot of items_file, compiling it first if it is
+    missing or was built from a different version of the spreadsheet
+
+    Parameters:
+    - items_file: Path of the source spreadsheet
+    - source_signature: Current (mtime_ns, size) of the spreadsheet
+    - load_items: Callable parsing the spreadsheet into a list of item dictionaries
+
+    Returns:
+    - Tuple of (items: MappedItems, or the parsed list when the compiled
+      file can't be used; CompiledCatalog or None)
+    """
+    path = compiled_path(items_file)
+    try:
+        catalog = CompiledCatalog(path)
+        if tuple(catalog.source_signature) == tuple(source_signature):
+            print(f"Loaded {catalog.count} items from {path}")
+            return catalog.items(), catalog
+    except (OSError, ValueError, KeyError):
+        pass  # Missing, stale or unreadable: compile it again
+
+    items = load_items(items_file)
+    if not items:
+        return items, None
+    try:
+        write_compiled_catalog(path, items, source_signature)
+        catalog = CompiledCatalog(path)
+        # Serve from the mapped file like any other process, dropping the parsed items
+        return catalog.items(), catalog
+    except (OSError, ValueError) as e:
+        print(f"Could not write compiled catalog {path}: {e}")
+        return items, None
@@ -0,0 +1,132 @@
+import math
+import os
+import re
+
+import numpy as np
+
+from catalog_db import CatalogDatabase
+from file_loader import snapshot_for
+from search_engine import CatalogColumns, get_columns
+
+# "relevance" ranks catalog items against the query, "first" keeps the old
+# behaviour of adding the first CONTEXT_MAX_ITEMS catalog rows
+CONTEXT_SELECTION = os.getenv("CONTEXT_SELECTION", "relevance")
+# Approximate token budget for the ITEMS INFORMATION section of the prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+# Maximum number of additional catalog items added to the prompt
+CONTEXT_MAX_ITEMS = int(os.getenv("CONTEXT_MAX_ITEMS", "15"))
+# Items added when nothing in the catalog matches the query
+CONTEXT_FALLBACK_ITEMS = int(os.getenv("CONTEXT_FALLBACK_ITEMS", "5"))
+
+# Average characters per token for English text with Gemini-style tokenizers
+CHARS_PER_TOKEN = 4
+
+QUERY_TERM_PATTERN = re.compile(r'\w+')
+STOPWORDS = {
+    "a", "about", "an", "and", "any", "are", "can", "do", "does", "for", "from", "have", "how",
+    "i", "in", "is", "it", "me", "much", "my", "need", "of", "on", "one", "or", "please", "show",
+    "some", "tell", "that", "the", "there", "this", "to", "want", "what", "whats", "which", "with",
+    "you", "your",
+}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count for a piece of prompt text
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def query_terms(query):
+    """
+    Return the search terms of a query (stopwords dropped, simple plural stemming)
+    """
+    terms = []
+    for word in QUERY_TERM_PATTERN.findall(query.lower()):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in terms:
+            terms.append(word)
+    return terms
+
+
+def rank_items(query, items_data, limit=None):
+    """
+    Rank catalog items by relevance to the query
+    
+    Each query term scores its inverse document frequency for every item
+    whose name or description contains it, so rare, specific words count
+    more than words shared by much of the catalog.
+    
+    Returns:
+    - Positions of items with a positive score, best first (ties in catalog
+      order), at most limit of them
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    if isinstance(items_data, CatalogDatabase):
+        # Document frequencies and scores are computed in SQL with the FTS5 index
+        size = len(items_data)
+        weighted_terms = []
+        for term in terms:
+            count = items_data.count_containing(term)
+            if count and count * 2 <= size:
+                weighted_terms.append((term, math.log((size + 1) / (count + 0.5))))
+        return items_data.rank(weighted_terms, limit)
+
+    snapshot = snapshot_for(items_data)
+    columns = get_columns(snapshot) if snapshot is not None else CatalogColumns(items_data)
+    index = columns.text_index
+
+    scores = np.zeros(len(columns), dtype=np.float64)
+    for term in terms:
+        rows = index.rows_containing(term)
+        # Words in most of the catalog ("quality", "use") don't tell items apart
+        if len(rows) and len(rows) * 2 <= len(columns):
+            scores[rows] += math.log((len(columns) + 1) / (len(rows) + 0.5))
+
+    matched = np.flatnonzero(scores > 0)
+    return matched[np.argsort(-scores[matched], kind='stable')][:limit].tolist()
+
+
+def select_context_items(query, items_data, exclude_ids=(), used_tokens=0, render=None):
+    """
+    Choose the additional catalog items to describe in the prompt
+    
+    Parameters:
+    - query: User's query text
+    - items_data: List of item dictionaries
+    - exclude_ids: IDs of items already in the prompt
+    - used_tokens: Tokens already used by the items section (current/recent items)
+    - render: Function returning an item's prompt line, used to charge the budget
+    
+    Returns:
+    - List of item dictionaries, most relevant first, that fit the token budget
+    """
+    if CONTEXT_SELECTION == "first":
+        return [item for item in items_data[:CONTEXT_MAX_ITEMS] if item["item_id"] not in exclude_ids]
+
+    # Excluded items are skipped, so rank enough to still fill CONTEXT_MAX_ITEMS
+    positions = rank_items(query, items_data, CONTEXT_MAX_ITEMS + len(exclude_ids))
+    if not positions:
+        positions = range(min(CONTEXT_FALLBACK_ITEMS, len(items_data)))
+
+    selected = []
+    budget = CONTEXT_TOKEN_BUDGET - used_tokens
+    for position in positions:
+        if len(selected) >= CONTEXT_MAX_ITEMS:
+            break
+        item = items_data[position]
+        if item["item_id"] in exclude_ids:
+            continue
+        cost = estimate_tokens(render(item)) if render else 0
+        if cost > budget:
+            # A long description doesn't crowd out the less relevant items that still fit
+            continue
+        budget -= cost
+        selected.append(item)
+    return selected
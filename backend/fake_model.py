@@ -0,0 +1,124 @@
+"""
+Local stand-in for the Gemini GenerativeModel, used by tests and load tests
+"""
+
+import asyncio
+import random
+import time
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def split_chunks(text, size):
+    """Split text into chunks of about size words (keeping the spaces)"""
+    words = text.split(" ")
+    return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+            for i in range(0, len(words), size)]
+
+
+class InjectedModelError(RuntimeError):
+    """
+    Error raised by FakeModel; code mimics the HTTP status of Google API errors
+    """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeModel:
+    """
+    Answers every prompt with a canned reply after an injected delay
+
+    Parameters:
+    - latency: Seconds each call takes
+    - reply: Text returned for every prompt
+    - error_rate: Fraction of calls (0-1) that raise InjectedModelError (a RuntimeError)
+    - error_code: Status code of the injected errors, e.g. 503 or 429 for transient ones
+    - fail_first: Number of calls that fail before the model starts answering
+    - stall_rate: Fraction of calls (0-1) that stall for stall_seconds more than latency
+    - stall_seconds: Extra time a stalled call takes
+    - seed: Random seed for the injected errors and stalls
+    - chunk_words: Words per chunk when streaming (stream=True)
+    - chunk_delay: Seconds between streamed chunks; latency is the time to the first one,
+      and a non-streamed call takes as long as the whole stream
+    """
+
+    def __init__(self, latency=0.0, reply="This is a test answer.", error_rate=0.0, seed=None,
+                 chunk_words=2, chunk_delay=0.0, error_code=None, fail_first=0, stall_rate=0.0, stall_seconds=0.0):
+        self.latency = latency
+        self.reply = reply
+        self.chunk_words = chunk_words
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.fail_first = fail_first
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _start(self):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return self.calls
+
+    def _respond(self, call):
+        if call <= self.fail_first or (self.error_rate and self.random.random() < self.error_rate):
+            raise InjectedModelError("injected model error", self.error_code)
+        return FakeResponse(self.reply)
+
+    def _duration(self, stream):
+        latency = self.latency
+        if self.stall_rate and self.random.random() < self.stall_rate:
+            latency += self.stall_seconds
+        if stream:
+            return latency
+        return latency + self.chunk_delay * (len(split_chunks(self.reply, self.chunk_words)) - 1)
+
+    def generate_content(self, prompt, stream=False):
+        call = self._start()
+        try:
+            time.sleep(self._duration(stream))
+        finally:
+            self.in_flight -= 1
+        response = self._respond(call)
+        if stream:
+            return self._stream(response.text)
+        return response
+
+    def _stream(self, text):
+        for i, chunk in enumerate(split_chunks(text, self.chunk_words)):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield FakeResponse(chunk)
+
+    async def generate_content_async(self, prompt, stream=False):
+        call = self._start()
+        try:
+            await asyncio.sleep(self._duration(stream))
+        finally:
+            self.in_flight -= 1
+        response = self._respond(call)
+        if stream:
+            return self._stream_async(response.text)
+        return response
+
+    async def _stream_async(self, text):
+        for i, chunk in enumerate(split_chunks(text, self.chunk_words)):
+            if i:
+                await asyncio.sleep(self.chunk_delay)
+            yield FakeResponse(chunk)
+
+
+class BlockingFakeModel(FakeModel):
+    """
+    FakeModel without an async API, like older SDK clients
+    """
+    generate_content_async = None
@@ -0,0 +1,254 @@
+import functools
+import os
+import re
+
+# Item IDs and price limits in queries (find_relevant_items uses the same patterns)
+SKU_PATTERN = re.compile(r'SKU\d{7}', re.IGNORECASE)
+PRICE_RANGE_PATTERN = re.compile(r'under\s+\$?(\d+)|less\s+than\s+\$?(\d+)|cheaper\s+than\s+\$?(\d+)')
+
+# Structured questions answered from the catalog with templated text instead of the model:
+# "price"       - "price of SKU2024001", "how much is the Dura Binder"
+# "discount"    - "what's the discount on the stapler"
+# "stock"       - "is the Apex Tablet in stock"
+# "price_range" - "items under $20"
+FAST_PATH_ALL_INTENTS = ["price", "discount", "stock", "price_range"]
+# Comma-separated intents to answer without the model, "all", or empty (the default) to always ask the model
+FAST_PATH_INTENTS = os.getenv("FAST_PATH_INTENTS", "")
+
+# Words that pick an item intent; a question matching more than one intent goes to the model
+# (except price and discount together, which the price answer covers)
+INTENT_PATTERNS = {
+    "price": re.compile(r"\b(price|prices|priced|cost|costs|how much)\b"),
+    "discount": re.compile(r"\b(discount|discounts|discounted|on sale|sale|deal|deals|off)\b"),
+    "stock": re.compile(r"\b(in stock|stock|how many|quantity|available|availability)\b"),
+}
+# Open questions that need the model even when they mention a price or an item
+OPEN_QUESTION_PATTERN = re.compile(
+    r"\b(compare|comparison|vs|versus|better|best|recommend|suggest|should|why|difference|review|reviews|"
+    r"similar|alternative|alternatives|instead|gift|worth)\b"
+)
+
+# Words a price range question may use besides the range itself ("show me anything under $20");
+# a question with other words ("coffee maker under $50") asks about something the range search ignores
+PRICE_RANGE_WORDS = {
+    "a", "all", "any", "anything", "are", "available", "buy", "can", "do", "find", "for", "get", "got",
+    "have", "i", "in", "is", "it", "items", "item", "list", "me", "of", "options", "please", "product",
+    "products", "show", "sell", "some", "something", "stock", "stuff", "that", "the", "there", "things",
+    "what", "what's", "whats", "which", "with", "you", "your",
+}
+
+# Answers given per intent since start-up
+_answered = {intent: 0 for intent in FAST_PATH_ALL_INTENTS}
+
+
+def parse_intents(value):
+    """
+    Parse an intent list like FAST_PATH_INTENTS
+
+    Parameters:
+    - value: Comma-separated string or list of intent names, or "all"
+
+    Returns:
+    - Set of intent names
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    names = {name.strip().lower() for name in value if name.strip()}
+    if "all" in names:
+        return set(FAST_PATH_ALL_INTENTS)
+    unknown = names - set(FAST_PATH_ALL_INTENTS)
+    if unknown:
+        print(f"⚠️ Ignoring unknown fast-path intents: {', '.join(sorted(unknown))}")
+    return names & set(FAST_PATH_ALL_INTENTS)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_setting(value):
+    return frozenset(parse_intents(value))
+
+
+def enabled_intents():
+    """
+    Intents the fast path answers, from FAST_PATH_INTENTS
+    """
+    return _parse_setting(FAST_PATH_INTENTS)
+
+
+def find_sku(query):
+    """
+    Return the first item ID mentioned in the query, upper-cased (None if there isn't one)
+    """
+    match = SKU_PATTERN.search(query)
+    return match.group(0).upper() if match else None
+
+
+def parse_max_price(query_lower):
+    """
+    Return the price limit of an "under $N" style query (None if there isn't one)
+    """
+    match = PRICE_RANGE_PATTERN.search(query_lower)
+    if not match:
+        return None
+    return int(next(filter(None, match.groups())))
+
+
+def item_intent(query_lower):
+    """
+    Return the item intent ("price", "discount" or "stock") a query asks about, or None
+    """
+    found = {intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(query_lower)}
+    if found == {"price", "discount"}:
+        return "price"
+    if len(found) == 1:
+        return found.pop()
+    return None
+
+
+def detect_intent(query, context, category_keywords=()):
+    """
+    Recognize a structured question
+
+    Parameters:
+    - query: User's query text
+    - context: Item context find_relevant_items found for the query (current_item/item_list), or None
+    - category_keywords: Category words; a list of items is only described when it
+      matches the category the query names
+
+    Returns:
+    - Tuple of (intent, items), or None for questions the model should answer.
+      items is empty when the query names an item ID the catalog doesn't have.
+    """
+    query_lower = query.lower().strip()
+    if OPEN_QUESTION_PATTERN.search(query_lower):
+        return None
+    context = context or {}
+    current_item = context.get("current_item")
+    item_list = context.get("item_list")
+
+    intent = item_intent(query_lower)
+    sku = find_sku(query)
+    if intent is not None:
+        if sku is not None:
+            # find_relevant_items sets current_item when the ID exists
+            if current_item is not None and str(current_item["item_id"]).strip().upper() == sku:
+                return intent, [current_item]
+            return intent, []
+        if current_item is not None:
+            return intent, [current_item]
+        if item_list and lists_keyword_items(query_lower, item_list, category_keywords):
+            return intent, item_list
+        return None
+
+    max_price = parse_max_price(query_lower)
+    if max_price is not None and sku is None and item_list and current_item is None:
+        # find_relevant_items lists the most expensive items under the limit (whatever
+        # else the query asks for), when there are any
+        if not is_plain_price_range(query_lower):
+            return None
+        if all(item["price"] <= max_price for item in item_list):
+            return "price_range", item_list
+    return None
+
+
+def lists_keyword_items(query_lower, item_list, category_keywords):
+    """
+    Whether item_list answers the category the query asks about: the query
+    names a category keyword and every listed item matches one of those
+    keywords (a price range list, for example, ignores the category)
+    """
+    keywords = [keyword for keyword in category_keywords if keyword in query_lower]
+    if not keywords:
+        return False
+    return all(
+        any(keyword in f"{item.get('item_name', '')} {item.get('item_description', '')}".lower()
+            for keyword in keywords)
+        for item in item_list
+    )
+
+
+def is_plain_price_range(query_lower):
+    """
+    Whether a query asks for items under a price and nothing else
+    """
+    rest = PRICE_RANGE_PATTERN.sub(" ", query_lower)
+    words = re.findall(r"[a-z']+", rest)
+    return all(word in PRICE_RANGE_WORDS for word in words)
+
+
+def _discount(item):
+    return item.get("maximum_discount") or 0
+
+
+def price_line(item):
+    line = f"{item['item_name']} ({item['item_id']}) costs ${item['price']:.2f}"
+    if _discount(item) > 0:
+        line += f", with up to {_discount(item) * 100:.0f}% off (as low as ${item['price'] * (1 - _discount(item)):.2f})"
+    return line + "."
+
+
+def discount_line(item):
+    if _discount(item) > 0:
+        return (f"{item['item_name']} ({item['item_id']}) has a discount of up to {_discount(item) * 100:.0f}%: "
+                f"${item['price']:.2f}, as low as ${item['price'] * (1 - _discount(item)):.2f}.")
+    return f"{item['item_name']} ({item['item_id']}) has no discount at the moment; it costs ${item['price']:.2f}."
+
+
+def stock_line(item):
+    quantity = int(item.get("item_quantity") or 0)
+    if quantity > 0:
+        return f"{item['item_name']} ({item['item_id']}) is in stock: {quantity} available."
+    return f"{item['item_name']} ({item['item_id']}) is out of stock at the moment."
+
+
+ITEM_LINES = {"price": price_line, "discount": discount_line, "stock": stock_line}
+
+
+def render_answer(intent, items, query):
+    """
+    Build the templated answer for a recognized question
+    """
+    if intent == "price_range":
+        max_price = parse_max_price(query.lower())
+        lines = "\n".join(
+            f"- {item['item_name']} ({item['item_id']}) - ${item['price']:.2f}" +
+            (f", up to {_discount(item) * 100:.0f}% off" if _discount(item) > 0 else "")
+            for item in items
+        )
+        return f"Here are some items under ${max_price}:\n\n{lines}"
+    if not items:
+        return f"I couldn't find an item with the ID {find_sku(query)} in our catalog. Please check the ID and try again."
+    line = ITEM_LINES[intent]
+    if len(items) == 1:
+        return line(items[0])
+    return "Here is what we have:\n\n" + "\n".join(f"- {line(item)}" for item in items)
+
+
+def fast_path_answer(query, context, category_keywords=(), intents=None):
+    """
+    Answer a structured catalog question without the model
+
+    Parameters:
+    - query: User's query text
+    - context: Item context find_relevant_items found for the query, or None
+    - category_keywords: Category words (see detect_intent)
+    - intents: Intents to answer (default FAST_PATH_INTENTS)
+
+    Returns:
+    - Tuple of (intent, answer text), or None when the model should answer
+    """
+    intents = enabled_intents() if intents is None else intents
+    if not intents:
+        return None
+    detected = detect_intent(query, context, category_keywords)
+    if detected is None or detected[0] not in intents:
+        return None
+    intent, items = detected
+    _answered[intent] += 1
+    return intent, render_answer(intent, items, query)
+
+
+def fast_path_stats():
+    return {
+        "enabled": sorted(enabled_intents()),
+        "answered": dict(_answered),
+    }
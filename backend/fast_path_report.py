@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Fast-path report: the share of logged user questions the catalog fast path
+(FAST_PATH_INTENTS) answers without the model, per intent
+
+Reads the user turns kept by the SQLite session store (SESSION_BACKEND=sqlite),
+or a file of logged queries (one per line, or JSON lines with a "query" member).
+Run from the backend directory:
+    python fast_path_report.py                     # user turns in SESSION_DB_PATH
+    python fast_path_report.py --db path/to/sessions.db
+    python fast_path_report.py --queries queries.jsonl
+"""
+
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+import agent
+from fast_path import FAST_PATH_ALL_INTENTS, detect_intent, enabled_intents, render_answer
+from file_loader import load_all_data
+from session_store import SESSION_DB_PATH
+
+
+def queries_from_db(path):
+    """Return the user questions recorded in a SQLite session store"""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = connection.execute("SELECT entry FROM turns ORDER BY id").fetchall()
+    finally:
+        connection.close()
+    queries = []
+    for (entry,) in rows:
+        entry = json.loads(entry)
+        if entry.get("role") == "user" and isinstance(entry.get("content"), str):
+            queries.append(entry["content"])
+    return queries
+
+
+def queries_from_file(path):
+    """Return the queries of a log file: plain lines, or JSON lines with a "query" member"""
+    queries = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line).get("query") or ""
+            if line:
+                queries.append(line)
+    return queries
+
+
+def traffic_report(queries, items_data=None):
+    """
+    Classify queries the way the fast path does
+
+    Parameters:
+    - queries: User questions
+    - items_data: Catalog (default: load_all_data())
+
+    Returns:
+    - Dictionary with the number of queries, the count per intent and the
+      time (microseconds) the fast path took for each answered question
+    """
+    items_data = load_all_data() if items_data is None else items_data
+    counts = {intent: 0 for intent in FAST_PATH_ALL_INTENTS}
+    micros = []
+    for query in queries:
+        relevant = agent.find_relevant_items(query, items_data)
+        context = agent.extract_item_context(relevant) if relevant else None
+        start = time.perf_counter()
+        detected = detect_intent(query, context, agent.CATEGORY_KEYWORDS)
+        if detected is not None:
+            render_answer(detected[0], detected[1], query)
+            micros.append((time.perf_counter() - start) * 1e6)
+            counts[detected[0]] += 1
+    return {"queries": len(queries), "intents": counts, "answer_micros": micros}
+
+
+def print_report(report, enabled):
+    total = report["queries"]
+    print(f"\n📊 {total} logged questions")
+    print("-" * 40)
+    for intent, count in report["intents"].items():
+        mark = "✅" if intent in enabled else "⏸️"
+        print(f"   {mark} {intent:12} {count:6} ({count / total:6.1%})")
+    handled = sum(count for intent, count in report["intents"].items() if intent in enabled)
+    possible = sum(report["intents"].values())
+    print(f"\n⚡ Answered without the model: {handled / total:.1%} with FAST_PATH_INTENTS="
+          f"{','.join(sorted(enabled)) or '(empty)'}, {possible / total:.1%} with all intents")
+    if report["answer_micros"]:
+        micros = sorted(report["answer_micros"])
+        print(f"⏱️ Fast-path answer time: median {statistics.median(micros):.0f} µs, "
+              f"max {micros[-1]:.0f} µs")
+
+
+if __name__ == "__main__":
+    print("⚡ Fast-path Traffic Report")
+    print("=" * 40)
+    if "--queries" in sys.argv:
+        source = sys.argv[sys.argv.index("--queries") + 1]
+        queries = queries_from_file(source)
+    else:
+        source = sys.argv[sys.argv.index("--db") + 1] if "--db" in sys.argv else SESSION_DB_PATH
+        if not os.path.exists(source):
+            print(f"❌ No session database at {source} (run the server with SESSION_BACKEND=sqlite, "
+                  f"or pass --queries FILE)")
+            sys.exit(1)
+        queries = queries_from_db(source)
+    print(f"📂 {source}")
+    if not queries:
+        print("❌ No user questions found")
+        sys.exit(1)
+    print_report(traffic_report(queries), enabled_intents())
@@ -1,14 +1,28 @@
+import hashlib
 import os
-import json
-import pandas as pd
+import threading
+import time
+from search_engine import get_columns
+from catalog_store import COMPILED_CATALOG, MappedItemJSON, open_compiled_catalog
+import catalog_db
+from serialization import ItemJSONCache
 
-def load_items_data():
+# Location of the catalog spreadsheet (can be overridden for testing/benchmarks)
+ITEMS_FILE = os.getenv(
+    "ITEMS_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'Items.xlsx')
+)
+
+def load_items_data(items_file=None):
     """
     Load items data from Excel file
     """
     try:
+        # pandas is only needed to parse the spreadsheet, normally once per catalog change
+        import pandas as pd
+
         # Load the Excel file with items
-        items_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'Items.xlsx')
+        items_file = items_file or ITEMS_FILE
         items_df = pd.read_excel(items_file)
         
         # Clean column names in case there are any whitespace issues
@@ -23,16 +37,18 @@ def load_items_data():
         print(f"Error loading items data: {e}")
         return []
 
-def search_items(items_data, search_query=None, min_price=None, max_price=None, sort_by=None):
+def search_items(items_data, search_query=None, min_price=None, max_price=None, sort_by=None, limit=None, offset=0):
     """
     Search for items based on search criteria
     
     Parameters:
-    - items_data: List of item dictionaries
+    - items_data: List of item dictionaries (or a CatalogSnapshot)
     - search_query: String to search in item name and description
     - min_price: Minimum price filter
     - max_price: Maximum price filter
     - sort_by: Field to sort by (e.g., 'price', 'item_name')
+    - limit: Maximum number of items to return (the first results in sort order)
+    - offset: Number of results to skip before the first one returned
     
     Returns:
     - List of matching items
@@ -40,8 +56,23 @@ def search_items(items_data, search_query=None, min_price=None, max_price=None,
     if not items_data:
         return []
     
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        return items_data.search(search_query, min_price, max_price, sort_by, limit, offset)
+    
+    # The cached catalog is searched with the vectorized columnar engine
+    snapshot = snapshot_for(items_data)
+    if snapshot is not None:
+        return get_columns(snapshot).search(
+            search_query=search_query,
+            min_price=min_price,
+            max_price=max_price,
+            sort_by=sort_by,
+            limit=limit,
+            offset=offset
+        )
+    
     # Start with all items
-    results = items_data.copy()
+    results = list(items_data)
     
     # Apply search query filter
     if search_query:
@@ -64,6 +95,79 @@ def search_items(items_data, search_query=None, min_price=None, max_price=None,
         reverse = sort_by == 'price'  # Sort price high to low by default
         results.sort(key=lambda x: x.get(sort_by, 0), reverse=reverse)
     
+    results = results[max(offset, 0):]
+    if limit is not None:
+        results = results[:max(limit, 0)]
+    
+    return results
+
+def iter_search_items(items_data, batch_size, search_query=None, min_price=None, max_price=None,
+                      sort_by=None, limit=None, offset=0):
+    """
+    Yield the results of search_items in lists of at most batch_size items
+    
+    The SQLite catalog is read one batch at a time, so memory use doesn't
+    grow with the number of results. The in-memory catalog is searched once;
+    its result list only references items that are already cached.
+    
+    Parameters:
+    - items_data: List of item dictionaries (or a CatalogSnapshot or CatalogDatabase)
+    - batch_size: Maximum number of items per yielded list
+    - Other parameters: as for search_items
+    """
+    filters = dict(search_query=search_query, min_price=min_price, max_price=max_price, sort_by=sort_by)
+    if not isinstance(items_data, catalog_db.CatalogDatabase):
+        results = search_items(items_data, limit=limit, offset=offset, **filters)
+        for start in range(0, len(results), batch_size):
+            yield results[start:start + batch_size]
+        return
+    
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        batch = search_items(items_data, limit=size, offset=offset, **filters)
+        if not batch:
+            return
+        yield batch
+        offset += len(batch)
+        if remaining is not None:
+            remaining -= len(batch)
+        if len(batch) < size:
+            return
+
+def find_items_in_range(items_data, field, minimum=None, maximum=None, limit=None, descending=False):
+    """
+    Find items whose numeric field lies in a range, ordered by that field
+    
+    Parameters:
+    - items_data: List of item dictionaries (or a CatalogSnapshot)
+    - field: 'price', 'item_quantity' or 'maximum_discount'
+    - minimum: Lower bound (inclusive), or None
+    - maximum: Upper bound (inclusive), or None
+    - limit: Maximum number of items to return (the top-k by field)
+    - descending: Return the highest values first
+    
+    Returns:
+    - List of matching items (ties keep catalog order)
+    """
+    if not items_data:
+        return []
+    
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        return items_data.range(field, minimum, maximum, limit=limit, descending=descending)
+    
+    snapshot = snapshot_for(items_data)
+    if snapshot is not None:
+        return get_columns(snapshot).range(field, minimum, maximum, limit=limit, descending=descending)
+    
+    results = [
+        item for item in items_data
+        if (minimum is None or item.get(field, 0) >= minimum) and
+           (maximum is None or item.get(field, 0) <= maximum)
+    ]
+    results.sort(key=lambda x: x.get(field, 0), reverse=descending)
+    if limit is not None:
+        results = results[:max(limit, 0)]
     return results
 
 def get_item_by_id(items_data, item_id):
@@ -71,19 +175,365 @@ def get_item_by_id(items_data, item_id):
     Get a specific item by its ID
     
     Parameters:
-    - items_data: List of item dictionaries
+    - items_data: List of item dictionaries (or a CatalogSnapshot)
     - item_id: The ID of the item to find
     
     Returns:
     - Item dictionary or None if not found
     """
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        return items_data.get(item_id)
+    
+    snapshot = snapshot_for(items_data)
+    if snapshot is not None:
+        return get_item_index(snapshot).get(normalize_item_id(item_id))
+    
+    item_id = normalize_item_id(item_id)
     for item in items_data:
-        if str(item.get('item_id', '')).strip() == str(item_id).strip():
+        if normalize_item_id(item.get('item_id', '')) == item_id:
             return item
     return None
 
+def get_items_by_ids(items_data, item_ids):
+    """
+    Get several items by their IDs in one call
+    
+    Parameters:
+    - items_data: List of item dictionaries (or a CatalogSnapshot)
+    - item_ids: Iterable of item IDs to resolve
+    
+    Returns:
+    - List with the item dictionary (or None if not found) for each requested ID
+    """
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        return items_data.get_many(item_ids)
+    
+    snapshot = snapshot_for(items_data)
+    if snapshot is not None:
+        index = get_item_index(snapshot)
+    else:
+        index = build_item_index(items_data)
+    return [index.get(normalize_item_id(item_id)) for item_id in item_ids]
+
+def normalize_item_id(item_id):
+    """
+    Normalize an item ID for lookups (surrounding whitespace and case are ignored)
+    """
+    return str(item_id).strip().upper()
+
+def build_item_index(items_data):
+    """
+    Build a normalized item ID -> item dictionary index
+    
+    The first item wins if an ID appears more than once, like the linear scan.
+    """
+    index = {}
+    for item in items_data:
+        index.setdefault(normalize_item_id(item.get('item_id', '')), item)
+    return index
+
+def get_item_index(snapshot):
+    """
+    Get the item ID index for a catalog snapshot (built once per version)
+    """
+    if snapshot.compiled is not None:
+        return snapshot.derived("item_index", lambda snap: snap.compiled.id_index())
+    return snapshot.derived("item_index", lambda snap: build_item_index(snap.items))
+
+def get_item_json(items_data):
+    """
+    Get the ItemJSONCache of the snapshot items_data belongs to (encoded once
+    per version; read from the file for a compiled catalog), or None for the
+    SQLite catalog and arbitrary lists
+    """
+    snapshot = snapshot_for(items_data) if not isinstance(items_data, catalog_db.CatalogDatabase) else None
+    if snapshot is None:
+        return None
+    if snapshot.compiled is not None:
+        return snapshot.derived("item_json", lambda snap: MappedItemJSON(snap.compiled))
+    return snapshot.derived("item_json", lambda snap: ItemJSONCache(snap.items))
+
+class CatalogSnapshot:
+    """
+    Immutable view of the catalog as it was loaded from the spreadsheet.
+    
+    A new snapshot (with a higher version) is created whenever the source
+    file changes. Item dictionaries are shared between all callers and must
+    be treated as read-only.
+    
+    Attributes:
+    - version: Monotonic catalog version, other layers use it as a cache key
+    - items: Tuple of item dictionaries, or the MappedItems of the compiled
+      catalog (item dictionaries built on access, so they are equal but not
+      identical between accesses)
+    - path: Source file the snapshot was built from
+    - mtime: Modification time (ns) of the source file when loaded
+    - size: Size in bytes of the source file when loaded
+    - loaded_at: Wall clock time the snapshot was built
+    - compiled: Memory-mapped CompiledCatalog the items were read from, or None
+    """
+    __slots__ = ("version", "items", "path", "mtime", "size", "loaded_at", "compiled", "_derived", "_lock")
+
+    def __init__(self, version, items, path, mtime, size, compiled=None):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "items", items if compiled is not None else tuple(items))
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "mtime", mtime)
+        object.__setattr__(self, "size", size)
+        object.__setattr__(self, "loaded_at", time.time())
+        object.__setattr__(self, "compiled", compiled)
+        object.__setattr__(self, "_derived", {})
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CatalogSnapshot is immutable")
+
+    def __len__(self):
+        return len(self.items)
+
+    def derived(self, key, factory):
+        """
+        Return a structure derived from this snapshot, building it on first use.
+        
+        Indexes and other per-version caches are attached here so they are
+        built once per catalog version and dropped together with the snapshot.
+        
+        Parameters:
+        - key: Name of the derived structure
+        - factory: Callable taking the snapshot and returning the structure
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = factory(self)
+            return self._derived[key]
+
+
+_catalog_lock = threading.Lock()
+_catalog_snapshot = None
+_catalog_version = 0
+# (path, mtime, size) of a changed spreadsheet that couldn't be loaded; it isn't
+# parsed again (the last good catalog is served) until the file changes again
+_failed_signature = None
+# Thread ingesting a changed spreadsheet into the SQLite catalog while the old database is served
+_ingest_thread = None
+
+
+def _stat_items_file(items_file):
+    try:
+        stat = os.stat(items_file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _is_current(catalog, items_file, signature):
+    """
+    Whether catalog should be served for the source file with signature: it
+    was loaded from that version of the file, or that version failed to load
+    """
+    if catalog is None or signature is None or catalog.path != items_file:
+        return False
+    return (catalog.mtime, catalog.size) == signature or (items_file, *signature) == _failed_signature
+
+
+def get_catalog():
+    """
+    Get the current catalog snapshot, reloading it only if the file changed
+    
+    The spreadsheet is parsed once and then revalidated on each call with a
+    single os.stat() of the source file (modification time and size). The
+    parsed catalog is kept in a compiled file next to the spreadsheet that
+    later processes memory-map instead of parsing the spreadsheet again.
+    
+    Returns:
+    - CatalogSnapshot for the current version of the catalog (a
+      CatalogDatabase when CATALOG_BACKEND is "sqlite")
+    """
+    global _catalog_snapshot, _catalog_version, _failed_signature
+    if catalog_db.CATALOG_BACKEND == "sqlite":
+        return get_catalog_database()
+    items_file = ITEMS_FILE
+    signature = _stat_items_file(items_file)
+    snapshot = _catalog_snapshot
+    if _is_current(snapshot, items_file, signature):
+        return snapshot
+
+    with _catalog_lock:
+        # Another thread may have reloaded while we were waiting
+        snapshot = _catalog_snapshot
+        signature = _stat_items_file(items_file)
+        if _is_current(snapshot, items_file, signature):
+            return snapshot
+
+        if signature is None:
+            print(f"Error loading items data: {items_file} not found")
+            return snapshot if snapshot is not None else CatalogSnapshot(0, [], items_file, None, None)
+
+        if COMPILED_CATALOG:
+            # Read the memory-mapped compiled catalog, compiling it if the spreadsheet is newer
+            items_data, compiled = open_compiled_catalog(items_file, signature, load_items_data)
+        else:
+            items_data, compiled = load_items_data(items_file), None
+        if not items_data and snapshot is not None:
+            # Keep serving the last good catalog if the new file can't be parsed
+            _failed_signature = (items_file, *signature)
+            return snapshot
+
+        _catalog_version += 1
+        _catalog_snapshot = CatalogSnapshot(_catalog_version, items_data, items_file, *signature, compiled)
+        return _catalog_snapshot
+
+
+def get_catalog_database():
+    """
+    Get the SQLite catalog, ingesting the spreadsheet again only if it changed
+    
+    Like get_catalog(), revalidated with a single os.stat() per call; rows
+    stay on disk and are read by the queries that need them. When the
+    spreadsheet changes, it is ingested in a background thread into a
+    database file of its own, and the old database is served until the new
+    one is swapped in.
+    
+    Returns:
+    - CatalogDatabase (or an empty CatalogSnapshot if there is no catalog at all)
+    """
+    global _catalog_snapshot, _catalog_version, _failed_signature, _ingest_thread
+    items_file = ITEMS_FILE
+    signature = _stat_items_file(items_file)
+    database = _catalog_snapshot
+    if (isinstance(database, catalog_db.CatalogDatabase) and database.path == items_file
+            and (signature is None or _is_current(database, items_file, signature) or _ingesting())):
+        return database
+
+    with _catalog_lock:
+        database = _catalog_snapshot
+        signature = _stat_items_file(items_file)
+        if isinstance(database, catalog_db.CatalogDatabase) and database.path == items_file:
+            if not (signature is None or _is_current(database, items_file, signature) or _ingesting()):
+                _ingest_thread = threading.Thread(target=_ingest_in_background, args=(items_file, signature),
+                                                  name="catalog-ingest", daemon=True)
+                _ingest_thread.start()
+            return database
+
+        # Nothing to serve yet: the first load ingests right away
+        opened = catalog_db.open_catalog_database(items_file, signature, load_items_data, _catalog_version + 1)
+        if opened is None:
+            if signature is None:
+                print(f"Error loading items data: {items_file} not found")
+            return CatalogSnapshot(0, [], items_file, None, None)
+
+        _catalog_version += 1
+        _catalog_snapshot = opened
+        return opened
+
+
+def _ingesting():
+    """Whether a changed spreadsheet is being ingested (in this process)"""
+    return _ingest_thread is not None and _ingest_thread.is_alive()
+
+
+def _ingest_in_background(items_file, signature):
+    """
+    Ingest a changed spreadsheet into the SQLite catalog and swap the new
+    database in; if it can't be loaded, the last good one stays
+    """
+    global _catalog_snapshot, _catalog_version, _failed_signature
+    try:
+        opened = catalog_db.open_catalog_database(items_file, signature, load_items_data, None)
+    except Exception as e:
+        print(f"Error ingesting {items_file}: {e}")
+        opened = None
+    with _catalog_lock:
+        if _catalog_snapshot is None or _catalog_snapshot.path != items_file:
+            return  # The catalog was switched to another file meanwhile
+        if opened is None:
+            _failed_signature = (items_file, *signature)
+            return
+        # Numbered when it is swapped in, so versions stay in load order
+        _catalog_version += 1
+        opened.version = _catalog_version
+        replaced, _catalog_snapshot = _catalog_snapshot, opened
+    # Older databases go once they are out of service; the one just replaced
+    # stays for the requests (and other workers) still reading it, until the next change
+    catalog_db.remove_databases(items_file, {opened.db_path, getattr(replaced, "db_path", None)})
+
+
+def snapshot_for(items_data):
+    """
+    Return the snapshot items_data belongs to, or None for an arbitrary list
+    """
+    if isinstance(items_data, CatalogSnapshot):
+        return items_data
+    snapshot = _catalog_snapshot
+    if isinstance(snapshot, CatalogSnapshot) and items_data is snapshot.items:
+        return snapshot
+    return None
+
+
+def get_catalog_version():
+    """
+    Get the version number of the current catalog snapshot
+    """
+    return get_catalog().version
+
+
+def catalog_version_of(items_data):
+    """
+    Get the catalog version items_data belongs to (the current version for an arbitrary list)
+    """
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        return items_data.version
+    snapshot = snapshot_for(items_data)
+    return snapshot.version if snapshot is not None else get_catalog_version()
+
+
+def catalog_fingerprint(catalog):
+    """
+    Content-derived ID of a catalog version: a hash of its source file's path,
+    modification time and size
+    
+    Unlike version, a counter that restarts in every process, it is the same
+    in every worker and after a restart, and changes whenever the file does;
+    use it for anything handed to clients (ETags, pagination cursors).
+    """
+    key = f"{catalog.path}:{catalog.mtime}:{catalog.size}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def catalog_fingerprint_of(items_data):
+    """
+    Get the fingerprint of the catalog items_data belongs to (the current catalog for an arbitrary list)
+    """
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        catalog = items_data
+    else:
+        catalog = snapshot_for(items_data) or get_catalog()
+    return catalog.derived("fingerprint", catalog_fingerprint)
+
+
+def get_item_fields(items_data):
+    """
+    Get the field names of the catalog's items
+    """
+    if isinstance(items_data, catalog_db.CatalogDatabase):
+        return list(items_data.columns)
+    return list(items_data[0]) if items_data else []
+
+
 def load_all_data():
     """
     Main function to load all items data
+    
+    Returns the items of the cached catalog snapshot; the Excel file is only
+    parsed again when it changes on disk. With the SQLite backend this is the
+    CatalogDatabase itself, which every catalog function accepts in place of
+    a list of items.
     """
-    return load_items_data()
+    catalog = get_catalog()
+    if isinstance(catalog, catalog_db.CatalogDatabase):
+        return catalog
+    return catalog.items
@@ -0,0 +1,513 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import resilience
+from resilience import CircuitBreaker, LatencyTracker, backoff_delay, is_transient
+
+# Per-request limit for a model call, including time spent waiting for a slot
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "30"))
+# Maximum number of model calls in flight at once (per process); the adaptive
+# limit starts here and moves between MIN_CONCURRENT_MODEL_CALLS and this
+MAX_CONCURRENT_MODEL_CALLS = int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", "8"))
+MIN_CONCURRENT_MODEL_CALLS = int(os.getenv("MIN_CONCURRENT_MODEL_CALLS", "1"))
+# Calls that may wait for a slot, and for how long, before new ones are shed (ModelOverloaded)
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE", "32"))
+MODEL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("MODEL_QUEUE_TIMEOUT_SECONDS", "5"))
+# Let concurrent calls with the same prompt share one model call ("false" to disable)
+COALESCE_MODEL_CALLS = os.getenv("COALESCE_MODEL_CALLS", "true").lower() != "false"
+
+# Used for clients without an async API so blocking calls stay off the event loop
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_MODEL_CALLS, thread_name_prefix="model-call")
+_slots = None
+
+
+class ModelOverloaded(Exception):
+    """
+    A model call was shed: too many calls were already waiting for a slot
+    """
+
+
+class CircuitOpen(ModelOverloaded):
+    """
+    The model's circuit breaker is open: calls are answered without the model until it recovers
+    """
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for model calls, with a bounded wait queue.
+
+    The limit grows by about one per round of successful calls that used
+    it fully (additive increase) and halves when a call fails or times out
+    (multiplicative decrease), which is how quota errors and an overloaded
+    model show up. Only calls started since the last decrease can lower it
+    again, so one burst of failures halves it once, not once per call.
+
+    Calls over the limit wait in a FIFO queue of at most max_queue. When
+    the queue is full, or a call has waited queue_timeout seconds, the call
+    is shed with ModelOverloaded so the caller can answer straight away.
+    """
+
+    def __init__(self, max_limit, min_limit=1, max_queue=32, queue_timeout=5.0, backoff=0.5):
+        """
+        Parameters:
+        - max_limit: Highest (and initial) number of calls in flight
+        - min_limit: Lowest number of calls in flight
+        - max_queue: Calls allowed to wait for a slot
+        - queue_timeout: Seconds a call waits for a slot before it is shed
+        - backoff: Factor applied to the limit when a call fails
+        """
+        self.max_limit = max_limit
+        self.min_limit = max(1, min(min_limit, max_limit))
+        self.limit = float(max_limit)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiters = deque()
+        self.epoch = 0
+        self.successes = 0
+        self.failures = 0
+        self.decreases = 0
+        self.shed = 0
+
+    async def acquire(self):
+        """
+        Wait for a slot; returns a token to hand back to release()
+
+        Raises:
+        - ModelOverloaded if the queue is full or the wait took too long
+        """
+        token = self.try_acquire()
+        if token is not None:
+            return token
+        if len(self.waiters) >= self.max_queue:
+            self.shed += 1
+            raise ModelOverloaded(f"{self.in_flight} model calls in flight and {len(self.waiters)} waiting")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.shed += 1
+            raise ModelOverloaded(f"no model slot became free within {self.queue_timeout:g} seconds") from None
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        return self.epoch
+
+    def try_acquire(self):
+        """
+        Take a slot only if one is free right now; returns a token, or None
+        """
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return self.epoch
+        return None
+
+    def _abandon(self, waiter):
+        if waiter.done():
+            # The slot was handed over just as this caller gave up: pass it on
+            self.in_flight -= 1
+            self._wake()
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+
+    def _wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, token, ok):
+        """
+        Give back a slot
+
+        Parameters:
+        - token: Value acquire() returned
+        - ok: True if the call succeeded, False for errors and timeouts,
+          None when it was abandoned by the caller (leaves the limit alone)
+        """
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if ok:
+            self.successes += 1
+            if saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif ok is False:
+            self.failures += 1
+            if token == self.epoch and self.limit > self.min_limit:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.decreases += 1
+                self.epoch += 1
+        self._wake()
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "max_queue": self.max_queue,
+            "successes": self.successes,
+            "failures": self.failures,
+            "decreases": self.decreases,
+            "shed": self.shed,
+        }
+
+
+def _model_slots():
+    """
+    Get the limiter for in-flight model calls on the running event loop
+    """
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        _slots = (loop, AdaptiveLimiter(MAX_CONCURRENT_MODEL_CALLS, MIN_CONCURRENT_MODEL_CALLS,
+                                        MODEL_QUEUE_SIZE, MODEL_QUEUE_TIMEOUT_SECONDS))
+    return _slots[1]
+
+
+def limiter_stats():
+    """
+    Return the model call limiter's metrics (None before the first call)
+    """
+    return _slots[1].stats() if _slots is not None else None
+
+
+def generate_text(model, prompt):
+    """
+    Call the model and return the stripped response text (blocking)
+    """
+    response = model.generate_content(prompt)
+    return response.text.strip()
+
+
+# Cancellation message of the slower of a request and its hedge
+HEDGE_LOST = "hedge lost"
+
+breaker = CircuitBreaker()
+latencies = LatencyTracker()
+_counters = {"attempts": 0, "retries": 0, "hedges": 0, "hedges_won": 0}
+
+
+async def _call_model(model, prompt, slots, token):
+    """
+    Make one model call on an acquired limiter slot and return the stripped text
+
+    A blocking call made in the executor can't be stopped when the request
+    is cancelled (timeout, lost hedge): its slot is only released once the
+    thread is done, so the limiter keeps counting the threads really in use.
+    """
+    start = time.perf_counter()
+    ok = False
+    held = False
+    try:
+        if getattr(model, "generate_content_async", None) is not None:
+            response = await model.generate_content_async(prompt)
+        else:
+            loop = asyncio.get_running_loop()
+            call = loop.run_in_executor(_executor, model.generate_content, prompt)
+            try:
+                response = await asyncio.shield(call)
+            except asyncio.CancelledError as e:
+                outcome = None if e.args == (HEDGE_LOST,) else False
+
+                def release_when_done(done):
+                    if not done.cancelled():
+                        done.exception()  # Retrieved so an abandoned call's error isn't logged as unhandled
+                    slots.release(token, outcome)
+
+                held = True
+                call.add_done_callback(release_when_done)
+                raise
+        ok = True
+    except asyncio.CancelledError as e:
+        if e.args == (HEDGE_LOST,):
+            ok = None  # Its twin answered first, this says nothing about the model
+        raise
+    finally:
+        if not held:
+            slots.release(token, ok)
+    latencies.record(time.perf_counter() - start)
+    return response.text.strip()
+
+
+async def _attempt(model, prompt, timeout):
+    """
+    One attempt at a model call, hedged with a second request when it takes
+    longer than most recent calls did (and a slot is free for it)
+
+    Raises:
+    - TimeoutError if neither request answered within timeout
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    slots = _model_slots()
+    token = await slots.acquire()
+    primary = asyncio.ensure_future(_call_model(model, prompt, slots, token))
+    pending = {primary}
+    answered = False
+    try:
+        delay = latencies.hedge_delay()
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            hedge_token = None if done else slots.try_acquire()
+            if hedge_token is not None:
+                _counters["hedges"] += 1
+                pending.add(asyncio.ensure_future(_call_model(model, prompt, slots, hedge_token)))
+        
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - loop.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"the AI model did not respond within {timeout:g} seconds")
+            for task in done:
+                if task.exception() is None:
+                    answered = True
+                    if task is not primary:
+                        _counters["hedges_won"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            if answered:
+                task.cancel(HEDGE_LOST)
+            else:
+                task.cancel()
+
+
+async def _generate(model, prompt, timeout):
+    """
+    Call the model through the resilience layer: the circuit breaker,
+    attempts of at most MODEL_ATTEMPT_TIMEOUT_SECONDS, and retries with
+    jittered backoff for transient errors, all within timeout
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpen(f"the AI model is unavailable, next try in {breaker.retry_after():.0f}s")
+        _counters["attempts"] += 1
+        try:
+            text = await _attempt(model, prompt, min(resilience.MODEL_ATTEMPT_TIMEOUT_SECONDS, deadline - loop.time()))
+        except ModelOverloaded:
+            breaker.release()  # Shed by the limiter, not the model's fault
+            raise
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            delay = backoff_delay(attempt)
+            if attempt >= resilience.MODEL_RETRIES or loop.time() + delay >= deadline:
+                raise
+            attempt += 1
+            _counters["retries"] += 1
+            print(f"Model call failed ({e}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return text
+
+
+def resilience_stats():
+    """
+    Return retry, hedging and circuit breaker metrics
+    """
+    return dict(_counters, hedge_delay=latencies.hedge_delay(), breaker=breaker.stats())
+
+
+async def _with_timeout(awaitable, timeout):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"the AI model did not respond within {timeout:g} seconds") from None
+
+
+def prompt_fingerprint(model, prompt):
+    """
+    Key identifying a model call: the model client plus a hash of the prompt
+    """
+    return id(model), hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class CallCoalescer:
+    """
+    Single-flight for model calls: concurrent calls with the same key wait
+    on one upstream call and all get its result (or its exception).
+
+    The upstream call runs as a task of its own, so a caller that times out
+    or goes away doesn't cancel it for the others; it is bounded by the
+    timeout of the caller that started it. Callers that join later still
+    give up after their own timeout.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self.upstream_errors = 0
+
+    async def call(self, key, start, timeout):
+        """
+        Run start() unless a call with the same key is in flight, then wait for its result
+
+        Parameters:
+        - key: Fingerprint of the call (see prompt_fingerprint)
+        - start: Function returning the coroutine that makes the upstream call
+        - timeout: Seconds this caller waits
+
+        Raises:
+        - TimeoutError if the result didn't come in time; whatever the upstream call raised
+        """
+        loop = asyncio.get_running_loop()
+        self.calls += 1
+        task = self.in_flight.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(_with_timeout(start(), timeout))
+            self.in_flight[key] = task
+            self.upstream_calls += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced_calls += 1
+        return await _with_timeout(asyncio.shield(task), timeout)
+
+    def _finished(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        # Retrieving the exception also keeps asyncio from logging it when every caller gave up
+        if not task.cancelled() and task.exception() is not None:
+            self.upstream_errors += 1
+
+    def stats(self):
+        """
+        Return call counts: coalesced_calls are the ones that didn't reach the model
+        """
+        return {
+            "calls": self.calls,
+            "upstream_calls": self.upstream_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "upstream_errors": self.upstream_errors,
+            "in_flight": len(self.in_flight),
+        }
+
+
+model_calls = CallCoalescer()
+
+
+async def generate_text_async(model, prompt, timeout=None):
+    """
+    Call the model without blocking the event loop and return the stripped response text
+    
+    Concurrent calls with the same model and prompt share one upstream call
+    (see CallCoalescer) unless COALESCE_MODEL_CALLS is off. Transient errors
+    and stalled attempts are retried, slow attempts can be hedged, and while
+    the circuit breaker is open no call is made (see _generate).
+    
+    Parameters:
+    - model: Model client (GenerativeModel or a stand-in with the same methods)
+    - prompt: Prompt text
+    - timeout: Seconds before giving up (defaults to MODEL_TIMEOUT_SECONDS)
+    
+    Raises:
+    - TimeoutError if the model didn't answer in time
+    - ModelOverloaded if the call was shed by the concurrency limiter
+      (CircuitOpen, a subclass, while the circuit breaker is open)
+    """
+    timeout = MODEL_TIMEOUT_SECONDS if timeout is None else timeout
+    if not COALESCE_MODEL_CALLS:
+        return await _with_timeout(_generate(model, prompt, timeout), timeout)
+    return await model_calls.call(prompt_fingerprint(model, prompt), lambda: _generate(model, prompt, timeout),
+                                  timeout)
+
+
+async def _iterate_in_thread(model, prompt):
+    """
+    Drive a blocking streaming response from the thread pool, one chunk at a time
+    """
+    loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(_executor, lambda: iter(model.generate_content(prompt, stream=True)))
+    done = object()
+    while True:
+        chunk = await loop.run_in_executor(_executor, next, chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+async def stream_text_async(model, prompt, timeout=None):
+    """
+    Call the model in streaming mode and yield the response text as it arrives
+    
+    Holds one of the limiter's slots until the stream ends.
+    
+    Parameters:
+    - model: Model client (GenerativeModel or a stand-in with the same methods)
+    - prompt: Prompt text
+    - timeout: Seconds to wait for a slot, the first chunk, and each following
+      chunk (defaults to MODEL_TIMEOUT_SECONDS)
+    
+    Streams aren't retried or hedged (text may already have been sent), but
+    their failures count towards the circuit breaker.
+    
+    Raises:
+    - TimeoutError if the model stalls for longer than timeout
+    - ModelOverloaded if the call was shed by the concurrency limiter
+      (CircuitOpen while the circuit breaker is open)
+    """
+    timeout = MODEL_TIMEOUT_SECONDS if timeout is None else timeout
+    if not breaker.allow():
+        raise CircuitOpen(f"the AI model is unavailable, next try in {breaker.retry_after():.0f}s")
+    slots = _model_slots()
+    try:
+        token = await _with_timeout(slots.acquire(), timeout)
+    except BaseException:
+        breaker.release()
+        raise
+    ok = False
+    try:
+        if getattr(model, "generate_content_async", None) is not None:
+            response = await _with_timeout(model.generate_content_async(prompt, stream=True), timeout)
+            chunks = response.__aiter__()
+        else:
+            chunks = _iterate_in_thread(model, prompt)
+
+        while True:
+            try:
+                chunk = await _with_timeout(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            if chunk.text:
+                yield chunk.text
+        ok = True
+    except (GeneratorExit, asyncio.CancelledError):
+        # The consumer stopped reading (or the client disconnected and the
+        # response was cancelled), which says nothing about the model
+        ok = None
+        raise
+    except Exception as e:
+        if is_transient(e):
+            breaker.record_failure()
+        raise
+    finally:
+        slots.release(token, ok)
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.release()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Load test: /health latency while chat requests are waiting on the model
+
+Runs the FastAPI app in-process against a FakeModel with injected latency,
+so no Gemini key or running server is needed. Run from the backend directory:
+    python load_test.py            # async /query path
+    python load_test.py --blocking # old behaviour: blocking model call on the event loop
+    python load_test.py --stream   # time to first byte: /query vs /query/stream
+    python load_test.py --workers 4 # requests/s with 1 vs 4 pre-forked workers (run_server.py)
+    python load_test.py --batch    # /query/batch and /items/batch vs one request per element
+    python load_test.py --promo    # many users asking the same question: coalesced vs separate model calls
+    python load_test.py --overload # model over quota: fixed limit vs adaptive limit with load shedding
+    python load_test.py --stalls   # p50/p99 with stalled model calls: plain vs retries vs hedging
+"""
+
+import asyncio
+import json
+import socket
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+import agent
+import main
+from fake_model import BlockingFakeModel, FakeModel
+from response_cache import response_cache
+
+CHAT_REQUESTS = 50
+MODEL_LATENCY = 1.0
+
+# Every request should reach the (fake) model
+response_cache.max_entries = 0
+
+
+@main.app.post("/query/blocking")
+async def blocking_query(request: main.QueryRequest):
+    """The pre-async endpoint: calls the blocking handle_query from the event loop"""
+    return agent.handle_query(request.query, session_id=request.session_id)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def probe_health(client, stop, latencies, interval=0.02):
+    """Call /health every interval; latency is measured from when the probe was due,
+    so time the event loop spent blocked before sending it counts too"""
+    while not stop.is_set():
+        due = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        await client.get("/health")
+        latencies.append((time.perf_counter() - due) * 1000)
+
+
+async def run(blocking):
+    agent.model = BlockingFakeModel(latency=MODEL_LATENCY) if blocking else FakeModel(latency=MODEL_LATENCY)
+    endpoint = "/query/blocking" if blocking else "/query"
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        idle = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_health(client, stop, idle))
+        await asyncio.sleep(0.5)
+        stop.set()
+        await probe
+
+        loaded = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_health(client, stop, loaded))
+        start = time.perf_counter()
+        chats = [
+            # Distinct questions, so identical prompts aren't coalesced into one model call
+            client.post(endpoint, json={"query": f"Do you have any binders? ({i})", "session_id": f"load-{i}"})
+            for i in range(CHAT_REQUESTS)
+        ]
+        responses = await asyncio.gather(*chats)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    ok = sum(1 for response in responses if response.status_code == 200)
+    print(f"🧪 {CHAT_REQUESTS} chat requests via {endpoint} (model latency {MODEL_LATENCY:.1f}s)")
+    print("=" * 50)
+    print(f"   chat requests OK      : {ok}/{CHAT_REQUESTS} in {elapsed:.1f}s")
+    print(f"   /health idle  p50/p99 : {statistics.median(idle):8.1f} / {percentile(idle, 99):8.1f} ms")
+    print(f"   /health load  p50/p99 : {statistics.median(loaded):8.1f} / {percentile(loaded, 99):8.1f} ms"
+          f"  ({len(loaded)} probes)")
+
+
+def start_server():
+    """Serve main.app with uvicorn on a free local port (streaming needs a real socket)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def run_stream(rounds=10):
+    reply = " ".join(["Our Dura Binder is a heavy duty binder at $21.31 with a 10% discount."] * 6)
+    agent.model = FakeModel(latency=0.3, chunk_delay=0.05, chunk_words=4, reply=reply)
+    server, base_url = start_server()
+    payload = {"query": "Do you have any binders?", "session_id": "ttfb"}
+    full, first_event, first_delta = [], [], []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await client.post("/query", json=payload)
+            full.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            async with client.stream("POST", "/query/stream", json=payload) as response:
+                async for line in response.aiter_lines():
+                    event = json.loads(line)
+                    if event["type"] == "context":
+                        first_event.append((time.perf_counter() - start) * 1000)
+                    elif event["type"] == "delta" and len(first_delta) < len(first_event):
+                        first_delta.append((time.perf_counter() - start) * 1000)
+    server.should_exit = True
+
+    print(f"🧪 Time to first byte over {rounds} rounds (model: 0.3s to first chunk, 50ms per chunk)")
+    print("=" * 50)
+    print(f"   /query full response       : {statistics.median(full):8.1f} ms")
+    print(f"   /query/stream item context : {statistics.median(first_event):8.1f} ms")
+    print(f"   /query/stream first text   : {statistics.median(first_delta):8.1f} ms")
+
+
+def serve(workers, port):
+    """Run the production launcher with a zero-latency FakeModel standing in for Gemini"""
+    import run_server
+    agent.model = FakeModel(latency=0)
+    run_server.serve_production("127.0.0.1", port, workers, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+THROUGHPUT_CASES = [
+    ("/items/search", {"search_query": "binder", "sort_by": "price", "limit": 10}),
+    ("/query", {"query": "Do you have any binders under $30?", "session_id": "throughput"}),
+]
+
+
+async def measure_throughput(base_url, endpoint, payload, concurrency=32, duration=5.0):
+    """Return requests/s and the error count for endpoint under concurrency clients"""
+    count, errors = 0, 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        nonlocal count, errors
+        while time.perf_counter() < deadline:
+            response = await client.post(endpoint, json=payload)
+            count += 1
+            errors += response.status_code != 200
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return count / elapsed, errors
+
+
+async def wait_until_ready(base_url, timeout=60):
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"server at {base_url} did not become ready")
+
+
+async def run_workers(workers):
+    print(f"🧪 Throughput with 1 vs {workers} workers (stubbed model, {os.cpu_count()} CPUs)")
+    print("=" * 50)
+    results = {}
+    for count in sorted({1, workers}):
+        port = free_port()
+        server = subprocess.Popen([sys.executable, __file__, "--serve", str(count), str(port)])
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            await wait_until_ready(base_url)
+            for endpoint, payload in THROUGHPUT_CASES:
+                results[count, endpoint] = await measure_throughput(base_url, endpoint, payload)
+        finally:
+            server.terminate()
+            server.wait()
+
+    for endpoint, _ in THROUGHPUT_CASES:
+        single, _ = results[1, endpoint]
+        for count in sorted({1, workers}):
+            rate, errors = results[count, endpoint]
+            print(f"   {endpoint:14} {count:2} worker(s): {rate:8.0f} req/s"
+                  f"  ({rate / single:4.1f}x, {errors} errors)")
+
+
+async def run_batch(queries=200, lookups=1000, model_latency=0.02):
+    """Throughput of one request per element vs the batch endpoints, over a real socket"""
+    agent.model = FakeModel(latency=model_latency)
+    server, base_url = start_server()
+    payloads = [{"query": f"Do you have any binders? ({i})", "session_id": f"batch-{i}"} for i in range(queries)]
+    items = agent.load_all_data()
+    ids = [items[i % len(items)]["item_id"] for i in range(lookups)]
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        start = time.perf_counter()
+        for payload in payloads:
+            await client.post("/query", json=payload)
+        query_sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        body = (await client.post("/query/batch", json={"queries": payloads})).json()
+        query_batch = time.perf_counter() - start
+        assert body["errors"] == 0
+
+        start = time.perf_counter()
+        for item_id in ids:
+            await client.get(f"/items/{item_id}")
+        lookup_sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        body = (await client.post("/items/batch", json={"ids": ids})).json()
+        lookup_batch = time.perf_counter() - start
+        assert body["errors"] == 0
+    server.should_exit = True
+
+    print(f"🧪 Batch endpoints vs one request per element (model latency {model_latency * 1000:.0f} ms,"
+          f" batch concurrency {agent.BATCH_CONCURRENCY})")
+    print("=" * 50)
+    rows = [
+        (f"{queries} queries, sequential /query", queries / query_sequential, query_sequential, 1),
+        (f"{queries} queries, /query/batch", queries / query_batch, query_batch, query_sequential / query_batch),
+        (f"{lookups} IDs, sequential /items/{{id}}", lookups / lookup_sequential, lookup_sequential, 1),
+        (f"{lookups} IDs, /items/batch", lookups / lookup_batch, lookup_batch, lookup_sequential / lookup_batch),
+    ]
+    for label, rate, elapsed, speedup in rows:
+        print(f"   {label:36} {rate:9.0f}/s  ({elapsed:6.2f}s, {speedup:4.1f}x)")
+
+async def run_promo(users=50, model_latency=0.5):
+    """Everyone sends the same opening question at once, with and without coalescing"""
+    import llm
+    transport = httpx.ASGITransport(app=main.app)
+    payloads = [{"query": "What's on promotion today?", "session_id": f"promo-{i}"} for i in range(users)]
+
+    print(f"🧪 {users} users send the same question at once (model latency {model_latency:.1f}s,"
+          f" {llm.MAX_CONCURRENT_MODEL_CALLS} model slots)")
+    print("=" * 50)
+    for coalesce in [False, True]:
+        llm.COALESCE_MODEL_CALLS = coalesce
+        agent.model = FakeModel(latency=model_latency)
+        before = llm.model_calls.stats()
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[client.post("/query", json=payload) for payload in payloads])
+            elapsed = time.perf_counter() - start
+        coalesced = llm.model_calls.stats()["coalesced_calls"] - before["coalesced_calls"]
+        ok = sum(1 for response in responses if response.status_code == 200)
+        print(f"   coalescing {'on ' if coalesce else 'off'}: {agent.model.calls:3} model calls,"
+              f" {coalesced:3} coalesced, {ok}/{users} OK, all answered in {elapsed:.2f}s")
+
+
+async def run_overload(users=200, model_latency=1.0, error_rate=0.7):
+    """A burst of questions while the model fails slowly (as when over quota):
+    the old fixed limit with an unbounded queue vs the adaptive limiter"""
+    import llm
+    transport = httpx.ASGITransport(app=main.app)
+    payloads = [{"query": f"Any binders for office {i}?", "session_id": f"overload-{i}"} for i in range(users)]
+    scenarios = [
+        ("fixed limit, unbounded queue", dict(MIN_CONCURRENT_MODEL_CALLS=llm.MAX_CONCURRENT_MODEL_CALLS,
+                                              MODEL_QUEUE_SIZE=users, MODEL_QUEUE_TIMEOUT_SECONDS=3600)),
+        ("adaptive limit + shedding", {}),
+    ]
+
+    print(f"🧪 {users} questions while the model fails {error_rate:.0%} of calls after {model_latency:.1f}s")
+    print("=" * 50)
+    for label, settings in scenarios:
+        original = {name: getattr(llm, name) for name in settings}
+        for name, value in settings.items():
+            setattr(llm, name, value)
+        llm._slots = None
+        agent.model = FakeModel(latency=model_latency, error_rate=error_rate, seed=1)
+
+        async def timed(client, payload):
+            start = time.perf_counter()
+            response = await client.post("/query", json=payload)
+            return (time.perf_counter() - start) * 1000, response.json()
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+            start = time.perf_counter()
+            results = await asyncio.gather(*[timed(client, payload) for payload in payloads])
+            elapsed = time.perf_counter() - start
+        limiter = llm.limiter_stats()
+        for name, value in original.items():
+            setattr(llm, name, value)
+
+        latencies = [latency for latency, _ in results]
+        degraded = sum(1 for _, body in results if body.get("degraded"))
+        failed = sum(1 for _, body in results if "encountered an error" in body["response"])
+        print(f"   {label}:")
+        print(f"      model answers {users - degraded - failed:4} | errors {failed:4} | catalog fallback {degraded:4}"
+              f" | {agent.model.calls} model calls, limit ended at {limiter['limit']}")
+        print(f"      latency p50/p99 {statistics.median(latencies):7.0f} / {percentile(latencies, 99):7.0f} ms"
+              f" | all done in {elapsed:.1f}s")
+
+
+async def run_stalls(calls=400, model_latency=0.05, stall_rate=0.05, stall_seconds=3.0):
+    """Latency percentiles when some model calls stall, with each resilience feature"""
+    import llm
+    import resilience
+    scenarios = [
+        ("no retries, no hedging", dict(MODEL_RETRIES=0, MODEL_HEDGE=False)),
+        ("attempt timeout 0.3s + retries", dict(MODEL_ATTEMPT_TIMEOUT_SECONDS=0.3, MODEL_HEDGE=False)),
+        ("hedging at p95", dict(MODEL_RETRIES=0, MODEL_HEDGE=True)),
+        ("hedging + attempt timeout + retries", dict(MODEL_ATTEMPT_TIMEOUT_SECONDS=0.3, MODEL_HEDGE=True)),
+    ]
+    # Room for every call: this measures latency, not load shedding (see --overload)
+    llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE = 64, calls
+    print(f"🧪 {calls} model calls, {model_latency * 1000:.0f} ms each, {stall_rate:.0%} stall for {stall_seconds:.0f}s")
+    print("=" * 50)
+    for label, settings in scenarios:
+        original = {name: getattr(resilience, name) for name in settings}
+        for name, value in settings.items():
+            setattr(resilience, name, value)
+        llm._slots = None
+        llm.breaker = resilience.CircuitBreaker()
+        llm.latencies = resilience.LatencyTracker()
+        model = FakeModel(latency=model_latency, stall_rate=stall_rate, stall_seconds=stall_seconds, seed=3)
+        before = llm.resilience_stats()
+
+        async def one(i):
+            start = time.perf_counter()
+            await llm.generate_text_async(model, f"stall test {i}")
+            return (time.perf_counter() - start) * 1000
+
+        for i in range(resilience.MODEL_HEDGE_MIN_SAMPLES):
+            await llm.generate_text_async(FakeModel(latency=model_latency), f"warm-up {i}")
+        # Arrivals spread out a little, as real traffic is
+        tasks = []
+        for i in range(calls):
+            tasks.append(asyncio.create_task(one(i)))
+            await asyncio.sleep(0.002)
+        latencies = await asyncio.gather(*tasks)
+        after = llm.resilience_stats()
+        for name, value in original.items():
+            setattr(resilience, name, value)
+
+        print(f"   {label:36} p50 {statistics.median(latencies):6.0f} ms | p99 {percentile(latencies, 99):6.0f} ms"
+              f" | {model.calls} model calls ({after['retries'] - before['retries']} retries,"
+              f" {after['hedges'] - before['hedges']} hedges)")
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        position = sys.argv.index("--serve")
+        serve(int(sys.argv[position + 1]), int(sys.argv[position + 2]))
+    elif "--workers" in sys.argv:
+        asyncio.run(run_workers(int(sys.argv[sys.argv.index("--workers") + 1])))
+    elif "--stalls" in sys.argv:
+        asyncio.run(run_stalls())
+    elif "--overload" in sys.argv:
+        asyncio.run(run_overload())
+    elif "--promo" in sys.argv:
+        asyncio.run(run_promo())
+    elif "--batch" in sys.argv:
+        asyncio.run(run_batch())
+    elif "--stream" in sys.argv:
+        asyncio.run(run_stream())
+    else:
+        asyncio.run(run(blocking="--blocking" in sys.argv))
@@ -1,13 +1,73 @@
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from agent import handle_query
-from file_loader import load_all_data, search_items, get_item_by_id
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from agent import handle_query_async, handle_query_batch_async, run_blocking, stream_query_async
+from llm import ModelOverloaded
+from file_loader import (load_all_data, search_items, iter_search_items, get_item_by_id, get_items_by_ids,
+                         catalog_fingerprint_of, get_item_fields, get_item_json)
+from pagination import (ITEMS_PAGE_SIZE, STREAM_BATCH_SIZE, FastJSONResponse, cache_headers, catalog_etag,
+                        decode_cursor, encode_cursor, encode_items, etag_matches, item_etag, ndjson_chunks,
+                        not_modified, parse_fields, query_fingerprint)
+from serialization import dumps, splice_items
+from typing import Any, List, Optional
 import os
+import asyncio
 from dotenv import load_dotenv
 
 load_dotenv()
-app = FastAPI()
+
+# What to do at start-up before the first request:
+# "background" - build the catalog indexes and create the model client in a
+#                thread while already serving (/ready turns 200 when done)
+# "blocking"   - finish that before accepting requests
+# "off"        - nothing, everything is loaded on first use
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+# Largest number of queries or IDs accepted by one /query/batch or /items/batch request
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+# Longest query accepted, in characters (naming an item is checked against every substring of the query)
+MAX_QUERY_LENGTH = int(os.getenv("MAX_QUERY_LENGTH", "2000"))
+# Retry-After (seconds) sent with 429 answers when model calls are shed
+OVERLOAD_RETRY_AFTER = os.getenv("OVERLOAD_RETRY_AFTER", "2")
+
+def prepare_catalog():
+    """Load and index the catalog
+
+    The production launcher calls this before forking workers, so they all
+    share the parsed catalog and its indexes copy-on-write."""
+    from agent import warm_catalog
+    snapshot = warm_catalog()
+    app.state.catalog_version = snapshot.version
+    return snapshot
+
+def warm_up():
+    """Build the catalog indexes and create the model client, then mark the app ready"""
+    from agent import get_model
+    if app.state.catalog_version is None:
+        prepare_catalog()
+    get_model()
+    app.state.ready = True
+
+@asynccontextmanager
+async def lifespan(app):
+    from agent import conversation_memory
+    conversation_memory.start_sweeper()
+    if STARTUP_WARMUP == "off":
+        app.state.ready = True
+    elif STARTUP_WARMUP == "blocking":
+        await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    else:
+        # /health answers right away, /ready once the warm-up is done
+        app.state.warmup = asyncio.get_running_loop().run_in_executor(None, warm_up)
+    yield
+    conversation_memory.stop_sweeper()
+
+app = FastAPI(lifespan=lifespan)
+# Version of the catalog whose indexes are built, and whether the warm-up is
+# done; /ready reports 503 until it is
+app.state.catalog_version = None
+app.state.ready = False
 
 # Add CORS middleware to allow frontend connections
 app.add_middleware(
@@ -19,7 +79,7 @@ app.add_middleware(
 )
 
 class QueryRequest(BaseModel):
-    query: str
+    query: str = Field(max_length=MAX_QUERY_LENGTH)
     session_id: str = "default"
 
 class ItemSearchRequest(BaseModel):
@@ -27,50 +87,205 @@ class ItemSearchRequest(BaseModel):
     min_price: float = None
     max_price: float = None
     sort_by: str = None
+    limit: int = None
+    # Optional so a client can send back next_cursor as it got it, null included
+    cursor: Optional[str] = None
+    fields: Optional[List[str]] = None
 
 @app.post("/query")
 async def query_agent(request: QueryRequest):
     """Main endpoint for chat interactions with the agent with session tracking"""
-    result = handle_query(request.query, session_id=request.session_id)
+    try:
+        result = await handle_query_async(request.query, session_id=request.session_id)
+    except ModelOverloaded as e:
+        # Only raised with OVERLOAD_RESPONSE=reject; the default degrades to the catalog-only answer
+        return JSONResponse({"error": f"The assistant is busy, please retry shortly ({e})"}, status_code=429,
+                            headers={"Retry-After": OVERLOAD_RETRY_AFTER})
     return result
 
+class QueryBatchRequest(BaseModel):
+    # Each element is a QueryRequest, validated on its own so one bad element doesn't fail the batch
+    queries: List[Any]
+
+class ItemBatchRequest(BaseModel):
+    ids: List[Any]
+    fields: Optional[List[str]] = None
+
+@app.post("/query/batch")
+async def query_batch(request: QueryBatchRequest):
+    """Answer many queries in one request. Results come back in order, each
+    {"ok": true, "result": ...} or {"ok": false, "error": ...}"""
+    if len(request.queries) > MAX_BATCH_SIZE:
+        return JSONResponse({"error": f"At most {MAX_BATCH_SIZE} queries per batch"}, status_code=400)
+    results = [None] * len(request.queries)
+    valid = []
+    for index, element in enumerate(request.queries):
+        try:
+            valid.append((index, QueryRequest.model_validate(element)))
+        except ValidationError as e:
+            results[index] = {"ok": False, "error": f"Invalid query: {e.errors()[0]['msg']}"}
+    
+    answers = await handle_query_batch_async([(query.query, query.session_id) for _, query in valid])
+    for (index, _), answer in zip(valid, answers):
+        if isinstance(answer, Exception):
+            results[index] = {"ok": False, "error": str(answer)}
+        else:
+            results[index] = {"ok": True, "result": answer}
+    return {"results": results, "count": len(results),
+            "errors": sum(1 for result in results if not result["ok"])}
+
+@app.post("/query/stream")
+async def stream_query(request: QueryRequest):
+    """Chat endpoint that streams the answer as newline-delimited JSON events
+    (context first, then text deltas, then done)"""
+    async def events():
+        async for event in stream_query_async(request.query, session_id=request.session_id):
+            yield dumps(event) + b"\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "message": "Items Sales AI Agent is running"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the catalog is indexed and the model client created"""
+    if not app.state.ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True, "catalog_version": app.state.catalog_version, "pid": os.getpid()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime metrics (AI response cache hit rate, coalesced model calls etc.)"""
+    from response_cache import response_cache
+    from agent import conversation_memory
+    from llm import limiter_stats, model_calls, resilience_stats
+    from fast_path import fast_path_stats
+    return {"response_cache": response_cache.stats(), "sessions": conversation_memory.stats(),
+            "model_calls": model_calls.stats(), "model_limiter": limiter_stats(),
+            "model_resilience": resilience_stats(), "fast_path": fast_path_stats()}
+
 @app.get("/conversation/{session_id}")
 async def get_conversation(session_id: str):
     """Get conversation history for a specific session"""
     from agent import get_conversation_history
-    history = get_conversation_history(session_id)
+    history = await run_blocking(get_conversation_history, session_id)
     return {"session_id": session_id, "history": history}
 
 @app.get("/items")
-async def get_all_items():
-    """Get all items in inventory"""
-    items_data = load_all_data()
-    return {"items": items_data}
+async def get_all_items(cursor: str = None, limit: int = None, fields: str = None, format: str = None,
+                        if_none_match: str = Header(None)):
+    """Get items in inventory: all of them, a page at a time (limit, then the
+    returned next_cursor), or streamed as NDJSON with format=ndjson.
+    fields is a comma-separated list of the fields to return.
+    Responses carry an ETag; send it back in If-None-Match to get a 304
+    while the catalog hasn't changed."""
+    items_data = await run_blocking(load_all_data)
+    catalog_fingerprint = catalog_fingerprint_of(items_data)
+    etag = catalog_etag(catalog_fingerprint, {"cursor": cursor, "limit": limit, "fields": fields, "format": format})
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    try:
+        fields = parse_fields(fields, get_item_fields(items_data))
+        offset = decode_cursor(cursor, catalog_fingerprint) if cursor else 0
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if cursor and limit is None:
+        limit = ITEMS_PAGE_SIZE
+    stop = len(items_data) if limit is None else min(len(items_data), offset + max(limit, 0))
+    
+    item_json = get_item_json(items_data)
+    if format == "ndjson":
+        batches = (items_data[start:min(start + STREAM_BATCH_SIZE, stop)]
+                   for start in range(offset, stop, STREAM_BATCH_SIZE))
+        return StreamingResponse(ndjson_chunks(batches, fields, item_json), media_type="application/x-ndjson",
+                                 headers=cache_headers(etag))
+    
+    # Items are spliced in from their cached JSON rather than encoded per request
+    # (reading the page runs in the thread pool, it is a query on the SQLite catalog)
+    page = await run_blocking(lambda: encode_items(items_data[offset:stop], fields, item_json))
+    if limit is None:
+        return FastJSONResponse(splice_items(page), headers=cache_headers(etag))
+    next_cursor = encode_cursor(catalog_fingerprint, stop) if stop < len(items_data) and limit > 0 else None
+    return FastJSONResponse(splice_items(page, count=len(page), next_cursor=next_cursor), headers=cache_headers(etag))
 
 @app.post("/items/search")
-async def search_items_endpoint(request: ItemSearchRequest):
-    """Search for items with filters"""
-    items_data = load_all_data()
-    results = search_items(
-        items_data,
-        search_query=request.search_query,
-        min_price=request.min_price,
-        max_price=request.max_price,
-        sort_by=request.sort_by
-    )
-    return {"items": results, "count": len(results)}
+async def search_items_endpoint(request: ItemSearchRequest, format: str = None):
+    """Search for items with filters; paginated with limit/cursor like /items,
+    projected with fields, streamed as NDJSON with ?format=ndjson"""
+    items_data = await run_blocking(load_all_data)
+    catalog_fingerprint = catalog_fingerprint_of(items_data)
+    filters = {
+        "search_query": request.search_query,
+        "min_price": request.min_price,
+        "max_price": request.max_price,
+        "sort_by": request.sort_by,
+    }
+    fingerprint = query_fingerprint(filters)
+    try:
+        fields = parse_fields(request.fields, get_item_fields(items_data))
+        offset = decode_cursor(request.cursor, catalog_fingerprint, fingerprint) if request.cursor else 0
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    limit = request.limit
+    if request.cursor and limit is None:
+        limit = ITEMS_PAGE_SIZE
+    
+    item_json = get_item_json(items_data)
+    if format == "ndjson":
+        batches = iter_search_items(items_data, STREAM_BATCH_SIZE, limit=limit, offset=offset, **filters)
+        return StreamingResponse(ndjson_chunks(batches, fields, item_json), media_type="application/x-ndjson")
+    
+    # One row past the page tells whether there is a next page
+    results = await run_blocking(lambda: search_items(items_data, limit=None if limit is None else limit + 1,
+                                                      offset=offset, **filters))
+    if limit is None:
+        return FastJSONResponse(splice_items(encode_items(results, fields, item_json), count=len(results)))
+    has_more = limit > 0 and len(results) > limit
+    results = results[:max(limit, 0)]
+    next_cursor = encode_cursor(catalog_fingerprint, offset + len(results), fingerprint) if has_more else None
+    page = encode_items(results, fields, item_json)
+    return FastJSONResponse(splice_items(page, count=len(page), next_cursor=next_cursor))
+
+@app.post("/items/batch")
+async def get_items_batch(request: ItemBatchRequest):
+    """Look up many items by ID in one request. Results come back in order,
+    each {"id", "ok": true, "item"} or {"id", "ok": false, "error"}"""
+    if len(request.ids) > MAX_BATCH_SIZE:
+        return JSONResponse({"error": f"At most {MAX_BATCH_SIZE} IDs per batch"}, status_code=400)
+    items_data = await run_blocking(load_all_data)
+    try:
+        fields = parse_fields(request.fields, get_item_fields(items_data))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    
+    # One lookup for all the IDs; encoding reuses the cached item JSON
+    lookups = iter(await run_blocking(get_items_by_ids, items_data,
+                                      [item_id for item_id in request.ids if isinstance(item_id, str)]))
+    items = [next(lookups) if isinstance(item_id, str) else None for item_id in request.ids]
+    encoded = iter(encode_items([item for item in items if item is not None], fields, get_item_json(items_data)))
+    
+    results = []
+    for item_id, item in zip(request.ids, items):
+        if item is not None:
+            results.append(b'{"id":' + dumps(item_id) + b',"ok":true,"item":' + next(encoded) + b'}')
+        else:
+            error = f"Item with ID {item_id} not found" if isinstance(item_id, str) else "Item IDs must be strings"
+            results.append(dumps({"id": item_id, "ok": False, "error": error}))
+    return FastJSONResponse(splice_items(results, key="results", count=len(results), errors=items.count(None)))
 
 @app.get("/items/{item_id}")
-async def get_item(item_id: str):
-    """Get a specific item by ID"""
-    items_data = load_all_data()
-    item = get_item_by_id(items_data, item_id)
+async def get_item(item_id: str, if_none_match: str = Header(None)):
+    """Get a specific item by ID (with an ETag of its own, see /items)"""
+    items_data = await run_blocking(load_all_data)
+    item = await run_blocking(get_item_by_id, items_data, item_id)
     if item:
-        return {"item": item}
+        encoded, = encode_items([item], item_json=get_item_json(items_data))
+        etag = item_etag(encoded)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        return FastJSONResponse(b'{"item":' + encoded + b'}', headers=cache_headers(etag))
     return {"error": f"Item with ID {item_id} not found"}, 404
 
 if __name__ == "__main__":
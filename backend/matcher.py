@@ -0,0 +1,131 @@
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds every occurrence of a set of patterns in a
+    text with a single left-to-right scan, independent of the number of patterns.
+    """
+
+    def __init__(self, patterns):
+        """
+        Parameters:
+        - patterns: List of strings; matches are reported by their index in this list
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        # Nearest state along the failure chain that ends a pattern
+        self.output_link = [0]
+
+        for pattern_id, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.output_link.append(0)
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.output[state].append(pattern_id)
+
+        # Breadth-first pass to fill in failure and output links
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                failed = self.fail[next_state]
+                self.output_link[next_state] = failed if self.output[failed] else self.output_link[failed]
+
+    def find_all(self, text):
+        """
+        Return the set of pattern indexes that occur in text
+        """
+        goto, fail, output, output_link = self.goto, self.fail, self.output, self.output_link
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match_state = state if output[state] else output_link[state]
+            while match_state:
+                found.update(output[match_state])
+                match_state = output_link[match_state]
+        return found
+
+
+def distinct_names(items):
+    """
+    Return (lowercased name, position of the first item with it) for each
+    distinct item name, in catalog order
+    """
+    first_position = {}
+    for position, item in enumerate(items):
+        first_position.setdefault(str(item.get('item_name', '')).lower(), position)
+    return list(first_position.items())
+
+
+class QueryMatcher:
+    """
+    Finds the category keywords and catalog item names mentioned in a query.
+
+    One automaton covers both, so a chat message is matched with a single
+    scan no matter how many items are in the catalog.
+    """
+
+    def __init__(self, items, keywords, names=None):
+        """
+        Parameters:
+        - items: Sequence of item dictionaries
+        - keywords: Category keywords, in the order they should be tried
+        - names: distinct_names(items), when it is already known (a compiled
+          catalog stores it)
+        """
+        self.items = items
+        self.keywords = list(keywords)
+
+        patterns = list(self.keywords)
+        # Pattern of each distinct lowercased item name -> position of the first item with that name
+        self.name_positions = []
+        self.empty_name_position = None
+        for name, position in (distinct_names(items) if names is None else names):
+            if not name:
+                self.empty_name_position = position
+                continue
+            patterns.append(name)
+            self.name_positions.append(position)
+
+        self.automaton = AhoCorasick(patterns)
+
+    def match(self, query_lower):
+        """
+        Parameters:
+        - query_lower: Lowercased user query
+
+        Returns:
+        - Tuple of (keywords found, in keyword order; first catalog item whose
+          name appears in the query, or None)
+        """
+        found = self.automaton.find_all(query_lower)
+        keyword_count = len(self.keywords)
+
+        keywords = [self.keywords[pattern_id] for pattern_id in sorted(found) if pattern_id < keyword_count]
+
+        positions = [self.name_positions[pattern_id - keyword_count] for pattern_id in found if pattern_id >= keyword_count]
+        if self.empty_name_position is not None:
+            positions.append(self.empty_name_position)
+        item = self.items[min(positions)] if positions else None
+
+        return keywords, item
@@ -0,0 +1,170 @@
+import base64
+import hashlib
+import json
+import os
+
+from fastapi.responses import Response
+
+from serialization import dumps
+
+# Page size for cursor requests that don't give a limit
+ITEMS_PAGE_SIZE = int(os.getenv("ITEMS_PAGE_SIZE", "100"))
+# Rows serialized per chunk of a streamed (NDJSON) response
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# Cache-Control of catalog responses: clients may keep them, but revalidate (If-None-Match) before reuse
+ITEMS_CACHE_CONTROL = os.getenv("ITEMS_CACHE_CONTROL", "public, no-cache")
+
+
+class CursorError(ValueError):
+    """A pagination cursor is malformed or no longer matches the catalog or query"""
+
+
+def query_fingerprint(params):
+    """
+    Short hash identifying the filters a cursor was issued for
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(catalog_fingerprint, offset, fingerprint=None):
+    """
+    Build the opaque cursor for the page starting at offset
+
+    catalog_fingerprint identifies the catalog's content
+    (file_loader.catalog_fingerprint), so a cursor stays valid on every
+    worker and across restarts, but not once the catalog changes.
+    """
+    payload = json.dumps({"v": catalog_fingerprint, "o": offset, "q": fingerprint}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, catalog_fingerprint, fingerprint=None):
+    """
+    Return the offset a cursor points at
+
+    Raises CursorError if the cursor can't be read, was issued for another
+    query, or for an older version of the catalog (positions may have moved).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        offset = int(payload["o"])
+    except (ValueError, KeyError, TypeError, UnicodeError):
+        raise CursorError("Invalid cursor")
+    if payload.get("q") != fingerprint or offset < 0:
+        raise CursorError("Cursor does not belong to this query")
+    if payload.get("v") != catalog_fingerprint:
+        raise CursorError("The catalog has changed since this cursor was issued, start again from the first page")
+    return offset
+
+
+def catalog_etag(catalog_fingerprint, params):
+    """
+    Strong ETag of a catalog listing: the catalog's content fingerprint
+    (file_loader.catalog_fingerprint) plus the query it answers
+    """
+    return f'"c{catalog_fingerprint}-{query_fingerprint(params)}"'
+
+
+def item_etag(encoded_item):
+    """
+    Strong ETag of one item, from its JSON bytes (it survives reloads that don't change the item)
+    """
+    return f'"i{hashlib.sha256(encoded_item).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header value matches etag (weak comparison, as RFC 9110 asks for GET)
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == "*" or tag.removeprefix("W/") == etag for tag in tags)
+
+
+def cache_headers(etag):
+    return {"ETag": etag, "Cache-Control": ITEMS_CACHE_CONTROL}
+
+
+def not_modified(etag):
+    """
+    Empty 304 response for a client that already has the representation etag names
+    """
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def parse_fields(fields, available):
+    """
+    Parse a field projection
+
+    Parameters:
+    - fields: Comma-separated string or list of field names, or None for all fields
+    - available: Field names items have
+
+    Returns:
+    - List of field names, or None to keep whole items
+    """
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    fields = [field.strip() for field in fields if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (available: {', '.join(available)})")
+    return fields or None
+
+
+def project(items, fields):
+    """
+    Return items reduced to the given fields (unchanged when fields is None)
+    """
+    if fields is None:
+        return list(items)
+    return [{field: item.get(field) for field in fields} for item in items]
+
+
+def encode_items(items, fields=None, item_json=None):
+    """
+    Serialize items to JSON bytes, one per item
+
+    Parameters:
+    - items: Item dictionaries
+    - fields: Fields to keep (None for whole items)
+    - item_json: ItemJSONCache of the catalog the items come from; whole
+      items are then taken from it instead of being encoded again
+
+    Returns:
+    - List of JSON bytes
+    """
+    if fields is not None:
+        return [dumps(item) for item in project(items, fields)]
+    if item_json is not None:
+        return item_json.encode(items)
+    return [dumps(item) for item in items]
+
+
+def ndjson_chunks(batches, fields=None, item_json=None):
+    """
+    Serialize batches of items as newline-delimited JSON, one chunk per batch
+
+    Only one batch is held at a time, so a streamed response needs the
+    same memory whatever the number of rows.
+    """
+    for batch in batches:
+        yield b"".join(line + b"\n" for line in encode_items(batch, fields, item_json))
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response that skips FastAPI's jsonable_encoder: content that is
+    already bytes (see serialization.splice_items) is sent as is, anything
+    else goes through serialization.dumps
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,118 @@
+from file_loader import snapshot_for
+
+# Static parts of the prompt, around the conversation, query and items sections
+PROMPT_HEADER = """
+You are a helpful sales assistant for an e-commerce store. Based on the query and conversation history,
+help the customer find products they're looking for or answer questions about our inventory.
+
+CONVERSATION HISTORY:
+"""
+PROMPT_QUERY = """
+
+CURRENT CUSTOMER QUERY: """
+PROMPT_ITEMS = """
+
+ITEMS INFORMATION:
+"""
+PROMPT_INSTRUCTIONS = """
+
+INSTRUCTIONS:
+1. If the customer is asking about an item already mentioned in the conversation, use that context.
+2. If the query refers to "it", "this item", "that product", etc., assume they are talking about the item marked [CURRENTLY DISCUSSING].
+3. If the customer is asking about price, features, availability, or discounts, look for the relevant item in the context.
+4. Be concise, helpful, and specific in your recommendations.
+5. ALWAYS mention the exact discount percentage when discussing an item that has a discount.
+6. ALWAYS include the item description in your response when focusing on a specific item.
+7. If answering a follow-up question about a specific item, always mention the item name for clarity.
+8. When discussing prices, always format them as $XX.XX with two decimal places.
+"""
+
+
+def render_item_details(item):
+    """
+    Render the details of an item (everything after "Item: ") for the prompt
+    """
+    return (f"ID={item['item_id']}, Name={item['item_name']}, "
+            f"Price=${item['price']:.2f}, Quantity={item['item_quantity']}, "
+            f"Description={item.get('item_description', 'No description available')}, "
+            f"Discount={item.get('maximum_discount', 0)*100:.0f}%\n")
+
+
+def render_item_summary(item):
+    """
+    Render the shorter item details (no quantity) used for recently discussed items
+    """
+    return (f"ID={item['item_id']}, Name={item['item_name']}, "
+            f"Price=${item['price']:.2f}, "
+            f"Description={item.get('item_description', 'No description available')}, "
+            f"Discount={item.get('maximum_discount', 0)*100:.0f}%\n")
+
+
+class ItemLines:
+    """
+    Prompt fragments for catalog items, rendered once per catalog version.
+
+    Lines are rendered the first time an item is used and reused by every
+    later prompt. Items that aren't part of this catalog version (like ones
+    remembered from an older version in a conversation, or read back from
+    the SQLite session store) are rendered on the fly and not kept.
+    """
+
+    def __init__(self, items=()):
+        # ids of the catalog's items; the catalog holds on to them, so the ids can't be reused
+        self.members = {id(item) for item in items}
+        # id(item) -> (details, summary)
+        self.lines = {}
+
+    def _lines(self, item):
+        lines = self.lines.get(id(item))
+        if lines is None:
+            lines = (render_item_details(item), render_item_summary(item))
+            if id(item) in self.members:
+                self.lines[id(item)] = lines
+        return lines
+
+    def details(self, item):
+        return self._lines(item)[0]
+
+    def summary(self, item):
+        return self._lines(item)[1]
+
+
+def get_item_lines(items_data):
+    """
+    Get the item line cache for items_data (shared per catalog version)
+    """
+    snapshot = snapshot_for(items_data)
+    if snapshot is not None and snapshot.compiled is None:
+        return snapshot.derived("prompt_lines", lambda snap: ItemLines(snap.items))
+    return ItemLines()
+
+
+def render_conversation(conversation_history):
+    """
+    Return the conversation history as a list of prompt lines
+    """
+    lines = []
+    for entry in conversation_history:
+        if entry["role"] == "user":
+            lines.append(f"Customer: {entry['content']}\n")
+        else:
+            # Truncate long responses
+            response = entry['content']
+            if len(response) > 200:
+                response = response[:197] + "..."
+            lines.append(f"Assistant: {response}\n")
+    return lines
+
+
+def assemble_prompt(query, conversation_lines, item_lines):
+    """
+    Join the static prompt parts and the rendered fragments into the prompt
+    """
+    return "".join([
+        PROMPT_HEADER, *conversation_lines,
+        PROMPT_QUERY, query,
+        PROMPT_ITEMS, *item_lines,
+        PROMPT_INSTRUCTIONS,
+    ])
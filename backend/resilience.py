@@ -0,0 +1,151 @@
+import os
+import random
+import time
+from collections import deque
+
+# Extra attempts after a transient model error or a stalled attempt (0 disables retries)
+MODEL_RETRIES = int(os.getenv("MODEL_RETRIES", "2"))
+# Backoff before retry n is random between 0 and min(MAX, BASE * 2**n) seconds ("full jitter")
+MODEL_RETRY_BASE_DELAY = float(os.getenv("MODEL_RETRY_BASE_DELAY", "0.2"))
+MODEL_RETRY_MAX_DELAY = float(os.getenv("MODEL_RETRY_MAX_DELAY", "2"))
+# A single attempt is abandoned (and retried) after this long; MODEL_TIMEOUT_SECONDS bounds them all
+MODEL_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("MODEL_ATTEMPT_TIMEOUT_SECONDS", "10"))
+# Send a second, hedged request when the first is slower than this percentile of recent calls
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "false").lower() == "true"
+MODEL_HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE", "95"))
+MODEL_HEDGE_MIN_SAMPLES = int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "20"))
+# Open the circuit after this many transient failures in a row, for this many seconds
+MODEL_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "5"))
+MODEL_BREAKER_COOLDOWN_SECONDS = float(os.getenv("MODEL_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# HTTP statuses (exception .code) and exception names of errors worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_ERROR_NAMES = {"DeadlineExceeded", "InternalServerError", "ResourceExhausted", "ServiceUnavailable",
+                         "TooManyRequests", "GatewayTimeout", "BadGateway"}
+
+
+def is_transient(error):
+    """
+    Whether a model error is likely to go away on retry: timeouts, connection
+    problems, rate limiting and server-side errors (as raised by the Google SDK)
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS_CODES:
+        return True
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """
+    Seconds to wait before retry number attempt (0-based), with full jitter
+    """
+    base = MODEL_RETRY_BASE_DELAY if base is None else base
+    cap = MODEL_RETRY_MAX_DELAY if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent successful model calls, for the hedging delay
+    """
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        """
+        Return the pct percentile of the recorded latencies (None without samples)
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def hedge_delay(self):
+        """
+        Seconds after which a call gets a hedged twin, or None when hedging is
+        off or there aren't enough samples yet
+        """
+        if not MODEL_HEDGE or len(self.samples) < MODEL_HEDGE_MIN_SAMPLES:
+            return None
+        return self.percentile(MODEL_HEDGE_PERCENTILE)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for the model.
+
+    closed: calls go through. After MODEL_BREAKER_FAILURES transient
+    failures in a row it opens: calls are refused (and answered without
+    the model) for MODEL_BREAKER_COOLDOWN_SECONDS. Then it is half-open:
+    one trial call goes through; its success closes the circuit, its
+    failure opens it again.
+    """
+
+    def __init__(self, failures=None, cooldown=None, clock=time.monotonic):
+        self.failure_threshold = MODEL_BREAKER_FAILURES if failures is None else failures
+        self.cooldown = MODEL_BREAKER_COOLDOWN_SECONDS if cooldown is None else cooldown
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    def allow(self):
+        """
+        Whether a call may go to the model now
+        """
+        if self.state == "open" and self.clock() - self.opened_at >= self.cooldown:
+            self.state = "half-open"
+            self.trial_in_flight = False
+        if self.state == "closed":
+            return True
+        if self.state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half-open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"⚠️ Model circuit opened after {self.consecutive_failures} failures in a row")
+            self.state = "open"
+            self.opened_at = self.clock()
+            self.trial_in_flight = False
+
+    def release(self):
+        """
+        Forget a half-open trial call that ended without a verdict (e.g. a non-transient error)
+        """
+        self.trial_in_flight = False
+
+    def retry_after(self):
+        """
+        Seconds until the circuit lets a trial call through (0 unless open)
+        """
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.cooldown - (self.clock() - self.opened_at))
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "short_circuited": self.short_circuited,
+        }
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of cached answers (0 disables the cache)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Seconds a cached answer stays valid
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+
+
+def normalize_query(query):
+    """
+    Normalize a query for cache lookups: case, repeated whitespace and
+    trailing punctuation don't change the answer
+    """
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!. ")
+
+
+def _item_ids(context):
+    if not context:
+        return []
+    ids = []
+    if context.get("current_item"):
+        ids.append(str(context["current_item"].get("item_id")))
+    for item in context.get("item_list") or []:
+        ids.append(str(item.get("item_id")))
+    return ids
+
+
+def response_cache_key(query, context, conversation_history, catalog_version):
+    """
+    Build the cache key for an AI answer
+    
+    Parameters:
+    - query: User's query text
+    - context: Item context selected for this query (or None)
+    - conversation_history: Conversation entries included in the prompt
+    - catalog_version: Version of the catalog the prompt was built from
+    
+    Returns:
+    - Hex digest identifying the answer
+    """
+    fingerprint = {
+        "query": normalize_query(query),
+        "items": _item_ids(context),
+        "history": [
+            [entry["role"], entry["content"], _item_ids(entry.get("context"))]
+            for entry in conversation_history
+        ],
+        "catalog_version": catalog_version,
+    }
+    return hashlib.sha256(json.dumps(fingerprint, default=str).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of AI answers with a time-to-live per entry.
+
+    Entries are tagged with the catalog version; when a newer version is
+    seen the whole cache is dropped, so answers never outlive the catalog
+    they were generated from.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.catalog_version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, catalog_version):
+        if catalog_version != self.catalog_version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.catalog_version = catalog_version
+
+    def get(self, key, catalog_version):
+        """
+        Return the cached answer for key, or None
+        """
+        if self.max_entries <= 0:
+            return None
+        with self.lock:
+            self._check_version(catalog_version)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, catalog_version, response):
+        """
+        Store an answer, evicting the least recently used entries if full
+        """
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self._check_version(catalog_version)
+            self.entries[key] = (time.monotonic() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Return hit-rate metrics for the cache
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+response_cache = ResponseCache()
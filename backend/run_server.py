@@ -1,20 +1,234 @@
 #!/usr/bin/env python
 """
-Startup script for Air Quality AI Agent Backend
+Startup script for the Items Sales AI Agent Backend
+
+    python run_server.py                          # development server with auto-reload
+    python run_server.py --workers 4              # production: 4 pre-forked workers
+    python run_server.py --workers 4 --port 9000
+
+In production mode the catalog is loaded and indexed once, before the
+workers are forked, so every worker shares those pages copy-on-write and
+is ready as soon as it starts. Send SIGHUP to the launcher to reload the
+catalog and replace the workers one at a time (each old worker finishes
+its in-flight requests first); SIGINT/SIGTERM stop everything gracefully.
 """
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+
 import uvicorn
-from main import app
 
-if __name__ == "__main__":
-    print("🌍 Starting Air Quality AI Agent Backend...")
-    print("🚀 Server will be available at: http://localhost:8000")
-    print("📋 API Documentation: http://localhost:8000/docs")
-    print("💚 Health Check: http://localhost:8000/health")
-    
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+# How long a worker gets to finish in-flight requests before it is killed
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+
+def bind_socket(host, port, backlog=2048):
+    """
+    Open the listening socket the workers share
+    """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def prepare_app():
+    """
+    Import the app and build the catalog and its indexes in this process
+    """
+    from main import app, prepare_catalog
+    from agent import conversation_memory
+
+    snapshot = prepare_catalog()
+    # Buffered session writes would otherwise be copied into (and flushed by) every worker
+    conversation_memory.flush()
+    # Move everything loaded so far out of the collector's reach: a collection
+    # in a worker would otherwise write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+    print(f"📦 Catalog version {snapshot.version} indexed ({len(snapshot)} items)")
+    return app
+
+
+class Supervisor:
+    """
+    Pre-fork process manager: keeps a fixed number of uvicorn workers
+    accepting on one shared socket, restarting them as needed.
+    """
+
+    def __init__(self, app, sock, workers, log_level="info"):
+        """
+        Parameters:
+        - app: ASGI application, already warmed up
+        - sock: Bound, listening socket
+        - workers: Number of worker processes
+        - log_level: uvicorn log level for the workers
+        """
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.pids = set()
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        """
+        Fork one worker; returns its pid in the parent
+        """
+        pid = os.fork()
+        if pid:
+            self.pids.add(pid)
+            return pid
+
+        # Worker process: the launcher coordinates reloads, uvicorn handles SIGINT/SIGTERM
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        status = 0
+        try:
+            config = uvicorn.Config(self.app, log_level=self.log_level, timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+            uvicorn.Server(config).run(sockets=[self.sock])
+            from agent import conversation_memory
+            conversation_memory.flush()
+        except BaseException as e:
+            print(f"❌ Worker {os.getpid()} failed: {e}")
+            status = 1
+        finally:
+            # Skip the launcher's atexit handlers and buffers inherited by the fork
+            os._exit(status)
+
+    def reap(self):
+        """
+        Collect exited workers; returns their pids
+        """
+        exited = []
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.pids:
+                self.pids.discard(pid)
+                exited.append(pid)
+                if not self.stopping:
+                    print(f"⚠️ Worker {pid} exited (status {os.waitstatus_to_exitcode(status)})")
+        return exited
+
+    def stop_worker(self, pid, timeout=GRACEFUL_TIMEOUT):
+        """
+        Ask a worker to shut down gracefully, killing it after timeout
+        """
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.pids.discard(pid)
+            return
+        deadline = time.monotonic() + timeout + 1
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self.pids.discard(pid)
+                return
+            time.sleep(0.05)
+        print(f"⚠️ Worker {pid} didn't stop in {timeout:.0f}s, killing it")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        self.pids.discard(pid)
+
+    def rolling_restart(self):
+        """
+        Reload the catalog, then replace the workers one at a time
+
+        A replacement is started before its predecessor is stopped, so there
+        are always workers accepting connections.
+        """
+        gc.unfreeze()
+        prepare_app()
+        for old_pid in list(self.pids):
+            new_pid = self.spawn()
+            print(f"🔄 Worker {new_pid} replaces {old_pid}")
+            self.stop_worker(old_pid)
+
+    def run(self):
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        def request_reload(signum, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"✅ {self.workers} workers started (launcher pid {os.getpid()})")
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_restart()
+            self.reap()
+            # Replace workers that crashed
+            while not self.stopping and len(self.pids) < self.workers:
+                self.spawn()
+            time.sleep(0.2)
+
+        print("🛑 Stopping workers...")
+        for pid in list(self.pids):
+            self.stop_worker(pid)
+        self.sock.close()
+
+
+def serve_production(host, port, workers, log_level="info"):
+    sock = bind_socket(host, port)
+    app = prepare_app()
+    if not hasattr(os, "fork"):
+        # No fork() on Windows: serve from this process
+        print("⚠️ Multiple workers need fork(), running a single worker")
+        uvicorn.Server(uvicorn.Config(app, log_level=log_level)).run(sockets=[sock])
+        return
+    Supervisor(app, sock, workers, log_level).run()
+
+
+def serve_development(host, port):
     uvicorn.run(
-        app, 
-        host="0.0.0.0", 
-        port=8000,
+        "main:app",
+        host=host,
+        port=port,
         reload=True,  # Enable auto-reload for development
         log_level="info"
     )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Items Sales AI Agent backend")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY,
+                        help="number of worker processes (production mode); 0 runs the auto-reloading dev server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    print("🛒 Starting Items Sales AI Agent Backend...")
+    print(f"🚀 Server will be available at: http://localhost:{args.port}")
+    print(f"📋 API Documentation: http://localhost:{args.port}/docs")
+    print(f"💚 Health Check: http://localhost:{args.port}/health")
+    print(f"🟢 Readiness: http://localhost:{args.port}/ready")
+
+    if args.workers > 0:
+        serve_production(args.host, args.port, args.workers, args.log_level)
+    else:
+        serve_development(args.host, args.port)
@@ -0,0 +1,318 @@
+import numpy as np
+
+from text_index import TOKEN_PATTERN, TextIndex
+
+# Fields search_items() can sort by; price is sorted high to low
+SORTABLE_FIELDS = ['price', 'item_name', 'item_quantity']
+NUMERIC_FIELDS = ['price', 'item_quantity', 'maximum_discount']
+
+# Joins name and description in the text column; not expected in catalog text
+TEXT_SEPARATOR = '\x1f'
+
+
+def encode_text(texts):
+    """
+    Encode texts as one UTF-8 blob plus byte offsets (count + 1 entries)
+    """
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    return offsets, b"".join(encoded)
+
+
+class TextColumn:
+    """
+    The search text of every row as one UTF-8 blob plus byte offsets.
+
+    Memory is the total size of the text, where a fixed-width array would
+    pay for the longest row on every row. Substrings are found with the
+    buffer's own find(), so the blob can be bytes or a memory-mapped file
+    (byte and text substring matches agree for UTF-8).
+    """
+
+    def __init__(self, blob, offsets, base=0):
+        """
+        Parameters:
+        - blob: bytes or mmap holding the text
+        - offsets: int64 byte offsets of the rows (count + 1 entries), relative to base
+        - base: Position of the text in blob
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.base = base
+
+    def contains(self, needle, positions):
+        """
+        Return the positions (a subset of positions, same order) whose text contains needle
+        """
+        find, base = self.blob.find, self.base
+        starts = self.offsets[positions].tolist()
+        ends = self.offsets[positions + 1].tolist()
+        keep = [find(needle, base + start, base + end) >= 0 for start, end in zip(starts, ends)]
+        return positions[np.array(keep, dtype=bool)]
+
+    def scan(self, needle):
+        """
+        Return the positions of all rows whose text contains needle, in order
+        """
+        find, base, offsets = self.blob.find, self.base, self.offsets
+        end_of_text = base + int(offsets[-1])
+        found = []
+        at = find(needle, base, end_of_text)
+        while at >= 0:
+            row = int(np.searchsorted(offsets, at - base, side='right')) - 1
+            row_end = base + int(offsets[row + 1])
+            if at + len(needle) <= row_end:
+                found.append(row)
+                at = find(needle, row_end, end_of_text)
+            else:
+                # The match runs into the next row, look again from the next byte
+                at = find(needle, at + 1, end_of_text)
+        return np.array(found, dtype=np.int64)
+
+
+class SortedIndex:
+    """
+    Positions of a numeric column sorted by value, for range queries by
+    bisection and top-k retrieval without sorting the matches.
+
+    Ties keep catalog order in both directions, exactly like a stable sort.
+    """
+
+    def __init__(self, values, ascending=None, descending=None, ascending_values=None, descending_values=None):
+        """
+        Parameters:
+        - values: float64 column
+        - ascending, descending: Precomputed stable sort orders (e.g. from a
+          compiled catalog), computed here when not given
+        - ascending_values, descending_values: The values in those orders
+          (negated for descending), computed here when not given
+        """
+        # NaN sorts last and never satisfies a bound, so it is left out of ranges
+        self.count = int(np.count_nonzero(~np.isnan(values)))
+        self.ascending = np.argsort(values, kind='stable') if ascending is None else ascending
+        self.ascending_values = values[self.ascending] if ascending_values is None else ascending_values
+        # Descending order is kept as ascending order of the negated values
+        self.descending = np.argsort(-values, kind='stable') if descending is None else descending
+        self.descending_values = -values[self.descending] if descending_values is None else descending_values
+
+    def range(self, minimum=None, maximum=None, descending=False):
+        """
+        Return the positions with minimum <= value <= maximum, ordered by value
+        """
+        if minimum is None and maximum is None:
+            return self.descending if descending else self.ascending
+        if descending:
+            order, values = self.descending, self.descending_values
+            minimum, maximum = (None if maximum is None else -maximum), (None if minimum is None else -minimum)
+        else:
+            order, values = self.ascending, self.ascending_values
+
+        start = 0 if minimum is None else int(np.searchsorted(values[:self.count], minimum, side='left'))
+        stop = self.count if maximum is None else int(np.searchsorted(values[:self.count], maximum, side='right'))
+        return order[start:max(start, stop)]
+
+
+class CatalogColumns:
+    """
+    Columnar copy of the catalog used to answer search requests with
+    vectorized NumPy masks instead of Python loops over item dictionaries.
+
+    Built once per catalog snapshot (see get_columns) and never modified.
+    With a compiled catalog the text and numeric columns, the token
+    postings, the sort orders and the item name order are views into the
+    memory-mapped file instead of private copies, and items are read from
+    it on access (MappedItems).
+    """
+
+    def __init__(self, items, compiled=None):
+        self.compiled = compiled
+        if compiled is not None:
+            self.items = items
+            self.text = compiled.search_text()
+            self.text_index = compiled.text_index()
+            self.numeric = {field: compiled.numeric(field) for field in NUMERIC_FIELDS}
+            # Rank in name order sorts exactly like the names themselves
+            self.names = compiled.name_rank()
+        else:
+            self.items = tuple(items)
+            # Lowercased "name<sep>description" so one substring check covers both fields
+            texts = [
+                str(item.get('item_name', '')).lower() + TEXT_SEPARATOR + str(item.get('item_description', '')).lower()
+                for item in self.items
+            ]
+            offsets, blob = encode_text(texts)
+            self.text = TextColumn(blob, offsets)
+            self.text_index = TextIndex(texts)
+            self.numeric = {
+                field: np.array([item.get(field, 0) for item in self.items], dtype=np.float64)
+                for field in NUMERIC_FIELDS
+            }
+            self.names = np.array([item.get('item_name', 0) for item in self.items], dtype=object)
+        self.sorted_indexes = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def sorted_index(self, field):
+        """
+        Get the SortedIndex for a numeric field, building it on first use
+        """
+        index = self.sorted_indexes.get(field)
+        if index is None:
+            if self.compiled is not None:
+                compiled = self.compiled
+                index = SortedIndex(self.numeric[field], compiled.sort_order(field),
+                                    compiled.sort_order(field, descending=True),
+                                    compiled.sorted_values(field), compiled.sorted_values(field, descending=True))
+            else:
+                index = SortedIndex(self.numeric[field])
+            self.sorted_indexes[field] = index
+        return index
+
+    def range(self, field, minimum=None, maximum=None, limit=None, descending=False):
+        """
+        Return items with minimum <= field <= maximum ordered by field
+
+        Parameters:
+        - field: Numeric field ('price', 'item_quantity' or 'maximum_discount')
+        - minimum: Lower bound (inclusive), or None
+        - maximum: Upper bound (inclusive), or None
+        - limit: Maximum number of items to return (the top-k by field)
+        - descending: Return the highest values first
+
+        Returns:
+        - List of matching items
+        """
+        positions = self.sorted_index(field).range(minimum, maximum, descending)
+        if limit is not None:
+            positions = positions[:max(limit, 0)]
+        return self.rows(positions)
+
+    def rows(self, positions):
+        """
+        Return the item dictionaries at positions
+        """
+        items = self.items
+        return [items[i] for i in positions.tolist()]
+
+    def sort_key(self, sort_by):
+        """
+        Return an array whose ascending order is the result order for sort_by
+        """
+        if sort_by == 'price':
+            return -self.numeric['price']  # Sort price high to low by default
+        if sort_by == 'item_name':
+            return self.names
+        return self.numeric[sort_by]
+
+    def match(self, search_query=None, min_price=None, max_price=None):
+        """
+        Return the positions (in catalog order) of items matching the filters
+        """
+        positions = None
+
+        if search_query:
+            positions = self.match_text(search_query.lower())
+
+        if positions is None and (min_price is not None or max_price is not None):
+            in_range = self.sorted_index('price').range(min_price, max_price)
+            # Re-sorting a narrow range is cheaper than a full mask, not so for a wide one
+            if len(in_range) * 8 < len(self.items):
+                return np.sort(in_range)
+
+        price = self.numeric['price']
+        for bound, keep in ((min_price, np.greater_equal), (max_price, np.less_equal)):
+            if bound is None:
+                continue
+            if positions is None:
+                positions = np.flatnonzero(keep(price, bound))
+            else:
+                positions = positions[keep(price[positions], bound)]
+
+        if positions is None:
+            return np.arange(len(self.items))
+        return positions
+
+    def match_text(self, search_query):
+        """
+        Return the positions of items whose name or description contains the
+        lowercased search_query
+        """
+        if TEXT_SEPARATOR in search_query:
+            # A match could span both fields in the combined column, check them separately
+            return np.flatnonzero(np.array([
+                search_query in str(item.get('item_name', '')).lower() or
+                search_query in str(item.get('item_description', '')).lower()
+                for item in self.items
+            ], dtype=bool))
+
+        needle = search_query.encode('utf-8')
+        candidates = self.text_index.candidates(search_query)
+        if candidates is None:
+            return self.text.scan(needle)
+        if not len(candidates) or TOKEN_PATTERN.fullmatch(search_query):
+            # A single word only ever occurs inside a token: the index's answer is exact
+            return candidates
+        # The index returns a superset of the matches, confirm them against the full text
+        return self.text.contains(needle, candidates)
+
+    def order(self, positions, sort_by, limit=None):
+        """
+        Stable-sort positions by sort_by, keeping only the first limit results
+
+        With a limit smaller than the number of matches, the top rows are
+        selected with a partition and only those are sorted.
+        """
+        key = self.sort_key(sort_by)
+        keys = key[positions]
+
+        if limit is not None and limit < len(positions):
+            if limit <= 0:
+                return positions[:0]
+            cutoff = np.partition(keys, limit - 1)[limit - 1]
+            before = keys < cutoff
+            # Items tied with the cutoff are taken in catalog order, like a stable sort would
+            tied = np.flatnonzero(keys == cutoff)[:limit - int(before.sum())]
+            selected = np.concatenate([np.flatnonzero(before), tied])
+            positions = positions[selected]
+            keys = keys[selected]
+
+        return positions[np.argsort(keys, kind='stable')]
+
+    def search(self, search_query=None, min_price=None, max_price=None, sort_by=None, limit=None, offset=0):
+        """
+        Vectorized equivalent of file_loader.search_items
+
+        Parameters:
+        - search_query: String to search in item name and description
+        - min_price: Minimum price filter
+        - max_price: Maximum price filter
+        - sort_by: Field to sort by (e.g., 'price', 'item_name')
+        - limit: Maximum number of items to return
+        - offset: Number of results to skip first
+
+        Returns:
+        - List of matching items, in the same order search_items produces
+        """
+        offset = max(offset, 0)
+        stop = None if limit is None else offset + max(limit, 0)
+
+        if sort_by == 'price' and not search_query:
+            # Price range sorted high to low comes straight out of the price index
+            positions = self.sorted_index('price').range(min_price, max_price, descending=True)
+            return self.rows(positions[offset:stop])
+
+        positions = self.match(search_query, min_price, max_price)
+
+        if sort_by and sort_by in SORTABLE_FIELDS:
+            positions = self.order(positions, sort_by, stop)
+
+        return self.rows(positions[offset:stop])
+
+
+def get_columns(snapshot):
+    """
+    Get the columnar search engine for a catalog snapshot (built once per version)
+    """
+    return snapshot.derived("columns", lambda snap: CatalogColumns(snap.items, snap.compiled))
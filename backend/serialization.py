@@ -0,0 +1,80 @@
+import json
+import math
+
+try:
+    import orjson
+except ImportError:  # The standard library encoder works too, just slower
+    orjson = None
+
+
+def json_safe(value):
+    """
+    Convert a value to plain JSON types: NumPy scalars and arrays become
+    Python numbers and lists, NaN and infinities become None
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {str(key): json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if type(value).__module__ == "numpy":
+        return json_safe(value.tolist())
+    return value
+
+
+def _default(value):
+    # orjson calls this for types it doesn't know (NumPy ones are handled natively)
+    safe = json_safe(value)
+    if safe is value:
+        return str(value)
+    return safe
+
+
+def dumps(value):
+    """
+    Serialize a value to compact JSON bytes (NaN becomes null)
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(json_safe(value), separators=(",", ":"), default=str, allow_nan=False).encode("utf-8")
+
+
+def splice_items(encoded_items, key="items", **fields):
+    """
+    Build the body {"items": [...], **fields} from items that are already encoded
+
+    Parameters:
+    - encoded_items: List of JSON bytes, one per item
+    - key: Name of the array member
+    - fields: Other (small) members of the response object
+
+    Returns:
+    - JSON bytes
+    """
+    parts = [b"{", dumps(key), b":[", b",".join(encoded_items), b"]"]
+    for key, value in fields.items():
+        parts += [b",", dumps(key), b":", dumps(value)]
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+class ItemJSONCache:
+    """
+    JSON bytes of every item of a catalog snapshot, encoded once per version.
+
+    Entries are keyed by the identity of the item dictionaries; the cache
+    holds on to the items so those identities can't be reused while it lives.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.encoded = {id(item): dumps(item) for item in items}
+
+    def encode(self, items):
+        """
+        Return the JSON bytes of each item (items that aren't from this snapshot are encoded now)
+        """
+        encoded = self.encoded
+        return [encoded.get(id(item)) or dumps(item) for item in items]
+
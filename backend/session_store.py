@@ -0,0 +1,443 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Sessions idle for longer than this are dropped
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+# Caps on the number of sessions and on the (estimated) memory they hold
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+# Seconds between background sweeps for expired sessions
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# Conversation entries kept per session
+MAX_HISTORY_ENTRIES = 10
+
+# "memory" keeps sessions in this process, "sqlite" shares them between workers
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sessions.db')
+)
+# Writes are buffered and committed together once this many are pending...
+SESSION_BATCH_SIZE = int(os.getenv("SESSION_BATCH_SIZE", "32"))
+# ...or after this many seconds
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.05"))
+
+
+def entry_size(entry):
+    """
+    Estimate the memory held by a conversation entry
+    
+    Context items are counted with their values: compiled and SQLite
+    catalogs build a new dictionary for every item they return, so the
+    entry holds its own copy (items of an in-memory catalog are shared with
+    it, and are over-counted).
+    """
+    size = sys.getsizeof(entry) + sys.getsizeof(entry.get("content", "")) + sys.getsizeof(entry.get("timestamp", ""))
+    context = entry.get("context")
+    if context:
+        size += sys.getsizeof(context)
+        items = {}
+        current_item = context.get("current_item")
+        if current_item:
+            items[id(current_item)] = current_item
+        item_list = context.get("item_list")
+        if item_list:
+            size += sys.getsizeof(item_list)
+            items.update((id(item), item) for item in item_list)
+        size += sum(item_size(item) for item in items.values())
+    return size
+
+
+def item_size(item):
+    """Memory held by an item dictionary and its values (keys are shared between items)"""
+    return sys.getsizeof(item) + sum(sys.getsizeof(value) for value in item.values())
+
+
+class Session:
+    __slots__ = ("entries", "last_access", "size")
+
+    def __init__(self):
+        self.entries = []
+        self.last_access = time.monotonic()
+        self.size = 0
+
+
+class SessionStore:
+    """
+    In-memory conversation store with idle expiry and LRU eviction.
+
+    Sessions expire after ttl seconds without activity. When there are more
+    than max_sessions sessions, or their estimated size exceeds max_bytes,
+    the least recently used sessions are evicted. Reads never create sessions.
+    """
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES,
+                 max_entries=MAX_HISTORY_ENTRIES):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sessions = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def _live_session(self, session_id, now):
+        session = self.sessions.get(session_id)
+        if session is not None and now - session.last_access > self.ttl:
+            self._drop(session_id)
+            self.expirations += 1
+            return None
+        return session
+
+    def _drop(self, session_id):
+        session = self.sessions.pop(session_id)
+        self.bytes -= session.size
+
+    def get_history(self, session_id, max_entries=None):
+        """
+        Return the most recent entries of a session (empty for unknown sessions)
+        """
+        with self.lock:
+            now = time.monotonic()
+            session = self._live_session(session_id, now)
+            if session is None:
+                return []
+            session.last_access = now
+            self.sessions.move_to_end(session_id)
+            if max_entries is None:
+                return list(session.entries)
+            return session.entries[-max_entries:]
+
+    def append(self, session_id, entry):
+        """
+        Add an entry to a session, creating it if needed, then enforce the caps
+        """
+        with self.lock:
+            now = time.monotonic()
+            session = self._live_session(session_id, now)
+            if session is None:
+                session = self.sessions[session_id] = Session()
+
+            size = entry_size(entry)
+            session.entries.append(entry)
+            session.size += size
+            self.bytes += size
+            # Limit the size of conversation history (keep last max_entries entries)
+            while len(session.entries) > self.max_entries:
+                removed = entry_size(session.entries.pop(0))
+                session.size -= removed
+                self.bytes -= removed
+
+            session.last_access = now
+            self.sessions.move_to_end(session_id)
+
+            # Evict least recently used sessions, never the one just written
+            while len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.bytes > self.max_bytes):
+                oldest = next(iter(self.sessions))
+                if oldest == session_id:
+                    break
+                self._drop(oldest)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        with self.lock:
+            if session_id in self.sessions:
+                self._drop(session_id)
+
+    def flush(self):
+        """
+        Nothing is buffered by the in-memory store
+        """
+
+    def sweep(self):
+        """
+        Drop every session that has been idle for longer than the TTL
+        
+        Returns:
+        - Number of sessions removed
+        """
+        with self.lock:
+            cutoff = time.monotonic() - self.ttl
+            expired = [session_id for session_id, session in self.sessions.items() if session.last_access < cutoff]
+            for session_id in expired:
+                self._drop(session_id)
+            self.expirations += len(expired)
+            return len(expired)
+
+    def start_sweeper(self, interval=SESSION_SWEEP_INTERVAL):
+        """
+        Start a daemon thread that sweeps expired sessions every interval seconds
+        """
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+    def stats(self):
+        """
+        Return the number of active sessions and the memory they hold
+        """
+        with self.lock:
+            return {
+                "backend": "memory",
+                "active_sessions": len(self.sessions),
+                "entries": sum(len(session.entries) for session in self.sessions.values()),
+                "bytes": self.bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # Dict-style access, so code written against the old dict keeps working
+
+    def __contains__(self, session_id):
+        with self.lock:
+            return self._live_session(session_id, time.monotonic()) is not None
+
+    def __getitem__(self, session_id):
+        with self.lock:
+            session = self._live_session(session_id, time.monotonic())
+            if session is None:
+                raise KeyError(session_id)
+            return list(session.entries)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Conversation store in an SQLite database (WAL mode) shared by all workers.
+
+    Appends are buffered and written in batches; a session's own pending
+    writes are flushed before it is read, so a worker always sees what it
+    wrote. The last N turns of a session are read through the
+    (session_id, id) index. Sweeping drops idle sessions and compacts
+    sessions down to their last max_entries turns.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL_SECONDS, max_entries=MAX_HISTORY_ENTRIES,
+                 batch_size=SESSION_BATCH_SIZE, flush_interval=SESSION_FLUSH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.evictions = 0
+        self.expirations = 0
+        self._sweeper = None
+        self._stop = threading.Event()
+
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    entry TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session_id, id);
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_by_last_access ON sessions (last_access);
+            """)
+        # Don't lose buffered turns when the process exits between flushes
+        atexit.register(self.flush)
+
+    def _connection(self):
+        """
+        Get this thread's connection (sqlite3 connections can't be shared between
+        threads, nor with forked server workers, which open their own)
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def flush(self):
+        """
+        Write all buffered entries in one transaction
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending:
+                return
+            last_access = {}
+            for session_id, _, timestamp in pending:
+                last_access[session_id] = timestamp
+            with self._connection() as connection:
+                connection.executemany(
+                    "INSERT INTO turns (session_id, entry) VALUES (?, ?)",
+                    [(session_id, entry) for session_id, entry, _ in pending]
+                )
+                connection.executemany(
+                    "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET last_access = excluded.last_access",
+                    list(last_access.items())
+                )
+
+    def get_history(self, session_id, max_entries=None):
+        """
+        Return the most recent entries of a session (empty for unknown or expired sessions)
+        """
+        if any(pending[0] == session_id for pending in self.pending):
+            self.flush()
+        connection = self._connection()
+        row = connection.execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return []
+        limit = self.max_entries if max_entries is None else min(max_entries, self.max_entries)
+        rows = connection.execute(
+            "SELECT entry FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, limit)
+        ).fetchall()
+        return [json.loads(entry) for (entry,) in reversed(rows)]
+
+    def append(self, session_id, entry):
+        """
+        Buffer an entry for a session; it is written with the next batch
+        """
+        with self.lock:
+            self.pending.append((session_id, json.dumps(entry, default=str), time.time()))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def delete(self, session_id):
+        self.flush()
+        with self._connection() as connection:
+            connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def compact(self):
+        """
+        Delete turns beyond the last max_entries of each session
+        
+        Returns:
+        - Number of turns removed
+        """
+        self.flush()
+        with self._connection() as connection:
+            cursor = connection.execute("""
+                DELETE FROM turns WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id DESC) AS newest
+                        FROM turns
+                    ) WHERE newest > ?
+                )
+            """, (self.max_entries,))
+            return cursor.rowcount
+
+    def sweep(self):
+        """
+        Drop sessions idle for longer than the TTL and compact the rest
+        
+        Returns:
+        - Number of sessions removed
+        """
+        self.flush()
+        cutoff = time.time() - self.ttl
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE last_access < ?)",
+                (cutoff,)
+            )
+            removed = connection.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,)).rowcount
+        self.expirations += removed
+        self.compact()
+        return removed
+
+    def start_sweeper(self, interval=SESSION_SWEEP_INTERVAL):
+        """
+        Start a daemon thread that flushes buffered writes every flush_interval
+        and sweeps the database every interval seconds
+        """
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            next_sweep = time.monotonic() + interval
+            while not self._stop.wait(self.flush_interval):
+                self.flush()
+                if time.monotonic() >= next_sweep:
+                    self.sweep()
+                    next_sweep = time.monotonic() + interval
+
+        self._sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        """
+        Return the number of active sessions and the size of the database
+        """
+        connection = self._connection()
+        cutoff = time.time() - self.ttl
+        active = connection.execute("SELECT COUNT(*) FROM sessions WHERE last_access >= ?", (cutoff,)).fetchone()[0]
+        entries = connection.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "active_sessions": active,
+            "entries": entries,
+            "pending_writes": len(self.pending),
+            "bytes": page_count * page_size,
+            "ttl_seconds": self.ttl,
+            "expirations": self.expirations,
+        }
+
+    def __contains__(self, session_id):
+        return bool(self.get_history(session_id, 1))
+
+    def __getitem__(self, session_id):
+        history = self.get_history(session_id)
+        if not history:
+            raise KeyError(session_id)
+        return history
+
+    def __len__(self):
+        return self.stats()["active_sessions"]
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """
+    Create the conversation store selected by SESSION_BACKEND ("memory" or "sqlite")
+    """
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend != "memory":
+        print(f"Unknown SESSION_BACKEND {backend!r}, using in-memory sessions")
+    return SessionStore()
@@ -0,0 +1,803 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Add backend directory to path to allow importing modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import agent
+import context_selector
+import fast_path
+import fast_path_report
+import llm
+import resilience
+from fake_model import BlockingFakeModel, FakeModel
+from file_loader import load_all_data, search_items
+from matcher import AhoCorasick
+from response_cache import ResponseCache, normalize_query, response_cache
+from session_store import SessionStore, SQLiteSessionStore
+
+
+def scan_relevant_items(query, items_data):
+    """Category keyword and item name matching the way find_relevant_items used to do it"""
+    query_lower = query.lower().strip()
+    for keyword in agent.CATEGORY_KEYWORDS:
+        if keyword in query_lower:
+            results = search_items(list(items_data), search_query=keyword)
+            if results:
+                return {"items": results[:5]}
+    for item in items_data:
+        if item['item_name'].lower() in query_lower:
+            return {"item_data": item}
+    return None
+
+
+def reference_build_prompt(query, items_data, conversation_history, context):
+    """The prompt build_prompt produced before item lines were pre-rendered"""
+    # Extract context from recent conversation
+    current_context = {}
+    
+    # Look for recent items in conversation history
+    for entry in reversed(conversation_history):
+        if "context" in entry and entry["context"]:
+            if "current_item" in entry["context"] and not current_context.get("current_item"):
+                current_context["current_item"] = entry["context"]["current_item"]
+            
+            if "item_list" in entry["context"] and not current_context.get("item_list"):
+                current_context["item_list"] = entry["context"]["item_list"]
+        
+        # Stop once we have enough context
+        if "current_item" in current_context and "item_list" in current_context:
+            break
+    
+    # If we have new context from this query, update current_context
+    if context:
+        if "current_item" in context and not current_context.get("current_item"):
+            current_context["current_item"] = context["current_item"]
+        if "item_list" in context and not current_context.get("item_list"):
+            current_context["item_list"] = context["item_list"]
+    
+    # Convert conversation history to string format
+    conversation_text = ""
+    for entry in conversation_history:
+        if entry["role"] == "user":
+            conversation_text += f"Customer: {entry['content']}\n"
+        else:
+            # Truncate long responses
+            response = entry['content']
+            if len(response) > 200:
+                response = response[:197] + "..."
+            conversation_text += f"Assistant: {response}\n"
+    
+    # Prepare items information for the AI
+    items_info = ""
+    
+    # Include current item from context first if available
+    if current_context.get("current_item"):
+        item = current_context["current_item"]
+        items_info += (f"[CURRENTLY DISCUSSING] Item: ID={item['item_id']}, Name={item['item_name']}, "
+                     f"Price=${item['price']:.2f}, Quantity={item['item_quantity']}, "
+                     f"Description={item.get('item_description', 'No description available')}, "
+                     f"Discount={item['maximum_discount']*100:.0f}%\n")
+    
+    # Include recently discussed items if available
+    if current_context.get("item_list"):
+        for i, item in enumerate(current_context["item_list"]):
+            items_info += (f"Recent Item {i+1}: ID={item['item_id']}, Name={item['item_name']}, "
+                         f"Price=${item['price']:.2f}, "
+                         f"Description={item.get('item_description', 'No description available')}, "
+                         f"Discount={item.get('maximum_discount', 0)*100:.0f}%\n")
+    
+    # Include general items as well (avoiding duplicates)
+    already_included_ids = set()
+    if current_context.get("current_item"):
+        already_included_ids.add(current_context["current_item"]["item_id"])
+    if current_context.get("item_list"):
+        for item in current_context["item_list"]:
+            already_included_ids.add(item["item_id"])
+    
+    # Add additional items for context
+    for i, item in enumerate(items_data[:15]):  # Limit to 15 additional items
+        if item["item_id"] not in already_included_ids:
+            items_info += (f"Item: ID={item['item_id']}, Name={item['item_name']}, "
+                          f"Price=${item['price']:.2f}, Quantity={item['item_quantity']}, "
+                          f"Description={item.get('item_description', 'No description available')}, "
+                          f"Discount={item.get('maximum_discount', 0)*100:.0f}%\n")
+    
+    # Create prompt for the AI with conversation context
+    return f"""
+You are a helpful sales assistant for an e-commerce store. Based on the query and conversation history,
+help the customer find products they're looking for or answer questions about our inventory.
+
+CONVERSATION HISTORY:
+{conversation_text}
+
+CURRENT CUSTOMER QUERY: {query}
+
+ITEMS INFORMATION:
+{items_info}
+
+INSTRUCTIONS:
+1. If the customer is asking about an item already mentioned in the conversation, use that context.
+2. If the query refers to "it", "this item", "that product", etc., assume they are talking about the item marked [CURRENTLY DISCUSSING].
+3. If the customer is asking about price, features, availability, or discounts, look for the relevant item in the context.
+4. Be concise, helpful, and specific in your recommendations.
+5. ALWAYS mention the exact discount percentage when discussing an item that has a discount.
+6. ALWAYS include the item description in your response when focusing on a specific item.
+7. If answering a follow-up question about a specific item, always mention the item name for clarity.
+8. When discussing prices, always format them as $XX.XX with two decimal places.
+"""
+
+
+def test_aho_corasick_matches_substring_checks():
+    rng = random.Random(7)
+    patterns = ["he", "she", "his", "hers", "a", "ab", "bab", "bca", "caa", ""]
+    automaton = AhoCorasick(patterns)
+    for _ in range(500):
+        text = "".join(rng.choice("abcehirs ") for _ in range(rng.randint(0, 30)))
+        expected = {i for i, pattern in enumerate(patterns) if pattern and pattern in text}
+        assert automaton.find_all(text) == expected, text
+
+
+def test_find_relevant_items_matches_scan():
+    items = load_all_data()
+    queries = [
+        "Do you have any binders?",
+        "I need a new laptop and a pen",
+        "tell me about the apex tablet",
+        "Is the Dura Binder in stock?",
+        "What about the Aero Coffee Maker?",
+        "Glow LED Lamp please",
+        "hello there",
+        "do you sell socks",
+    ]
+    for query in queries:
+        assert agent.find_relevant_items(query, items) == scan_relevant_items(query, items), query
+        assert agent.find_relevant_items(query, list(items)) == scan_relevant_items(query, items), query
+
+
+def run_with_model(model, coroutine_factory):
+    """Run an async test body with agent.model swapped for a stand-in"""
+    original = agent.model
+    agent.model = model
+    response_cache.clear()
+    try:
+        return asyncio.run(coroutine_factory())
+    finally:
+        agent.model = original
+
+
+def test_handle_query_async_uses_model():
+    model = FakeModel(latency=0.01, reply="  We have binders.  ")
+
+    async def body():
+        return await agent.handle_query_async("Do you have any binders?", session_id="async-test")
+
+    result = run_with_model(model, body)
+    assert result["response"] == "We have binders."
+    assert result["items"]
+    assert agent.conversation_memory["async-test"][-1]["content"] == "We have binders."
+
+
+def test_model_calls_are_bounded_and_time_out():
+    model = FakeModel(latency=0.05)
+    original_limit, original_timeout = llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_TIMEOUT_SECONDS
+    llm.MAX_CONCURRENT_MODEL_CALLS = 3
+    llm._slots = None
+
+    async def body():
+        await asyncio.gather(*[agent.handle_query_async(f"hello {i}", session_id=f"limit-{i}") for i in range(10)])
+        llm.MODEL_TIMEOUT_SECONDS = 0.01
+        return await agent.handle_query_async("anything on sale?", session_id="timeout-test")
+
+    try:
+        result = run_with_model(model, body)
+    finally:
+        llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_TIMEOUT_SECONDS = original_limit, original_timeout
+        llm._slots = None
+    assert model.max_in_flight == 3
+    assert "did not respond" in result["response"]
+
+
+def test_identical_model_calls_are_coalesced():
+    before = llm.model_calls.stats()
+
+    async def body(model, *timeouts):
+        return await asyncio.gather(*[llm.generate_text_async(model, "same prompt", timeout) for timeout in timeouts],
+                                    return_exceptions=True)
+
+    model = FakeModel(latency=0.05, reply="shared")
+    assert asyncio.run(body(model, *[1.0] * 20)) == ["shared"] * 20
+    assert model.calls == 1
+
+    # Every waiter gets the upstream error; failures aren't kept for later calls
+    failing = FakeModel(latency=0.02, error_rate=1.0)
+    results = asyncio.run(body(failing, 1.0, 1.0, 1.0))
+    assert all(isinstance(result, RuntimeError) for result in results) and failing.calls == 1
+    asyncio.run(body(failing, 1.0))
+    assert failing.calls == 2
+
+    # A caller that gives up doesn't cancel the call the others wait for
+    slow = FakeModel(latency=0.1, reply="late")
+    leader, impatient, follower = asyncio.run(body(slow, 1.0, 0.01, 1.0))
+    assert leader == follower == "late" and isinstance(impatient, TimeoutError) and slow.calls == 1
+
+    after = llm.model_calls.stats()
+    assert after["upstream_calls"] - before["upstream_calls"] == 4
+    assert after["coalesced_calls"] - before["coalesced_calls"] == 19 + 2 + 2
+    assert after["upstream_errors"] - before["upstream_errors"] == 2
+    assert after["in_flight"] == 0
+
+
+def test_concurrent_identical_questions_share_one_model_call():
+    model = FakeModel(latency=0.05, reply="Binders are in stock.")
+    response_cache.clear()
+
+    async def body():
+        return await asyncio.gather(*[agent.handle_query_async("Do you sell staplers?", session_id=f"promo-{i}")
+                                      for i in range(10)])
+
+    results = run_with_model(model, body)
+    assert [result["response"] for result in results] == ["Binders are in stock."] * 10
+    assert model.calls == 1
+    assert all(agent.conversation_memory[f"promo-{i}"][-1]["content"] == "Binders are in stock." for i in range(10))
+
+
+def test_cancelled_streams_do_not_lower_the_limit():
+    # A client that disconnects mid-answer cancels its stream; that's no model failure
+    model = FakeModel(latency=0.01, chunk_delay=0.05, reply="one two three four five six seven eight")
+    llm._slots = None
+
+    async def body():
+        async def consume():
+            async for _ in llm.stream_text_async(model, "a prompt", 1.0):
+                pass
+
+        for _ in range(3):
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.08)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return llm._model_slots().stats()
+
+    try:
+        stats = asyncio.run(body())
+    finally:
+        llm._slots = None
+    assert stats["limit"] == llm.MAX_CONCURRENT_MODEL_CALLS and stats["failures"] == 0 and stats["in_flight"] == 0
+
+
+def test_adaptive_limiter_backs_off_and_sheds():
+    async def body():
+        limiter = llm.AdaptiveLimiter(max_limit=4, min_limit=1, max_queue=2, queue_timeout=0.05)
+        tokens = [await limiter.acquire() for _ in range(4)]
+        queued = [asyncio.ensure_future(limiter.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        try:
+            await limiter.acquire()
+            raise AssertionError("a full queue should shed")
+        except llm.ModelOverloaded:
+            pass
+        # A burst of failures halves the limit once
+        for token in tokens[:3]:
+            limiter.release(token, False)
+        assert limiter.limit == 2 and limiter.decreases == 1
+        # One waiter gets the freed slot; the other waits past queue_timeout and is shed
+        await asyncio.sleep(0.1)
+        assert queued[0].result() == limiter.epoch and limiter.in_flight == 2
+        assert isinstance(queued[1].exception(), llm.ModelOverloaded)
+        assert limiter.shed == 2 and not limiter.waiters
+        limiter.release(tokens[3], True)
+        limiter.release(queued[0].result(), True)
+        # Successes that use the whole limit raise it again, up to max_limit
+        for _ in range(40):
+            tokens = [await limiter.acquire() for _ in range(int(limiter.limit))]
+            for token in tokens:
+                limiter.release(token, True)
+        return limiter
+
+    limiter = asyncio.run(body())
+    assert limiter.limit == 4 and limiter.in_flight == 0
+
+
+def test_shed_queries_get_the_fallback_answer():
+    model = FakeModel(latency=0.1)
+    settings = llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE
+    llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE = 2, 2
+    llm._slots = None
+
+    async def body():
+        return await asyncio.gather(*[agent.handle_query_async(f"binders for team {i}?", session_id=f"shed-{i}")
+                                      for i in range(8)], return_exceptions=True)
+
+    try:
+        results = run_with_model(model, body)
+        agent.OVERLOAD_RESPONSE = "reject"
+        rejected = run_with_model(FakeModel(latency=0.1), body)
+    finally:
+        llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE = settings
+        llm._slots = None
+        agent.OVERLOAD_RESPONSE = "fallback"
+    assert model.calls == 4
+    degraded = [result for result in results if result.get("degraded")]
+    assert len(degraded) == 4 and all("featured products" in result["response"] for result in degraded)
+    assert sum(isinstance(result, llm.ModelOverloaded) for result in rejected) == 4
+
+
+def use_resilience(**settings):
+    """Override resilience settings and start with a fresh breaker and latency history;
+    returns the previous settings for restore_resilience"""
+    original = {name: getattr(resilience, name) for name in settings}
+    for name, value in settings.items():
+        setattr(resilience, name, value)
+    llm.breaker = resilience.CircuitBreaker()
+    llm.latencies = resilience.LatencyTracker()
+    return original
+
+
+def restore_resilience(original):
+    use_resilience(**original)
+
+
+def test_transient_errors_are_retried_with_backoff():
+    original = use_resilience(MODEL_RETRY_BASE_DELAY=0.01)
+    try:
+        flaky = FakeModel(latency=0.01, reply="third time lucky", fail_first=2, error_code=503)
+        retries = llm.resilience_stats()["retries"]
+        assert asyncio.run(llm.generate_text_async(flaky, "retry me")) == "third time lucky"
+        assert flaky.calls == 3 and llm.resilience_stats()["retries"] == retries + 2
+
+        # Errors that won't go away (no transient status) are not retried
+        broken = FakeModel(latency=0.01, fail_first=5)
+        try:
+            asyncio.run(llm.generate_text_async(broken, "don't retry me"))
+            raise AssertionError("the error should propagate")
+        except RuntimeError:
+            pass
+        assert broken.calls == 1
+    finally:
+        restore_resilience(original)
+
+
+def test_circuit_breaker_opens_and_recovers():
+    now = [0.0]
+    breaker = resilience.CircuitBreaker(failures=3, cooldown=10, clock=lambda: now[0])
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] = 10
+    assert breaker.allow() and not breaker.allow()  # One trial call while half-open
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.times_opened == 2
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+    # While open, queries get the catalog-only answer without calling the model
+    original = use_resilience(MODEL_RETRIES=0, MODEL_BREAKER_FAILURES=2, MODEL_BREAKER_COOLDOWN_SECONDS=60)
+    model = FakeModel(latency=0.01, error_rate=1.0, error_code=429)
+    try:
+        async def body():
+            return [await agent.handle_query_async(f"quota test {i}", session_id="breaker-test") for i in range(5)]
+
+        results = run_with_model(model, body)
+        state = llm.resilience_stats()["breaker"]
+    finally:
+        restore_resilience(original)
+    assert model.calls == 2 and state["state"] == "open" and state["short_circuited"] == 3
+    assert [bool(result.get("degraded")) for result in results] == [False, False, True, True, True]
+
+
+def test_retries_and_hedging_bound_tail_latency():
+    def latencies_ms(model, calls=100):
+        async def one(i):
+            start = time.perf_counter()
+            await llm.generate_text_async(model, f"tail latency {i}")
+            return (time.perf_counter() - start) * 1000
+
+        async def body():
+            # Successful calls give the hedging delay its latency history
+            for i in range(resilience.MODEL_HEDGE_MIN_SAMPLES):
+                await llm.generate_text_async(FakeModel(latency=0.01), f"warm-up {i}")
+            return sorted(await asyncio.gather(*[one(i) for i in range(calls)]))
+
+        return asyncio.run(body())
+
+    settings = llm.MAX_CONCURRENT_MODEL_CALLS
+    llm.MAX_CONCURRENT_MODEL_CALLS = 200
+    llm._slots = None
+    try:
+        original = use_resilience(MODEL_ATTEMPT_TIMEOUT_SECONDS=30, MODEL_HEDGE=False)
+        plain = latencies_ms(FakeModel(latency=0.01, stall_rate=0.1, stall_seconds=1.0, seed=7))
+        use_resilience(MODEL_ATTEMPT_TIMEOUT_SECONDS=0.2, MODEL_HEDGE=True, MODEL_RETRY_BASE_DELAY=0.01)
+        hedges = llm.resilience_stats()["hedges"]
+        resilient = latencies_ms(FakeModel(latency=0.01, stall_rate=0.1, stall_seconds=1.0, seed=7))
+        assert llm.resilience_stats()["hedges"] > hedges
+    finally:
+        restore_resilience(original)
+        llm.MAX_CONCURRENT_MODEL_CALLS = settings
+        llm._slots = None
+
+    def p(values, pct):
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    assert p(plain, 50) < 100 and p(plain, 99) > 1000
+    assert p(resilient, 50) < 100 and p(resilient, 99) < 500
+
+
+def test_blocking_client_does_not_stall_event_loop():
+    model = BlockingFakeModel(latency=0.2)
+
+    async def body():
+        ticks = []
+
+        async def ticker():
+            for _ in range(10):
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                ticks.append(time.perf_counter() - start)
+
+        await asyncio.gather(agent.handle_query_async("hello", session_id="blocking-test"), ticker())
+        return ticks
+
+    ticks = run_with_model(model, body)
+    assert max(ticks) < 0.1
+
+
+def test_catalog_and_session_io_do_not_stall_event_loop():
+    # A catalog reload (spreadsheet parse, SQLite ingest), slow session storage
+    # and the SQLite queries of prompt building run in the thread pool
+    import catalog_db
+    import file_loader
+    from test_catalog import copy_items_file, use_catalog_backend
+
+    def slow(function):
+        def call(*args):
+            time.sleep(0.2)
+            return function(*args)
+        return call
+
+    async def body():
+        ticks = []
+
+        async def ticker():
+            for _ in range(10):
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                ticks.append(time.perf_counter() - start)
+
+        async def stream():
+            return [event async for event in agent.stream_query_async("do you have a tv?", session_id="slow-io-test")]
+
+        await asyncio.gather(ticker(), agent.handle_query_async("sturdy widget", session_id="slow-io-test"))
+        await asyncio.gather(ticker(), stream())
+        return ticks
+
+    original = agent.load_all_data, agent.get_conversation_history
+    agent.load_all_data, agent.get_conversation_history = slow(load_all_data), slow(agent.get_conversation_history)
+    try:
+        ticks = run_with_model(FakeModel(latency=0.01), body)
+    finally:
+        agent.load_all_data, agent.get_conversation_history = original
+    assert max(ticks) < 0.1
+
+    path = copy_items_file()
+    items_file = file_loader.ITEMS_FILE
+    count_containing = catalog_db.CatalogDatabase.count_containing
+    catalog_db.CatalogDatabase.count_containing = slow(count_containing)
+    try:
+        use_catalog_backend("sqlite", path)
+        load_all_data()
+        ticks = run_with_model(FakeModel(latency=0.01), body)
+    finally:
+        catalog_db.CatalogDatabase.count_containing = count_containing
+        use_catalog_backend("memory", items_file)
+    assert max(ticks) < 0.1
+
+
+def test_abandoned_model_threads_keep_their_slot():
+    # A blocking call that timed out still occupies an executor thread
+    model = BlockingFakeModel(latency=0.2)
+    llm._slots = None
+
+    async def body():
+        slots = llm._model_slots()
+        try:
+            await llm._attempt(model, "slow prompt", 0.02)
+        except TimeoutError:
+            pass
+        await asyncio.sleep(0.05)
+        held = slots.in_flight
+        await asyncio.sleep(0.3)
+        return held, slots.in_flight
+
+    try:
+        assert asyncio.run(body()) == (1, 0)
+    finally:
+        llm._slots = None
+
+
+def test_response_cache_lru_ttl_and_catalog_version():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", 1, "answer a")
+    cache.put("b", 1, "answer b")
+    assert cache.get("a", 1) == "answer a"
+    cache.put("c", 1, "answer c")  # evicts b, the least recently used
+    assert cache.get("b", 1) is None
+    assert cache.get("c", 1) == "answer c"
+
+    # A new catalog version drops everything
+    assert cache.get("a", 2) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["invalidations"]) == (2, 2, 1, 1)
+
+    cache = ResponseCache(max_entries=2, ttl=-1)
+    cache.put("a", 1, "answer a")
+    assert cache.get("a", 1) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_repeated_questions_are_answered_from_cache():
+    model = FakeModel(reply="Yes, we have binders.")
+
+    async def body():
+        first = await agent.handle_query_async("Do you have binders?", session_id="cache-1")
+        second = await agent.handle_query_async("do you have   binders", session_id="cache-2")
+        return first, second
+
+    first, second = run_with_model(model, body)
+    assert model.calls == 1
+    assert first["response"] == second["response"] == "Yes, we have binders."
+    assert normalize_query("Do you have binders?") == normalize_query("do you have   binders")
+    assert agent.conversation_memory["cache-2"][-1]["content"] == "Yes, we have binders."
+
+
+def test_structured_questions_take_the_fast_path():
+    model = FakeModel(latency=0.01, reply="From the model.")
+    original = fast_path.FAST_PATH_INTENTS
+    fast_path.FAST_PATH_INTENTS = "price,discount,price_range"
+
+    async def body():
+        price = await agent.handle_query_async("What's the price of sku2024001?", session_id="fast-1")
+        missing = await agent.handle_query_async("price of SKU0001234", session_id="fast-1")
+        discount = await agent.handle_query_async("what's the discount on the stapler", session_id="fast-2")
+        cheap = await agent.handle_query_async("items under $20", session_id="fast-3")
+        events = [event async for event in agent.stream_query_async("how much is SKU2024001", session_id="fast-4")]
+        assert model.calls == 0
+        # Disabled intents and open questions still go to the model
+        stock = await agent.handle_query_async("Is SKU2024001 in stock?", session_id="fast-5")
+        advice = await agent.handle_query_async("which laptop is best under $500?", session_id="fast-5")
+        # The under-$N list ignores the category, so these can't be answered from it
+        for query in ["how much is a tablet under $100", "what is the price of a laptop under $500",
+                      "coffee maker under $50"]:
+            assert (await agent.handle_query_async(query, session_id="fast-7"))["response"] == "From the model."
+        return price, missing, discount, cheap, events, stock, advice
+
+    try:
+        price, missing, discount, cheap, events, stock, advice = run_with_model(model, body)
+        sync = agent.handle_query("price of SKU2024001", session_id="fast-6")
+    finally:
+        fast_path.FAST_PATH_INTENTS = original
+
+    apex = load_all_data()[0]
+    assert price["fast_path"] == "price" and price["item_data"] == apex
+    assert price["response"].startswith("Apex Tablet (SKU2024001) costs $391.25")
+    assert "couldn't find an item with the ID SKU0001234" in missing["response"]
+    assert discount["fast_path"] == "discount"
+    assert all(item["item_name"] == "StaplePro Stapler" for item in discount["items"])
+    assert "has a discount of up to 25%" in discount["response"]
+    assert cheap["fast_path"] == "price_range"
+    assert all(item["price"] <= 20 for item in cheap["items"])
+    assert events[-1]["fast_path"] == "price" and events[0]["item_data"] == apex
+    assert sync["response"] == price["response"]
+    assert stock["response"] == advice["response"] == "From the model."
+    assert model.calls == 5
+
+    # Memory and context are updated as for model answers
+    history = agent.conversation_memory["fast-1"]
+    assert [entry["role"] for entry in history] == ["user", "assistant", "user", "assistant"]
+    assert history[1]["content"] == price["response"]
+    assert history[1]["context"]["current_item"] == apex
+    assert agent.get_conversation_history("fast-3")[-1]["context"]["item_list"] == cheap["items"]
+    assert fast_path.fast_path_stats()["answered"]["discount"] >= 1
+
+
+def test_fast_path_report_counts_intents():
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    store = SQLiteSessionStore(path, ttl=60, max_entries=10, batch_size=100)
+    logged = ["price of SKU2024001", "is the Dura Binder in stock?", "items under $20", "hello", "pens under $30"]
+    for i, query in enumerate(logged):
+        store.append(f"report-{i}", {"role": "user", "content": query})
+        store.append(f"report-{i}", {"role": "assistant", "content": "price of SKU2024001"})
+    store.flush()
+
+    queries = fast_path_report.queries_from_db(path)
+    assert queries == logged
+    report = fast_path_report.traffic_report(queries, load_all_data())
+    assert report["queries"] == 5
+    assert report["intents"] == {"price": 1, "discount": 0, "stock": 1, "price_range": 1}
+    assert len(report["answer_micros"]) == 3
+
+
+def test_build_prompt_matches_reference():
+    items = load_all_data()
+    long_answer = "A very long answer. " * 20
+    histories = [
+        [],
+        [{"role": "user", "content": "Do you have binders?"},
+         {"role": "assistant", "content": long_answer, "context": {"item_list": list(items[19:22])}}],
+        [{"role": "user", "content": "Tell me about SKU2024005"},
+         {"role": "assistant", "content": "Sure.", "context": {"current_item": items[4]}}],
+    ]
+    contexts = [None, {"current_item": items[2]}, {"item_list": list(items[:3])},
+                {"current_item": dict(items[7])}]
+    original = context_selector.CONTEXT_SELECTION
+    context_selector.CONTEXT_SELECTION = "first"
+    try:
+        for history in histories:
+            for context in contexts:
+                for items_data in [items, list(items)]:
+                    expected = reference_build_prompt("what's the price?", items_data, history, context)
+                    assert agent.build_prompt("what's the price?", items_data, history, context) == expected
+    finally:
+        context_selector.CONTEXT_SELECTION = original
+
+    # Items read back from a conversation (copies) are rendered without being kept
+    lines = agent.get_item_lines(items)
+    expected = lines.details(items[7])
+    cached = len(lines.lines)
+    for _ in range(3):
+        assert lines.details(dict(items[7])) == expected
+    assert len(lines.lines) == cached
+
+
+def test_context_selection_is_relevant_and_budgeted():
+    items = load_all_data()
+    prompt = agent.build_prompt("Do you have any binders?", items, [], None)
+    binders = [item for item in items if "Binder" in item["item_name"]]
+    assert binders and all(f"ID={item['item_id']}," in prompt for item in binders)
+    assert "Apex Tablet" not in prompt
+
+    # Nothing relevant: only a few fallback items instead of 15 filler rows
+    prompt = agent.build_prompt("hello", items, [], None)
+    assert prompt.count("\nItem: ID=") == context_selector.CONTEXT_FALLBACK_ITEMS
+
+    selected = context_selector.select_context_items("yoga pants", items, render=lambda item: "x" * 1000)
+    assert len(selected) == context_selector.CONTEXT_TOKEN_BUDGET // 250
+
+    # An item too long for the budget is skipped, not the end of the selection
+    ranked = context_selector.select_context_items("binder", items, render=lambda item: "x")
+    too_long = ranked[0]["item_id"]
+    render = lambda item: "x" * (context_selector.CONTEXT_TOKEN_BUDGET * 8 if item["item_id"] == too_long else 4)
+    assert context_selector.select_context_items("binder", items, render=render) == ranked[1:]
+
+
+def test_relevance_lookups_on_sqlite_catalog():
+    import file_loader
+    from test_catalog import copy_items_file, use_catalog_backend
+
+    path = copy_items_file()
+    original = file_loader.ITEMS_FILE
+    try:
+        use_catalog_backend("sqlite", path)
+        database = load_all_data()
+        items = file_loader.load_items_data(path)
+        queries = [
+            "Do you have any binders?", "I need a new laptop and a pen", "tell me about the apex tablet",
+            "Is the Dura Binder in stock?", "Glow LED Lamp please", "hello there", "anything under $40?",
+            "show me SKU2024003", "yoga pants", "do you sell socks",
+        ]
+        for query in queries:
+            assert agent.find_relevant_items(query, database) == agent.find_relevant_items(query, items), query
+            assert context_selector.select_context_items(query, database, render=str) == \
+                context_selector.select_context_items(query, items, render=str), query
+    finally:
+        use_catalog_backend("memory", original)
+
+
+def test_reading_history_does_not_create_sessions():
+    before = len(agent.conversation_memory)
+    assert agent.get_conversation_history("never-seen-session") == []
+    assert "never-seen-session" not in agent.conversation_memory
+    assert len(agent.conversation_memory) == before
+
+
+def test_session_store_expiry_and_eviction():
+    store = SessionStore(ttl=60, max_sessions=3, max_entries=4)
+    for i in range(5):
+        store.append(f"s{i}", {"role": "user", "content": f"hello {i}"})
+    assert [session_id for session_id in store.sessions] == ["s2", "s3", "s4"]
+    assert store.stats()["evictions"] == 2
+
+    for i in range(6):
+        store.append("s2", {"role": "user", "content": str(i)})
+    assert [entry["content"] for entry in store.get_history("s2")] == ["2", "3", "4", "5"]
+    assert store.get_history("s2", 2) == store.get_history("s2")[-2:]
+
+    # Byte cap: a big session pushes out older ones
+    store.max_bytes = store.bytes + 100
+    store.append("big", {"role": "assistant", "content": "x" * 1000})
+    assert "big" in store
+    assert store.bytes <= store.max_bytes or len(store) == 1
+    assert len(store) < 3
+
+    store.ttl = -1
+    expired = len(store.sessions)
+    assert store.sweep() == expired
+    assert store.stats()["active_sessions"] == 0
+    assert store.stats()["bytes"] == 0
+
+
+def test_session_bytes_count_context_items():
+    # Items of a compiled or SQLite catalog are built per access, so each entry holds its own copies
+    items = load_all_data()
+    store = SessionStore(max_sessions=100_000, max_bytes=1 << 40)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(2000):
+        store.append(f"items-{i}", {"role": "assistant", "content": "Here you go.", "timestamp": "2026-01-01T00:00:00",
+                                    "context": {"item_list": items[i % 50:i % 50 + 5]}})
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert held / 2 < store.bytes < held * 2, (store.bytes, held)
+
+
+def test_sqlite_sessions_are_shared_batched_and_compacted():
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    worker_a = SQLiteSessionStore(path, ttl=60, max_entries=4, batch_size=100)
+    worker_b = SQLiteSessionStore(path, ttl=60, max_entries=4, batch_size=100)
+    item = load_all_data()[19]
+
+    worker_a.append("shared", {"role": "user", "content": "Do you have binders?"})
+    worker_a.append("shared", {"role": "assistant", "content": "Yes.", "context": {"current_item": item}})
+    # Buffered until a flush, but the writing worker reads its own writes
+    assert worker_b.get_history("shared") == []
+    assert worker_a.get_history("shared")[-1]["context"]["current_item"] == item
+    assert worker_b.get_history("shared")[-1]["content"] == "Yes."
+
+    for i in range(6):
+        worker_b.append("shared", {"role": "user", "content": str(i)})
+    worker_b.flush()
+    assert [entry["content"] for entry in worker_a.get_history("shared", 3)] == ["3", "4", "5"]
+    assert worker_a.compact() == 4
+    assert worker_a.stats()["entries"] == 4
+
+    worker_a.ttl = -1
+    assert worker_a.get_history("shared") == []
+    assert worker_a.sweep() == 1
+    assert worker_b.stats()["entries"] == 0
+
+
+if __name__ == "__main__":
+    test_aho_corasick_matches_substring_checks()
+    test_find_relevant_items_matches_scan()
+    test_build_prompt_matches_reference()
+    test_context_selection_is_relevant_and_budgeted()
+    test_handle_query_async_uses_model()
+    test_model_calls_are_bounded_and_time_out()
+    test_identical_model_calls_are_coalesced()
+    test_concurrent_identical_questions_share_one_model_call()
+    test_cancelled_streams_do_not_lower_the_limit()
+    test_adaptive_limiter_backs_off_and_sheds()
+    test_shed_queries_get_the_fallback_answer()
+    test_transient_errors_are_retried_with_backoff()
+    test_circuit_breaker_opens_and_recovers()
+    test_retries_and_hedging_bound_tail_latency()
+    test_blocking_client_does_not_stall_event_loop()
+    test_catalog_and_session_io_do_not_stall_event_loop()
+    test_abandoned_model_threads_keep_their_slot()
+    test_response_cache_lru_ttl_and_catalog_version()
+    test_repeated_questions_are_answered_from_cache()
+    test_structured_questions_take_the_fast_path()
+    test_fast_path_report_counts_intents()
+    test_reading_history_does_not_create_sessions()
+    test_session_store_expiry_and_eviction()
+    test_session_bytes_count_context_items()
+    test_sqlite_sessions_are_shared_batched_and_compacted()
+    print("✅ Agent tests passed")
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Add backend directory to path to allow importing modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import numpy
+from fastapi.testclient import TestClient
+
+import agent
+import file_loader
+import llm
+import main
+import pagination
+import serialization
+from fake_model import BlockingFakeModel, FakeModel
+from response_cache import response_cache
+from test_catalog import copy_items_file, use_items_file
+
+client = TestClient(main.app)
+
+
+def use_model(model):
+    """Swap agent.model for a stand-in, returning the previous model"""
+    original = agent.model
+    agent.model = model
+    response_cache.clear()
+    return original
+
+
+def read_events(response):
+    return [json.loads(line) for line in response.iter_lines() if line]
+
+
+def test_query_stream_sends_context_deltas_then_done():
+    for model in [FakeModel(reply=" Dura Binder costs $21.31 today."), BlockingFakeModel(reply="Dura Binder costs $21.31 today.")]:
+        original = use_model(model)
+        try:
+            with client.stream("POST", "/query/stream", json={"query": "Do you have any binders?", "session_id": "stream-test"}) as response:
+                assert response.status_code == 200
+                assert response.headers["content-type"].startswith("application/x-ndjson")
+                events = read_events(response)
+        finally:
+            use_model(original)
+
+        assert events[0]["type"] == "context"
+        assert any("Binder" in item["item_name"] for item in events[0]["items"])
+        deltas = [event["text"] for event in events if event["type"] == "delta"]
+        assert len(deltas) > 1
+        assert events[-1] == {"type": "done", "response": "Dura Binder costs $21.31 today."}
+        assert "".join(deltas) == events[-1]["response"]
+        assert agent.conversation_memory["stream-test"][-1]["content"] == events[-1]["response"]
+
+
+def test_query_stream_reports_model_errors():
+    original = use_model(FakeModel(error_rate=1.0))
+    try:
+        with client.stream("POST", "/query/stream", json={"query": "hello", "session_id": "stream-error"}) as response:
+            events = read_events(response)
+    finally:
+        use_model(original)
+    assert [event["type"] for event in events] == ["context", "error"]
+    assert "injected model error" in events[-1]["response"]
+
+
+def test_query_stream_events_are_valid_json():
+    # Empty spreadsheet cells are NaN, which must go out as null, not as a bare NaN
+    async def events(query, session_id="default"):
+        yield {"type": "context", "query": query, "items": [{"item_id": "SKU1", "price": float("nan"),
+                                                            "item_description": float("nan")}]}
+        yield {"type": "done", "response": "ok"}
+
+    original = main.stream_query_async
+    main.stream_query_async = events
+    try:
+        lines = client.post("/query/stream", json={"query": "hello"}).content.splitlines()
+    finally:
+        main.stream_query_async = original
+
+    def reject(constant):
+        raise ValueError(f"invalid JSON constant {constant}")
+
+    first = json.loads(lines[0], parse_constant=reject)
+    assert first["items"] == [{"item_id": "SKU1", "price": None, "item_description": None}]
+
+
+if __name__ == "__main__":
+    test_query_stream_sends_context_deltas_then_done()
+    test_query_stream_reports_model_errors()
+    test_query_stream_events_are_valid_json()
+    print("✅ API tests passed")
+
+
+def test_ready_once_catalog_is_indexed():
+    main.app.state.catalog_version = None
+    main.app.state.ready = False
+    assert client.get("/ready").status_code == 503
+
+    with TestClient(main.app) as started:
+        deadline = time.time() + 60
+        response = started.get("/ready")
+        while response.status_code == 503 and time.time() < deadline:
+            time.sleep(0.05)
+            response = started.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+    assert response.json()["catalog_version"] == file_loader.get_catalog_version()
+
+
+def test_importing_app_skips_heavy_modules():
+    check = "import sys, main; print(sorted(m for m in ('pandas', 'google.generativeai') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == "[]", result.stderr
+
+
+def walk_pages(request_page):
+    """Follow next_cursor until the last page; returns all items and the page count"""
+    items, cursor, pages = [], None, 0
+    while True:
+        body = request_page(cursor)
+        items += body["items"]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+
+def test_items_cursor_pagination_and_fields():
+    everything = client.get("/items").json()["items"]
+    items, pages = walk_pages(lambda cursor: client.get(
+        "/items", params={"limit": 7, "fields": "item_id,price", **({"cursor": cursor} if cursor else {})}).json())
+    assert items == [{"item_id": item["item_id"], "price": item["price"]} for item in everything]
+    assert pages == -(-len(everything) // 7)
+
+    search = {"search_query": "a", "sort_by": "price"}
+    expected = client.post("/items/search", json=search).json()["items"]
+    found, _ = walk_pages(lambda cursor: client.post(
+        "/items/search", json={**search, "limit": 6, "cursor": cursor}).json())
+    assert found == expected
+
+    first_page = client.post("/items/search", json={**search, "limit": 6}).json()
+    other_query = client.post("/items/search", json={"search_query": "b", "cursor": first_page["next_cursor"]})
+    assert other_query.status_code == 400
+    assert client.get("/items", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/items", params={"fields": "item_id,colour"}).status_code == 400
+
+
+def test_cursors_follow_catalog_content():
+    # Simulates restarted processes: the version counter starts again at 1 each time
+    path = copy_items_file()
+    original, counter = file_loader.ITEMS_FILE, file_loader._catalog_version
+    try:
+        use_items_file(path)
+        file_loader._catalog_version = 0
+        first_page = client.get("/items", params={"limit": 5}).json()
+        use_items_file(path)
+        file_loader._catalog_version = 0
+        second_page = client.get("/items", params={"cursor": first_page["next_cursor"], "limit": 5})
+        assert second_page.status_code == 200
+        assert second_page.json()["items"][0]["item_id"] != first_page["items"][0]["item_id"]
+
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        use_items_file(path)
+        file_loader._catalog_version = 0
+        stale = client.get("/items", params={"cursor": first_page["next_cursor"], "limit": 5})
+        assert stale.status_code == 400 and "catalog has changed" in stale.json()["error"]
+    finally:
+        file_loader._catalog_version = counter
+        use_items_file(original)
+
+
+def test_items_ndjson_stream():
+    everything = client.get("/items").json()["items"]
+    with client.stream("GET", "/items", params={"format": "ndjson"}) as response:
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert read_events(response) == everything
+
+    search = {"max_price": 100, "sort_by": "price", "fields": ["item_name"]}
+    expected = client.post("/items/search", json=search).json()["items"]
+    with client.stream("POST", "/items/search?format=ndjson", json=search) as response:
+        assert read_events(response) == expected
+
+
+def test_streamed_items_use_flat_memory():
+    template = dict(agent.load_all_data()[0])
+
+    def peak_memory(count, fmt):
+        catalog = [dict(template, item_id=f"SKU{i:07d}") for i in range(count)]
+        original = main.load_all_data
+        main.load_all_data = lambda: catalog
+        tracemalloc.start()
+        try:
+            if fmt == "ndjson":
+                async def drain():
+                    response = await main.get_all_items(format="ndjson", if_none_match=None)
+                    async for _ in response.body_iterator:
+                        pass
+                asyncio.run(drain())
+            else:
+                asyncio.run(main.get_all_items(if_none_match=None)).body
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            main.load_all_data = original
+
+    peak_memory(100, "json"), peak_memory(100, "ndjson")  # first-call imports and caches
+    # The whole-catalog JSON body grows with the catalog, the stream doesn't
+    assert peak_memory(50_000, "json") > 3 * peak_memory(5_000, "json")
+    assert peak_memory(50_000, "ndjson") < 1.5 * peak_memory(5_000, "ndjson")
+
+
+def test_item_json_is_encoded_once_per_version():
+    items = agent.load_all_data()
+    item_json = file_loader.get_item_json(items)
+    assert file_loader.get_item_json(items) is item_json
+    assert pagination.encode_items(items[:3], item_json=item_json) == [serialization.dumps(item) for item in items[:3]]
+    if isinstance(item_json, serialization.ItemJSONCache):
+        assert pagination.encode_items(items[:3], item_json=item_json)[0] is item_json.encoded[id(items[0])]
+    else:
+        # A compiled catalog's item JSON is read from the mapped file
+        assert item_json.encode(items[:1])[0] == item_json.catalog.item_json(0)
+
+    body = client.get(f"/items/{items[0]['item_id']}")
+    assert body.headers["content-type"] == "application/json"
+    assert body.json() == {"item": items[0]}
+    assert client.get("/items").content == serialization.splice_items(item_json.encode(items))
+
+    # Values pandas can produce: NaN for empty cells, NumPy scalars
+    odd = {"item_id": "SKU1", "price": float("nan"), "item_quantity": numpy.int64(3), "maximum_discount": numpy.float32(0.5)}
+    expected = {"item_id": "SKU1", "price": None, "item_quantity": 3, "maximum_discount": 0.5}
+    assert json.loads(serialization.dumps(odd)) == expected
+    assert json.loads(serialization.splice_items(pagination.encode_items([odd]), count=1)) == {"items": [expected], "count": 1}
+
+
+def test_conditional_get_on_catalog_endpoints():
+    first = client.get("/items", params={"limit": 5})
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == pagination.ITEMS_CACHE_CONTROL
+    revalidated = client.get("/items", params={"limit": 5}, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert revalidated.status_code == 304 and revalidated.content == b"" and revalidated.headers["etag"] == etag
+    other_page = client.get("/items", params={"limit": 6}, headers={"If-None-Match": etag})
+    assert other_page.status_code == 200 and other_page.headers["etag"] != etag
+
+    item_id = first.json()["items"][0]["item_id"]
+    item = client.get(f"/items/{item_id}")
+    item_tag = item.headers["etag"]
+    assert client.get(f"/items/{item_id}", headers={"If-None-Match": item_tag}).status_code == 304
+    assert client.get(f"/items/{first.json()['items'][1]['item_id']}", headers={"If-None-Match": item_tag}).status_code == 200
+
+    # A reloaded catalog invalidates listings; an unchanged item keeps its tag
+    original = file_loader.ITEMS_FILE
+    try:
+        use_items_file(copy_items_file())
+        reloaded = client.get("/items", params={"limit": 5}, headers={"If-None-Match": etag})
+        assert reloaded.status_code == 200 and reloaded.headers["etag"] != etag
+        assert client.get(f"/items/{item_id}", headers={"If-None-Match": item_tag}).status_code == 304
+    finally:
+        use_items_file(original)
+
+    # Tags don't depend on the per-process version counter: a restarted process
+    # (or another worker) serving a changed file gives a new tag, an unchanged one the same
+    path = copy_items_file()
+    counter = file_loader._catalog_version
+    try:
+        use_items_file(path)
+        file_loader._catalog_version = 0
+        before = client.get("/items", params={"limit": 5}).headers["etag"]
+        use_items_file(path)
+        file_loader._catalog_version = 0
+        assert client.get("/items", params={"limit": 5}, headers={"If-None-Match": before}).status_code == 304
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        use_items_file(path)
+        file_loader._catalog_version = 0
+        changed = client.get("/items", params={"limit": 5}, headers={"If-None-Match": before})
+        assert changed.status_code == 200 and changed.headers["etag"] != before
+    finally:
+        file_loader._catalog_version = counter
+        use_items_file(original)
+
+
+def test_query_batch_reports_each_element():
+    model = FakeModel(latency=0.05, reply="Here is what we have.")
+    original = use_model(model)
+    try:
+        queries = [{"query": f"Do you have any binders? ({i})", "session_id": f"batch-{i}"} for i in range(12)]
+        queries += [{"session_id": "batch-bad"}, "not an object",
+                    {"query": "x" * (main.MAX_QUERY_LENGTH + 1), "session_id": "batch-long"},
+                    {"query": "first question", "session_id": "batch-shared"},
+                    {"query": "second question", "session_id": "batch-shared"}]
+        body = client.post("/query/batch", json={"queries": queries}).json()
+    finally:
+        use_model(original)
+
+    results = body["results"]
+    assert body["count"] == len(queries) and body["errors"] == 3
+    assert all(result["ok"] and result["result"]["response"] == "Here is what we have." for result in results[:12])
+    assert [result["result"]["query"] for result in results[:12]] == [query["query"] for query in queries[:12]]
+    assert not results[12]["ok"] and "Invalid query" in results[12]["error"]
+    assert not results[13]["ok"]
+    assert not results[14]["ok"] and "Invalid query" in results[14]["error"]
+    assert client.post("/query", json={"query": "x" * (main.MAX_QUERY_LENGTH + 1)}).status_code == 422
+    # Sessions stay separate; queries of one session run in order
+    user_turns = [entry["content"] for entry in agent.get_conversation_history("batch-shared", 10)
+                  if entry["role"] == "user"]
+    assert user_turns == ["first question", "second question"]
+    assert [entry["content"] for entry in agent.get_conversation_history("batch-3", 10)
+            if entry["role"] == "user"] == [queries[3]["query"]]
+    assert 1 < model.max_in_flight <= agent.BATCH_CONCURRENCY
+
+
+def test_items_batch_resolves_ids_in_one_request():
+    items = agent.load_all_data()
+    ids = [items[2]["item_id"], "SKU-MISSING", f" {items[0]['item_id'].lower()} ", 42, items[2]["item_id"]]
+    body = client.post("/items/batch", json={"ids": ids}).json()
+    assert body["count"] == 5 and body["errors"] == 2
+    assert [result["id"] for result in body["results"]] == ids
+    assert [result["ok"] for result in body["results"]] == [True, False, True, False, True]
+    assert body["results"][0]["item"] == items[2] and body["results"][2]["item"] == items[0]
+    assert "not found" in body["results"][1]["error"] and "strings" in body["results"][3]["error"]
+
+    projected = client.post("/items/batch", json={"ids": ids[:1], "fields": ["price"]}).json()
+    assert projected["results"][0]["item"] == {"price": items[2]["price"]}
+    assert client.post("/items/batch", json={"ids": ids, "fields": ["colour"]}).status_code == 400
+    assert client.post("/items/batch", json={"ids": ["x"] * (main.MAX_BATCH_SIZE + 1)}).status_code == 400
+
+
+def test_shed_queries_get_429_when_rejecting():
+    original = use_model(FakeModel(latency=0.1))
+    settings = llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE
+    llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE = 1, 1
+    llm._slots = None
+    agent.OVERLOAD_RESPONSE = "reject"
+
+    async def send():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*[http.post("/query", json={"query": f"stapler {i}?", "session_id": f"429-{i}"})
+                                          for i in range(5)])
+
+    try:
+        responses = asyncio.run(send())
+        metrics = client.get("/metrics").json()
+    finally:
+        use_model(original)
+        llm.MAX_CONCURRENT_MODEL_CALLS, llm.MODEL_QUEUE_SIZE = settings
+        llm._slots = None
+        agent.OVERLOAD_RESPONSE = "fallback"
+    assert sorted(response.status_code for response in responses) == [200, 200, 429, 429, 429]
+    assert all(response.headers["retry-after"] == main.OVERLOAD_RETRY_AFTER
+               for response in responses if response.status_code == 429)
+    assert metrics["model_limiter"]["shed"] == 3
@@ -0,0 +1,394 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Add backend directory to path to allow importing modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import catalog_db
+import catalog_store
+import file_loader
+import serialization
+from matcher import QueryMatcher
+from search_engine import CatalogColumns, TextColumn, encode_text
+
+
+def use_items_file(path):
+    """Point the loader at another spreadsheet and drop the cached snapshot"""
+    file_loader.ITEMS_FILE = path
+    file_loader._catalog_snapshot = None
+
+
+def use_catalog_backend(backend, path):
+    """Switch the catalog backend and spreadsheet (and drop the cached catalog)"""
+    catalog_db.CATALOG_BACKEND = backend
+    use_items_file(path)
+
+
+def copy_items_file():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "Items.xlsx")
+    shutil.copy(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "Items.xlsx"), path)
+    return path
+
+
+def test_catalog_is_cached_until_file_changes():
+    path = copy_items_file()
+    original = file_loader.ITEMS_FILE
+    try:
+        use_items_file(path)
+        first = file_loader.get_catalog()
+        assert len(first) > 0
+        assert file_loader.get_catalog() is first
+        assert file_loader.load_all_data() is first.items
+
+        # Touch the file with a new mtime: a new snapshot and version is produced
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        second = file_loader.get_catalog()
+        assert second is not first
+        assert second.version > first.version
+        assert file_loader.get_catalog_version() == second.version
+    finally:
+        use_items_file(original)
+
+
+def test_snapshot_is_immutable():
+    snapshot = file_loader.get_catalog()
+    try:
+        snapshot.version = 0
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("snapshot attributes should be read-only")
+    try:
+        snapshot.items[0] = {}
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("snapshot items should be read-only")
+
+
+def test_missing_file_keeps_last_snapshot():
+    path = copy_items_file()
+    original = file_loader.ITEMS_FILE
+    try:
+        use_items_file(path)
+        snapshot = file_loader.get_catalog()
+        os.remove(path)
+        assert file_loader.get_catalog() is snapshot
+    finally:
+        use_items_file(original)
+
+
+def test_unreadable_file_is_parsed_once():
+    path = copy_items_file()
+    original, original_loader = file_loader.ITEMS_FILE, file_loader.load_items_data
+    parses = []
+
+    def counting_loader(items_file=None):
+        parses.append(items_file)
+        return original_loader(items_file)
+
+    try:
+        use_items_file(path)
+        snapshot = file_loader.get_catalog()
+        good = open(path, "rb").read()
+        file_loader.load_items_data = counting_loader
+        with open(path, "wb") as f:
+            f.write(b"not a spreadsheet")
+        for _ in range(20):
+            assert file_loader.get_catalog() is snapshot
+        assert len(parses) == 1
+
+        # Fixing the file reloads it
+        with open(path, "wb") as f:
+            f.write(good)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert file_loader.get_catalog() is not snapshot
+        assert len(parses) == 2
+    finally:
+        file_loader.load_items_data = original_loader
+        use_items_file(original)
+
+
+SEARCH_CASES = [
+    {},
+    {"search_query": "binder"},
+    {"search_query": "HEAVY duty"},
+    {"search_query": "no such thing"},
+    {"search_query": "pen"},
+    {"search_query": "a"},
+    {"search_query": "vy du"},
+    {"search_query": " - "},
+    {"search_query": "for everyday use."},
+    {"search_query": "chef's"},
+    {"min_price": 20, "max_price": 100},
+    {"max_price": 50, "sort_by": "price"},
+    {"search_query": "yoga", "sort_by": "item_name"},
+    {"min_price": 100, "sort_by": "item_quantity"},
+    {"sort_by": "unknown"},
+]
+
+
+def test_columnar_search_matches_list_scan():
+    items = file_loader.load_all_data()
+    for case in SEARCH_CASES:
+        expected = file_loader.search_items(list(items), **case)
+        assert file_loader.search_items(items, **case) == expected, case
+
+
+def test_text_index_matches_substring_scan():
+    items = list(file_loader.load_all_data())
+    columns = CatalogColumns(items)
+    words = {word.lower() for item in items for word in item["item_name"].split()}
+    queries = words | {word[1:-1] for word in words} | {"heavy duty", "ty. a h", "-", "'", "zzz"}
+    for query in queries:
+        assert columns.search(search_query=query) == file_loader.search_items(items, search_query=query), query
+
+
+def test_text_column_is_sized_by_its_text():
+    texts = ["ab", "", "bab", "été café", "x" * 5000, "ba"]
+    offsets, blob = encode_text(texts)
+    column = TextColumn(blob, offsets)
+    for needle in ["ab", "ba", "b", "bab", "abb", "é", "café", "xx", "x" * 5001, "zz"]:
+        expected = [row for row, text in enumerate(texts) if needle in text]
+        encoded = needle.encode("utf-8")
+        assert column.scan(encoded).tolist() == expected, needle
+        assert column.contains(encoded, np.arange(len(texts))).tolist() == expected, needle
+
+    # One long description costs its own length, not the longest row times the row count
+    items = [{"item_name": f"Item {i}", "item_description": "Short.", "price": 1.0} for i in range(1000)]
+    items[0]["item_description"] = "Long. " * 1000
+    text = CatalogColumns(items).text
+    assert len(text.blob) < 6000 + 1000 * 20
+
+
+def test_columnar_search_limit_keeps_order():
+    # Duplicate every item so ties straddle the cutoff
+    items = list(file_loader.load_all_data()) * 3
+    columns = CatalogColumns(items)
+    for sort_by in ["price", "item_name", "item_quantity"]:
+        expected = file_loader.search_items(items, sort_by=sort_by)
+        assert columns.search(sort_by=sort_by) == expected
+        for limit in [0, 1, 5, 7, 299, 1000]:
+            assert columns.search(sort_by=sort_by, limit=limit) == expected[:limit]
+            assert columns.search(sort_by=sort_by, limit=limit, offset=7) == expected[7:7 + limit]
+
+
+def test_item_lookup_by_id():
+    items = file_loader.load_all_data()
+    first = items[0]
+    # Items of a compiled catalog are built on access: equal, not identical
+    assert file_loader.get_item_by_id(items, first["item_id"]) == first
+    assert file_loader.get_item_by_id(items, f"  {first['item_id'].lower()} ") == first
+    assert file_loader.get_item_by_id(list(items), first["item_id"].lower()) == first
+    assert file_loader.get_item_by_id(items, "SKU0000000") is None
+
+    ids = [items[3]["item_id"], "missing", items[1]["item_id"].lower()]
+    assert file_loader.get_items_by_ids(items, ids) == [items[3], None, items[1]]
+    assert file_loader.get_items_by_ids(list(items), ids) == [items[3], None, items[1]]
+
+
+def test_price_index_range_and_top_k():
+    items = file_loader.load_all_data()
+    for case in [{}, {"max_price": 50}, {"min_price": 20, "max_price": 100}, {"min_price": 1000}]:
+        expected = file_loader.search_items(list(items), sort_by="price", **case)
+        assert file_loader.search_items(items, sort_by="price", **case) == expected
+        assert file_loader.search_items(items, sort_by="price", limit=5, **case) == expected[:5]
+        assert file_loader.search_items(items, limit=3, **case) == file_loader.search_items(list(items), **case)[:3]
+
+    # Duplicated rows give ties in every field, which must keep catalog order
+    duplicated = list(items) * 2
+    columns = CatalogColumns(duplicated)
+    for field in ["price", "item_quantity", "maximum_discount"]:
+        values = sorted(item[field] for item in items)
+        low, high = values[10], values[60]
+        for descending in [False, True]:
+            expected = file_loader.find_items_in_range(duplicated, field, low, high, descending=descending)
+            assert columns.range(field, low, high, descending=descending) == expected
+            assert columns.range(field, low, high, limit=7, descending=descending) == expected[:7]
+            assert columns.range(field, maximum=low, descending=descending) == \
+                file_loader.find_items_in_range(duplicated, field, maximum=low, descending=descending)
+
+
+def test_compiled_catalog_is_reused_and_regenerated():
+    path = copy_items_file()
+    compiled_file = catalog_store.compiled_path(path)
+    original = file_loader.ITEMS_FILE
+    try:
+        use_items_file(path)
+        parsed = file_loader.load_items_data(path)
+        first = file_loader.get_catalog()
+        assert os.path.exists(compiled_file)
+        assert list(first.items) == parsed
+
+        # A fresh process maps the compiled file instead of parsing the spreadsheet
+        use_items_file(path)
+        second = file_loader.get_catalog()
+        assert list(second.items) == parsed
+        assert second.compiled.source_signature == first.compiled.source_signature
+        assert not second.compiled.search_text().offsets.flags.writeable
+
+        # A newer spreadsheet is compiled again
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        third = file_loader.get_catalog()
+        assert third.compiled.source_signature == (stat.st_mtime_ns + 1_000_000_000, stat.st_size)
+
+        # So is a damaged one
+        with open(compiled_file, "wb") as f:
+            f.write(b"garbage")
+        use_items_file(path)
+        assert list(file_loader.get_catalog().items) == parsed
+        assert file_loader.get_catalog().compiled is not None
+    finally:
+        use_items_file(original)
+
+
+def test_compiled_columns_match_built_columns():
+    path = copy_items_file()
+    items = file_loader.load_items_data(path)
+    items.append({"item_id": "SKU9999999", "item_name": "Été Notebook", "item_description": float("nan"),
+                  "item_quantity": 3, "price": 12.5, "maximum_discount": 0.1})
+    compiled_file = catalog_store.compiled_path(path)
+    catalog_store.write_compiled_catalog(compiled_file, items, (1, 2))
+    compiled = catalog_store.CompiledCatalog(compiled_file)
+
+    loaded = compiled.items()
+    assert loaded[:-1] == items[:-1]
+    assert loaded[-1]["item_name"] == "Été Notebook" and loaded[-1]["item_description"] != loaded[-1]["item_description"]
+
+    built, mapped = CatalogColumns(items), CatalogColumns(items, compiled)
+    for case in SEARCH_CASES + [{"search_query": "été"}]:
+        assert mapped.search(**case) == built.search(**case), case
+        assert mapped.search(limit=5, **case) == built.search(limit=5, **case), case
+    assert mapped.search(sort_by="item_name") == built.search(sort_by="item_name")
+
+    # ID lookups, item JSON and item name matches come from the file too
+    ids = compiled.id_index()
+    built_ids = file_loader.build_item_index(items)
+    for item in items[:10] + [items[-1]]:
+        key = file_loader.normalize_item_id(item["item_id"])
+        assert serialization.dumps(ids.get(key)) == serialization.dumps(built_ids[key])
+    assert ids.get("SKU0000000") is None
+    assert catalog_store.MappedItemJSON(compiled).encode(loaded[:5]) == [serialization.dumps(item) for item in items[:5]]
+    names = QueryMatcher(items, [])
+    mapped_names = QueryMatcher(loaded, [], compiled.distinct_names())
+    for query in [f"how much is the {item['item_name'].lower()}?" for item in items[::7]] + ["été notebook", "nothing"]:
+        assert serialization.dumps(mapped_names.match(query)[1]) == serialization.dumps(names.match(query)[1]), query
+
+    # Names are matched with one scan of the query, even the longest query the API accepts (MAX_QUERY_LENGTH)
+    query = ("is the " + " ".join(item["item_name"].lower() for item in items))[:2000]
+    start = time.perf_counter()
+    for _ in range(10):
+        mapped_names.match(query)
+    assert (time.perf_counter() - start) / 10 < 0.01
+
+
+def test_compiled_catalog_memory_is_flat():
+    # Per-process memory of a compiled catalog (searching, ID lookups, item
+    # JSON, name matches) must not grow with the number of items
+    def resident(count):
+        items = [{"item_id": f"SKU{i:07d}", "item_name": f"Item {i % 50}", "item_description": "A sturdy thing",
+                  "item_quantity": i % 7, "price": float(i % 100), "maximum_discount": 0.1} for i in range(count)]
+        path = os.path.join(tempfile.mkdtemp(), "Items.catalog")
+        catalog_store.write_compiled_catalog(path, items, (1, 2))
+        del items
+        tracemalloc.start()
+        compiled = catalog_store.CompiledCatalog(path)
+        columns = CatalogColumns(compiled.items(), compiled)
+        columns.search(search_query="sturdy", sort_by="price", limit=10)
+        columns.search(search_query="item 4", limit=10)
+        compiled.id_index().get("SKU0000042")
+        catalog_store.MappedItemJSON(compiled).encode(columns.rows(np.arange(10)))
+        QueryMatcher(compiled.items(), [], compiled.distinct_names()).match("price of the item 7")
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    resident(1_000)  # Lazy imports and caches of the first run
+    small, large = resident(10_000), resident(100_000)
+    assert large < small * 2 + 100_000, (small, large)
+
+
+def test_sqlite_catalog_matches_memory_catalog():
+    path = copy_items_file()
+    original = file_loader.ITEMS_FILE
+    try:
+        use_catalog_backend("sqlite", path)
+        database = file_loader.load_all_data()
+        assert isinstance(database, catalog_db.CatalogDatabase)
+        assert os.path.exists(catalog_db.database_path(path, file_loader._stat_items_file(path)))
+        items = file_loader.load_items_data(path)
+        assert len(database) == len(items)
+        assert list(database) == items
+        assert database[3] == items[3] and database[-1] == items[-1] and database[:5] == items[:5]
+
+        words = {word.lower() for item in items for word in item["item_name"].split()}
+        cases = SEARCH_CASES + [{"search_query": query} for query in words | {word[:2] for word in words}]
+        for case in cases:
+            expected = file_loader.search_items(items, **case)
+            assert file_loader.search_items(database, **case) == expected, case
+            assert file_loader.search_items(database, limit=4, **case) == expected[:4], case
+            assert file_loader.search_items(database, limit=4, offset=3, **case) == expected[3:7], case
+
+        for field in ["price", "item_quantity", "maximum_discount"]:
+            values = sorted(item[field] for item in items)
+            for descending in [False, True]:
+                expected = file_loader.find_items_in_range(items, field, values[10], values[60], descending=descending)
+                assert file_loader.find_items_in_range(database, field, values[10], values[60],
+                                                       descending=descending) == expected
+
+        first = items[0]
+        assert file_loader.get_item_by_id(database, f" {first['item_id'].lower()} ") == first
+        assert file_loader.get_item_by_id(database, "SKU0000000") is None
+        ids = [items[3]["item_id"], "missing", items[1]["item_id"].lower(), items[3]["item_id"]]
+        assert file_loader.get_items_by_ids(database, ids) == [items[3], None, items[1], items[3]]
+
+        # The database is kept until the spreadsheet changes, then ingested again
+        # in the background while the old one is still served
+        use_catalog_backend("sqlite", path)
+        reopened = file_loader.get_catalog()
+        assert file_loader.get_catalog() is reopened
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert file_loader.get_catalog() is reopened
+        file_loader._ingest_thread.join()
+        reingested = file_loader.get_catalog()
+        assert reingested.version > reopened.version
+        # Into a file of its own: the old database was never replaced under its readers
+        assert reingested.db_path != reopened.db_path and reopened[:5] == items[:5]
+        assert catalog_db.database_files(path) == [reingested.db_path, reopened.db_path]
+        # The next change removes the database that went out of service before
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+        file_loader.get_catalog()
+        file_loader._ingest_thread.join()
+        assert catalog_db.database_files(path) == [file_loader.get_catalog().db_path, reingested.db_path]
+        assert reingested.mtime == stat.st_mtime_ns + 1_000_000_000
+    finally:
+        use_catalog_backend("memory", original)
+
+
+if __name__ == "__main__":
+    test_catalog_is_cached_until_file_changes()
+    test_snapshot_is_immutable()
+    test_missing_file_keeps_last_snapshot()
+    test_unreadable_file_is_parsed_once()
+    test_columnar_search_matches_list_scan()
+    test_text_index_matches_substring_scan()
+    test_text_column_is_sized_by_its_text()
+    test_columnar_search_limit_keeps_order()
+    test_item_lookup_by_id()
+    test_price_index_range_and_top_k()
+    test_compiled_catalog_is_reused_and_regenerated()
+    test_compiled_columns_match_built_columns()
+    test_compiled_catalog_memory_is_flat()
+    test_sqlite_catalog_matches_memory_catalog()
+    print("✅ Catalog tests passed")
@@ -0,0 +1,132 @@
+import re
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+')
+NGRAM_SIZE = 3
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    """Return the set of character n-grams of text"""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class PostingLists:
+    """
+    Read-only sequence of posting lists stored back to back in one array
+    (data[offsets[i]:offsets[i + 1]] holds the rows of token i); items are views
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, token_id):
+        return self.data[self.offsets[token_id]:self.offsets[token_id + 1]]
+
+
+class TextIndex:
+    """
+    Inverted index over lowercased item name and description text.
+
+    Rows are indexed by word token (token -> sorted row positions), and the
+    token vocabulary is indexed by character trigrams so tokens containing a
+    substring can be found without scanning every row.
+
+    A substring query is split into its word pieces; every row that contains
+    the query must contain each piece inside one of its tokens, so the
+    intersection of the pieces' posting lists is a superset of the matches.
+    Callers verify the (small) candidate set against the full text to get
+    exactly the same results as a substring scan.
+    """
+
+    def __init__(self, texts):
+        # Catalog text repeats a lot (variants, boilerplate descriptions), so
+        # each distinct text is tokenized only once
+        rows_by_text = {}
+        for row, text in enumerate(texts):
+            rows_by_text.setdefault(text, []).append(row)
+
+        postings = {}
+        for text, rows in rows_by_text.items():
+            for token in set(TOKEN_PATTERN.findall(text)):
+                postings.setdefault(token, []).extend(rows)
+
+        self.size = len(texts)
+        self.vocabulary = list(postings)
+        self.postings = [np.sort(np.array(postings[token], dtype=np.int64)) for token in self.vocabulary]
+        self.index_vocabulary()
+
+    @classmethod
+    def from_postings(cls, vocabulary, postings, size):
+        """
+        Rebuild an index from its token vocabulary and posting lists (as
+        stored in a compiled catalog), without tokenizing any text
+
+        Parameters:
+        - vocabulary: List of tokens
+        - postings: Sequence of sorted row position arrays, one per token
+        - size: Number of rows
+        """
+        index = cls.__new__(cls)
+        index.size = size
+        index.vocabulary = vocabulary
+        index.postings = postings
+        index.index_vocabulary()
+        return index
+
+    def index_vocabulary(self):
+        """Index the vocabulary by character trigrams"""
+        self.token_ngrams = {}
+        for token_id, token in enumerate(self.vocabulary):
+            for gram in ngrams(token):
+                self.token_ngrams.setdefault(gram, []).append(token_id)
+
+    def tokens_containing(self, piece):
+        """
+        Return the IDs of vocabulary tokens that contain piece
+        """
+        if len(piece) < NGRAM_SIZE:
+            return [token_id for token_id, token in enumerate(self.vocabulary) if piece in token]
+
+        candidates = None
+        for gram in ngrams(piece):
+            token_ids = self.token_ngrams.get(gram)
+            if not token_ids:
+                return []
+            candidates = set(token_ids) if candidates is None else candidates.intersection(token_ids)
+        return [token_id for token_id in candidates if piece in self.vocabulary[token_id]]
+
+    def rows_containing(self, piece):
+        """
+        Return the sorted positions of rows with a token containing piece
+        """
+        token_ids = self.tokens_containing(piece)
+        if not token_ids:
+            return np.zeros(0, dtype=np.int64)
+        if len(token_ids) == 1:
+            return self.postings[token_ids[0]]
+        return np.unique(np.concatenate([self.postings[token_id] for token_id in token_ids]))
+
+    def candidates(self, query):
+        """
+        Return sorted row positions that may contain the lowercased query
+
+        Returns None when the query has no word characters, in which case the
+        index can't narrow the search down.
+        """
+        pieces = set(TOKEN_PATTERN.findall(query))
+        if not pieces:
+            return None
+
+        # Start with the most selective piece, longer pieces tend to match fewer tokens
+        rows = None
+        for piece in sorted(pieces, key=len, reverse=True):
+            piece_rows = self.rows_containing(piece)
+            rows = piece_rows if rows is None else np.intersect1d(rows, piece_rows, assume_unique=True)
+            if not len(rows):
+                break
+        return rows